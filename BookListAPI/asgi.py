@@ -0,0 +1,61 @@
+"""
+ASGI config for BookListAPI project.
+
+It exposes the ASGI callable as a module-level variable named ``application``, run it with e.g.:
+    uvicorn BookListAPI.asgi:application
+    gunicorn BookListAPI.asgi:application -k uvicorn.workers.UvicornWorker
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BookListAPI.settings')
+os.environ.setdefault('DJANGO_ROOT_URLCONF', 'BookListAPI.asgi_urls')  # the async versions of the read endpoints
+
+STREAM_END = object()
+
+
+class BookListASGIHandler(ASGIHandler):
+    """
+    Django 3.2 iterates streaming responses inside the event loop, where the database can't be used,
+    so e.g. an account statement (which reads its rows while it's being sent) would fail.
+    Here every chunk is produced in Django's synchronous thread, where the view has opened the iterator.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            response_headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            response_headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': response_headers})
+        parts = iter(response)
+        next_part = sync_to_async(next, thread_sensitive=True)
+        while True:
+            part = await next_part(parts, STREAM_END)
+            if part is STREAM_END:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def get_asgi_application():
+    import django
+    django.setup(set_prefix=False)
+    return BookListASGIHandler()
+
+
+application = get_asgi_application()
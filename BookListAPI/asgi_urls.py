@@ -0,0 +1,16 @@
+"""BookListAPI URL Configuration under ASGI
+
+The read-only endpoints are served by their async versions from tasks.async_views,
+everything else is the same as in BookListAPI.urls.
+"""
+from django.urls import path
+from rest_framework.urlpatterns import format_suffix_patterns
+
+from BookListAPI import urls
+from tasks import async_views
+
+urlpatterns = format_suffix_patterns([
+    path('', async_views.api_root),
+    path('books/', async_views.book_list, name='book-list'),
+    path('accounts/', async_views.account_list, name='accounts-list'),
+]) + urls.urlpatterns
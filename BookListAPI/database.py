@@ -0,0 +1,31 @@
+"""
+Database performance profiles, picked with the DATABASE_PROFILE environment variable:
+    default      a new connection per request, the databases as they come
+    performance  persistent connections, checked before every request reuses them, and on SQLite
+                 the write-ahead log and the pragmas below, set on every new connection (see tasks.signals)
+The profile is applied at the very end of the settings, after django_heroku has put its DATABASES in place.
+"""
+from django.core.exceptions import ImproperlyConfigured
+
+PROFILES = ('default', 'performance')
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # readers don't wait for the writer, nor the writer for them
+    'busy_timeout': 5000,  # in ms, how long a writer waits for another worker's write instead of failing
+    'synchronous': 'NORMAL',  # with WAL the database can't be corrupted, a power cut may lose the last commits
+    'cache_size': -65536,  # in KiB, 64 MB of pages per connection instead of 2 MB
+}
+
+
+def apply_database_profile(databases, profile, conn_max_age=600):
+    if profile not in PROFILES:
+        raise ImproperlyConfigured(f'DATABASE_PROFILE has to be one of: {", ".join(PROFILES)}')
+    if profile == 'default':
+        return
+    for database in databases.values():
+        database['CONN_MAX_AGE'] = conn_max_age  # in seconds
+        # as the setting of Django 4.1, which is read by tasks.signals until then
+        database['CONN_HEALTH_CHECKS'] = True
+        if database['ENGINE'] == 'django.db.backends.sqlite3':
+            # not in OPTIONS, which are handed over to sqlite3.connect()
+            database['PRAGMAS'] = dict(SQLITE_PRAGMAS, **database.get('PRAGMAS', {}))
@@ -0,0 +1,41 @@
+"""
+Settings profiles of the web workers, picked with the SETTINGS_PROFILE environment variable:
+    full  everything: the admin, the browsable API, the static files served by WhiteNoise, set up by django_heroku
+    api   the workers which only serve the API to its clients: no admin, messages, static files nor django_heroku
+          (which imports Django's test runner), so a worker starts faster and takes less memory.
+          The browsable API and the login page still work, without their CSS.
+The profile is applied at the end of the settings, before the database profile.
+"""
+import os
+
+import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
+
+PROFILES = ('full', 'api')
+
+API_ONLY_DROPPED_APPS = ('django.contrib.admin', 'django.contrib.messages', 'django.contrib.staticfiles')
+API_ONLY_DROPPED_MIDDLEWARE = ('tasks.middleware.MessageMiddleware',
+                               'django.middleware.clickjacking.XFrameOptionsMiddleware',  # no HTML to frame
+                               'tasks.middleware.WhiteNoiseMiddleware')
+API_ONLY_DROPPED_CONTEXT_PROCESSORS = ('django.contrib.messages.context_processors.messages',)
+
+
+def apply_settings_profile(settings, profile):
+    """
+    Adapts the settings, the globals of BookListAPI.settings, to the profile.
+    """
+    if profile not in PROFILES:
+        raise ImproperlyConfigured(f'SETTINGS_PROFILE has to be one of: {", ".join(PROFILES)}')
+    if profile == 'full':
+        return
+    settings['INSTALLED_APPS'] = [app for app in settings['INSTALLED_APPS'] if app not in API_ONLY_DROPPED_APPS]
+    settings['MIDDLEWARE'] = [middleware for middleware in settings['MIDDLEWARE']
+                              if middleware not in API_ONLY_DROPPED_MIDDLEWARE]
+    for template in settings['TEMPLATES']:
+        options = template.setdefault('OPTIONS', {})
+        options['context_processors'] = [processor for processor in options.get('context_processors', [])
+                                         if processor not in API_ONLY_DROPPED_CONTEXT_PROCESSORS]
+    # what django_heroku would have set up and the API needs
+    settings['ALLOWED_HOSTS'] = ['*']
+    if 'DATABASE_URL' in os.environ:
+        settings['DATABASES']['default'] = dj_database_url.config(conn_max_age=600, ssl_require=True)
@@ -13,10 +13,12 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path, include
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('', include('tasks.urls')),
 ]
+if apps.is_installed('django.contrib.admin'):  # not in the API-only profile, see BookListAPI/profiles.py
+    from django.contrib import admin
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
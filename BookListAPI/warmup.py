@@ -0,0 +1,75 @@
+"""
+Warms the web workers up before their first request, called by the hooks of gunicorn.conf.py. With preload_app
+the master runs prime() once, before the workers are forked, so every worker starts with the URL resolvers,
+the fields of the serializers and the model metadata in memory (shared with the master until written to).
+connect_databases() runs in every worker, connections can't be shared by processes.
+"""
+import os
+from inspect import isclass
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.urls import URLResolver, get_resolver, reverse
+from rest_framework.settings import api_settings
+
+
+def iterate_patterns(patterns, namespace=''):
+    # every URL pattern, with its name as reverse() takes it
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from iterate_patterns(pattern.url_patterns,
+                                        f'{namespace}{pattern.namespace}:' if pattern.namespace else namespace)
+        else:
+            yield f'{namespace}{pattern.name}' if pattern.name else None, pattern
+
+
+def prime():
+    # the app has to be loaded by then, without preload_app the master only runs clear_metrics()
+    from rest_framework import serializers
+    from tasks import serializers as tasks_serializers
+    from tasks.encoders import RowEncoder
+    from tasks.middleware import view_name
+    from tasks.views import FastListMixin
+
+    for model in apps.get_models():
+        model._meta.get_fields()  # the relation tree of all the models is built by the first call
+    for name in api_settings.import_strings:  # REST framework imports its default classes when first asked
+        getattr(api_settings, name)
+
+    view_classes = set()
+    for name, pattern in iterate_patterns(get_resolver().url_patterns):
+        # the paths without parameters are resolved once, for tasks.middleware.view_name()
+        if name and not pattern.pattern.regex.groups:
+            view_name(reverse(name))
+        # REST framework's as_view() keeps the class as cls, Django's as view_class
+        view_class = getattr(pattern.callback, 'cls', getattr(pattern.callback, 'view_class', None))
+        if view_class is not None:
+            view_classes.add(view_class)
+    for view_class in view_classes:
+        if issubclass(view_class, FastListMixin):  # the row encoder of the whole rows, built by the first request
+            view_class.row_encoders[view_class.serializer_class, None] = RowEncoder(view_class.serializer_class)
+
+    for serializer_class in vars(tasks_serializers).values():
+        if isclass(serializer_class) and issubclass(serializer_class, serializers.Serializer) and \
+                serializer_class.__module__ == tasks_serializers.__name__ and \
+                (hasattr(serializer_class, 'Meta') or not issubclass(serializer_class, serializers.ModelSerializer)):
+            serializer_class().fields  # the fields the ModelSerializers build from their model
+    connections.close_all()  # nothing above should have connected, but the workers mustn't share a connection
+
+
+def connect_databases():
+    # only the persistent ones, a connection closed at the end of every request would be closed by the first one
+    # (the sync workers serve the requests in their main thread, which runs this)
+    for connection in connections.all():
+        if connection.settings_dict['CONN_MAX_AGE']:
+            connection.ensure_connection()
+
+
+def clear_metrics():
+    # the files of the workers of the previous run, see tasks.metrics
+    if not settings.METRICS_DIR or not os.path.isdir(settings.METRICS_DIR):
+        return
+    for name in os.listdir(settings.METRICS_DIR):
+        if name.endswith('.json'):
+            os.remove(os.path.join(settings.METRICS_DIR, name))
@@ -0,0 +1,29 @@
+"""
+Settings of gunicorn, which reads this file from the working directory, e.g. with the Procfile's
+    gunicorn BookListAPI.wsgi
+and for the workers only serving the API, see BookListAPI/profiles.py:
+    SETTINGS_PROFILE=api gunicorn BookListAPI.wsgi
+The app is loaded and warmed up once, in the master, and the workers are forked with it ready, so a new worker
+(e.g. when scaling up, or replacing one which has exited) answers its first request as fast as the following ones.
+The number of workers is read by gunicorn from WEB_CONCURRENCY, as set by Heroku.
+"""
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BookListAPI.settings')
+
+preload_app = True
+
+
+def when_ready(server):
+    # in the master, once the app is loaded and before the workers are forked
+    from BookListAPI.warmup import clear_metrics, prime
+    clear_metrics()
+    if server.cfg.preload_app:
+        prime()
+
+
+def post_worker_init(worker):
+    from BookListAPI.warmup import connect_databases, prime
+    if not worker.cfg.preload_app:  # e.g. with --reload, every worker loads the app itself
+        prime()
+    connect_databases()
@@ -0,0 +1,43 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from rest_framework import permissions
+
+from tasks import views
+
+
+def run_in_thread_pool(view):
+    """
+    Async version of a view, served under ASGI (see BookListAPI.asgi).
+    Django runs synchronous views under ASGI one at a time, in a single thread. Reads are independent of each other,
+    so here the whole view, with its ORM queries and rendering, runs in the thread pool of sync_to_async instead,
+    and slow reads of many clients no longer wait for each other. Every thread uses its own database connection,
+    which is closed at the end of the request just like the request_finished signal does in a synchronous view.
+    Requests which write are still handed to Django's single thread, as in a synchronous view.
+    """
+
+    def call_view(request, *args, **kwargs):
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()  # the rendering is CPU work, it's kept out of the event loop as well
+            return response
+        finally:
+            close_old_connections()
+
+    read = sync_to_async(call_view, thread_sensitive=False)
+    write = sync_to_async(view, thread_sensitive=True)
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        if request.method in permissions.SAFE_METHODS:
+            return await read(request, *args, **kwargs)
+        return await write(request, *args, **kwargs)
+
+    return async_view
+
+
+api_root = run_in_thread_pool(views.api_root)
+book_list = run_in_thread_pool(views.BookList.as_view())
+account_list = run_in_thread_pool(views.AccountList.as_view())
@@ -0,0 +1,62 @@
+"""
+Token authentication for the API clients, "Authorization: Token <key>" with the tokens of REST framework's authtoken
+app (python manage.py drf_create_token <username>). The token, its user and the user's account are read with a single
+query and kept in the shared cache for API_TOKEN_CACHE_TIMEOUT seconds, so an authenticated request usually costs
+no query at all, where a session costs one for the session and one for the user. A deleted token (revoked in the
+admin, or replaced with drf_create_token -r) and a changed user or account are evicted at once, see tasks.signals.
+Such requests skip the session altogether, see tasks.middleware.SessionMiddleware.
+"""
+from collections import namedtuple
+from hashlib import blake2b
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+# what REST framework hands to the view as request.auth
+TokenCredentials = namedtuple('TokenCredentials', ['key', 'account_id'])
+USER_FIELDS = ('id', 'username', 'is_active', 'is_staff', 'is_superuser')
+
+
+def token_cache_key(key):
+    # hashed, the tokens themselves never end up in the cache
+    return f'api-token:{blake2b(key.encode(), digest_size=16).hexdigest()}'
+
+
+def evict_tokens(keys):
+    # right away and again once the change is committed, in between other requests may cache the old rows again
+    cache_keys = [token_cache_key(key) for key in keys]
+    cache.delete_many(cache_keys)
+    transaction.on_commit(lambda: cache.delete_many(cache_keys))
+
+
+def evict_tokens_of_user(user_id):
+    evict_tokens(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+
+
+def is_token_request(request):
+    return request.META.get('HTTP_AUTHORIZATION', '').startswith(f'{CachedTokenAuthentication.keyword} ')
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        credentials = cache.get(cache_key)
+        if credentials is None:
+            credentials = Token.objects.filter(key=key).values_list(
+                *(f'user__{field}' for field in USER_FIELDS), 'user__accounts__id').first()
+            if credentials is None:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            cache.set(cache_key, credentials, settings.API_TOKEN_CACHE_TIMEOUT)
+        *user_fields, account_id = credentials
+        # the user as it was when cached, without e.g. its password, only read by the views, never saved
+        user = User(**dict(zip(USER_FIELDS, user_fields)))
+        user._state.adding = False
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return user, TokenCredentials(key, account_id)
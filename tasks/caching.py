@@ -0,0 +1,75 @@
+import time
+from functools import wraps
+from hashlib import sha1
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+# the version lives in the shared cache, so a book saved in one gunicorn worker invalidates the others as well
+CATALOGUE_VERSION_KEY = 'catalogue-version'
+CATALOGUE_RESPONSE_KEY = 'catalogue-response:{}'
+
+
+def get_catalogue_version():
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:  # first request, or the cache was cleared
+        cache.add(CATALOGUE_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOGUE_VERSION_KEY)
+    return version
+
+
+def bump_catalogue_version():
+    # a fresh timestamp instead of cache.incr(), which is a non-atomic read and write on some backends
+    # and could hand the same version to two different catalogues
+    cache.set(CATALOGUE_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def catalogue_etag(request, version):
+    # the response only depends on the catalogue, the URL and the negotiated format. The URL is the absolute one,
+    # with the scheme and the host, since the pagination and the hyperlinks are rendered with them
+    key = f"{version}|{request.build_absolute_uri()}|{request.META.get('HTTP_ACCEPT', '')}"
+    return '"{}"'.format(sha1(key.encode('utf-8')).hexdigest())
+
+
+def catalogue_cache(view):
+    """
+    Caches rendered GET responses of views which only depend on the Book table, under a key derived
+    from the catalogue version. The version changes whenever a book is saved or deleted (see tasks.signals),
+    so nothing has to be evicted. Every response carries a strong ETag and a matching If-None-Match
+    is answered with 304 Not Modified without calling the view at all.
+    The browsable API is never cached, since its HTML shows who is logged in.
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        etag = catalogue_etag(request, get_catalogue_version())
+        # the weak comparison of If-None-Match, a compressed response carries the weak version of the ETag
+        if etag in (tag[2:] if tag.startswith('W/') else tag
+                    for tag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            patch_vary_headers(response, ['Accept', 'Accept-Encoding'])
+            return response
+
+        cached = cache.get(CATALOGUE_RESPONSE_KEY.format(etag))
+        if cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            response = view(request, *args, **kwargs)
+            renderer = getattr(response, 'accepted_renderer', None)
+            if response.status_code != 200 or renderer is None or renderer.format == 'api':
+                return response
+            response.render()
+            cache.set(CATALOGUE_RESPONSE_KEY.format(etag), (response.content, response['Content-Type']),
+                      timeout=settings.CATALOGUE_CACHE_TIMEOUT)
+        response['ETag'] = etag
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    return wrapper
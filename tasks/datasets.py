@@ -0,0 +1,140 @@
+"""
+Generation of the synthetic dataset of the generate_dataset command. Nothing here touches Django or the database,
+so the chunks can be generated by worker processes (started in any way) while the command writes the previous ones.
+Every chunk is generated from its own random generator, seeded with the seed of the dataset and the number of
+the chunk, so the dataset is the same whatever the number of workers and the order they finish in.
+"""
+import random
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pa', 'qu', 'dor', 'fen', 'gal', 'hum']
+WORDS = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+CART_SIZES = (1, 2, 3, 4, 5)
+CART_SIZE_WEIGHTS = list(accumulate((45, 25, 15, 10, 5)))  # most carts hold a single book
+EPOCH = datetime(2020, 1, 1)  # in UTC
+
+
+class DatasetPlan:
+    """
+    How many rows of every kind each account gets and which ids they start from. The ids are assigned up front,
+    so every chunk can be generated independently and the rows can reference each other without a read back.
+    """
+
+    def __init__(self, seed, users, operations, purchase_ratio, first_ids, book_ids, book_prices, days, aware):
+        self.seed = seed
+        self.users = users
+        self.first_ids = first_ids  # {'user': ..., 'account': ..., 'operation': ..., 'purchase': ...}
+        self.book_ids = book_ids
+        self.book_prices = book_prices  # in cents
+        # a Zipf-like popularity, the first books of the catalogue sell the most
+        self.book_weights = list(accumulate(1 / rank for rank in range(1, len(book_ids) + 1)))
+        self.days = days
+        self.aware = aware  # SQLite keeps naive UTC datetimes, the other databases take the offset
+        self.operations = [operations // users + (1 if number < operations % users else 0) for number in range(users)]
+        # every ledger starts with a deposit, a share of the rest are purchases, each with its deduction
+        self.purchases = [int((amount - 1) * purchase_ratio) for amount in self.operations]
+
+    def chunks(self, chunk_size):
+        """
+        (number, first account, last account, first operation id, first purchase id) of every chunk.
+        """
+        operation_id, purchase_id = self.first_ids['operation'], self.first_ids['purchase']
+        for number, start in enumerate(range(0, self.users, chunk_size)):
+            stop = min(start + chunk_size, self.users)
+            yield number, start, stop, operation_id, purchase_id
+            operation_id += sum(self.operations[start:stop])
+            purchase_id += sum(self.purchases[start:stop])
+
+
+def format_cents(cents):
+    sign = '-' if cents < 0 else ''
+    return f'{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}'
+
+
+def format_datetime(moment, aware):
+    formatted = moment.isoformat(sep=' ', timespec='microseconds')
+    return formatted + '+00:00' if aware else formatted
+
+
+def generate_books(seed, amount):
+    """
+    [(title, price in cents)], titles of three made-up words, prices from 1.99 to 99.99.
+    """
+    generator = random.Random(f'{seed}:books')
+    return [(' '.join(generator.sample(WORDS, 3)).title(), generator.randint(1, 99) * 100 + 99)
+            for _ in range(amount)]
+
+
+def generate_chunk(plan, chunk):
+    """
+    The rows of the users of one chunk, ready for the INSERTs of the command: users, accounts, operations,
+    purchases and the books of the purchases. The deposits always cover the purchases which follow them,
+    so no balance ever goes below zero, and the balance of every account is the sum of its ledger.
+    """
+    number, start, stop, operation_id, purchase_id = chunk
+    generator = random.Random(f'{plan.seed}:chunk:{number}')
+    users, accounts, operations, purchases, purchase_books = [], [], [], [], []
+    period = plan.days * 24 * 60 * 60
+    for index in range(start, stop):
+        user_id, account_id = plan.first_ids['user'] + index, plan.first_ids['account'] + index
+        operations_amount, purchases_amount = plan.operations[index], plan.purchases[index]
+        joined = EPOCH + timedelta(seconds=generator.random() * period / 2)
+        users.append((user_id, f'generated-{plan.seed}-{index}', format_datetime(joined, plan.aware)))
+
+        # which operations of the ledger are purchases, the first one is always a deposit
+        purchase_positions = set(generator.sample(range(1, operations_amount), purchases_amount))
+        carts, costs = [], []
+        for _ in range(purchases_amount):
+            size = CART_SIZES[bisect_left(CART_SIZE_WEIGHTS, generator.random() * CART_SIZE_WEIGHTS[-1])]
+            cart = {}
+            for _ in range(size):
+                book = bisect_left(plan.book_weights, generator.random() * plan.book_weights[-1])
+                cart[book] = cart.get(book, 0) + (2 if generator.random() < 0.1 else 1)
+            carts.append(cart)
+            costs.append(sum(plan.book_prices[book] * quantity for book, quantity in cart.items()))
+
+        # every deposit covers the purchases up to the next deposit, plus some savings
+        deposits, due, purchase_number = {}, 0, purchases_amount
+        for position in range(operations_amount - 1, -1, -1):  # backwards, summing what the deposit has to cover
+            if position in purchase_positions:
+                purchase_number -= 1
+                due += costs[purchase_number]
+            else:
+                deposits[position] = due + generator.randint(0, 5000)
+                due = 0
+        balance, purchase_number = 0, 0
+        moment = joined
+        step = (EPOCH + timedelta(seconds=period) - joined) / max(operations_amount, 1)
+        for position in range(operations_amount):
+            moment += step * generator.random() * 2 if position else timedelta(0)
+            created = format_datetime(moment, plan.aware)
+            if position in deposits:
+                balance += deposits[position]
+                operations.append((operation_id, account_id, format_cents(deposits[position]), 'deposition', created))
+            else:
+                cost = costs[purchase_number]
+                balance -= cost
+                operations.append((operation_id, account_id, format_cents(-cost), 'deduction', created))
+                purchases.append((purchase_id, account_id, operation_id))
+                for book, quantity in carts[purchase_number].items():
+                    purchase_books.append((purchase_id, plan.book_ids[book], quantity))
+                purchase_id += 1
+                purchase_number += 1
+            operation_id += 1
+        accounts.append((account_id, user_id, format_cents(balance)))
+    return users, accounts, operations, purchases, purchase_books
+
+
+# the plan is handed to every worker process once, when it starts, and not with each of the chunks
+worker_plan = None
+
+
+def init_worker(plan):
+    global worker_plan
+    worker_plan = plan
+
+
+def generate_chunk_in_worker(chunk):
+    return generate_chunk(worker_plan, chunk)
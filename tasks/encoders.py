@@ -0,0 +1,125 @@
+import decimal
+from json.encoder import encode_basestring, encode_basestring_ascii
+
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+
+class EncodedJSON(str):
+    """
+    JSON which is already encoded, the PreEncodedJSONRenderer sends it as it is.
+    """
+
+
+def encode_string(value):
+    # what JSONRenderer's json.dumps() does with strings
+    if api_settings.UNICODE_JSON:
+        return encode_basestring(value)
+    return encode_basestring_ascii(value)
+
+
+def encode_link(link):
+    return 'null' if link is None else encode_string(link)
+
+
+class RowEncoder:
+    """
+    Encodes rows fetched with values_list() into exactly the JSON that the serializer and JSONRenderer
+    would produce for the model instances, without creating the instances and without the per-field
+    dispatch of the serializer. The serializer's fields are looked at once, when the encoder is built,
+    and every field gets a plain function which turns the database value into its JSON text.
+    Only the field types the list views need are supported. The keyword arguments go to the serializer,
+    e.g. the fields of a SparseFieldsetSerializer. Columns after those of the fields are ignored.
+    For the other renderers, e.g. MessagePack, represent_rows() gives the serializer's data instead of JSON.
+    """
+
+    def __init__(self, serializer_class, **kwargs):
+        fields = serializer_class(**kwargs).fields
+        self.sources = [field.source for field in fields.values()]  # what values_list() has to fetch
+        self.converters = [self.get_converter(field) for field in fields.values()]
+        self.names = list(fields)
+        self.representations = [self.get_representation(field) for field in fields.values()]
+        # e.g. {"id":%s,"title":%s,"price":%s}, the values are put into the template in one go
+        self.template = '{' + ','.join(f'{encode_string(name)}:%s' for name in fields) + '}'
+
+    @staticmethod
+    def get_converter(field):
+        if isinstance(field, serializers.DecimalField):
+            return decimal_converter(field)
+        if isinstance(field, serializers.CharField):
+            return nullable(encode_string)
+        if isinstance(field, (serializers.IntegerField, serializers.PrimaryKeyRelatedField)):
+            return nullable(int.__repr__)
+        raise TypeError(f'{type(field).__name__} "{field.field_name}" is not supported by {RowEncoder.__name__}')
+
+    @staticmethod
+    def get_representation(field):
+        if isinstance(field, serializers.DecimalField):
+            return nullable_value(decimal_representation(field))
+        return None  # the database value is the representation already
+
+    def represent_rows(self, rows):
+        names, representations = self.names, self.representations
+        return [dict(zip(names, [value if represent is None else represent(value)
+                                 for represent, value in zip(representations, row)])) for row in rows]
+
+    def encode_row(self, row):
+        return self.template % tuple([convert(value) for convert, value in zip(self.converters, row)])
+
+    def encode_rows(self, rows):
+        encoded = '[' + ','.join([self.encode_row(row) for row in rows]) + ']'
+        # JSONRenderer escapes those two, since they are line terminators in JavaScript
+        return encoded.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+def nullable(convert):
+    def convert_or_null(value):
+        return 'null' if value is None else convert(value)
+
+    return convert_or_null
+
+
+def nullable_value(represent):
+    def represent_or_none(value):
+        return None if value is None else represent(value)
+
+    return represent_or_none
+
+
+def decimal_representation(field):
+    """
+    DecimalField.to_representation(), with the quantizing exponent and context prepared once.
+    """
+    if field.localize:
+        raise TypeError(f'localized DecimalField "{field.field_name}" is not supported by {RowEncoder.__name__}')
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    exponent = decimal.Decimal(1).scaleb(-field.decimal_places) if field.decimal_places is not None else None
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+
+    def represent(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        if exponent is not None:
+            value = value.quantize(exponent, rounding=field.rounding, context=context)
+        return f'{value:f}' if coerce_to_string else value
+
+    return represent
+
+
+def decimal_converter(field):
+    """
+    The same rounding as DecimalField.to_representation(), written as JSONRenderer would write it.
+    """
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    represent = decimal_representation(field)
+
+    def convert(value):
+        if value is None:  # REST framework leaves a None out of the fields' to_representation()
+            return 'null'
+        if coerce_to_string:
+            return f'"{represent(value)}"'
+        return float.__repr__(float(represent(value)))  # how JSONEncoder writes a Decimal which isn't a string
+
+    return convert
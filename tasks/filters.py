@@ -0,0 +1,72 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+# the full-text index of the titles is created by migration 0005 and kept up to date by the database itself
+SQLITE_TITLE_SEARCH = 'SELECT rowid FROM tasks_book_fts WHERE tasks_book_fts MATCH %s'
+POSTGRESQL_TITLE_SEARCH = 'SELECT id FROM tasks_book WHERE title ~* %s'  # served by the trigram GIN index
+
+
+class BookSearchFilter(BaseFilterBackend):
+    """
+    Filters the catalogue with:
+    ?title=<beginning of the title> - prefix in any case, a range scan of the case-insensitive index of migration 0012
+    ?search=<words> - every word has to begin a word of the title, in any order and case, uses the full-text index
+    on SQLite and the trigram index on PostgreSQL
+    ?min_price=<amount>, ?max_price=<amount> - inclusive bounds, a range scan of the (price, id) index
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        prefix = params.get('title')
+        if prefix:
+            queryset = queryset.filter(title__istartswith=prefix)
+        words = params.get('search', '').split()
+        if words:
+            queryset = self.search(queryset, words)
+        min_price = self.get_price(params, 'min_price')
+        if min_price is not None:
+            queryset = queryset.filter(price__gte=min_price)
+        max_price = self.get_price(params, 'max_price')
+        if max_price is not None:
+            queryset = queryset.filter(price__lte=max_price)
+        return queryset
+
+    @staticmethod
+    def search(queryset, words):
+        vendor = connections[queryset.db].vendor
+        if vendor == 'sqlite':
+            # each word is quoted, so it can't be read as an FTS5 operator, and the trailing * makes it a prefix
+            match = ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+            return queryset.filter(id__in=RawSQL(SQLITE_TITLE_SEARCH, [match]))
+        if vendor == 'postgresql':
+            for word in words:
+                # the words of FTS5 are the runs of letters and digits, so "monte-cris" is "monte" followed by
+                # a word beginning with "cris". \m anchors the first one at the beginning of a word of the title
+                tokens = re.findall(r'[^\W_]+', word)
+                if not tokens:
+                    return queryset.none()
+                pattern = '\\m' + '[^[:alnum:]]+'.join(tokens)
+                queryset = queryset.filter(id__in=RawSQL(POSTGRESQL_TITLE_SEARCH, [pattern]))
+            return queryset
+        for word in words:  # other databases have no search index set up, so they just scan the table
+            queryset = queryset.filter(Q(title__istartswith=word) | Q(title__icontains=' ' + word))
+        return queryset
+
+    @staticmethod
+    def get_price(params, name):
+        value = params.get(name)
+        if value is None or value == '':
+            return None
+        try:
+            price = Decimal(value)
+        except InvalidOperation:
+            raise ValidationError({name: ['A valid number is required.']})
+        if not price.is_finite():
+            raise ValidationError({name: ['A valid number is required.']})
+        return price
@@ -0,0 +1,110 @@
+import json
+from datetime import timedelta
+from functools import wraps
+from hashlib import sha256
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from tasks.models import IdempotencyKey
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return sha256(f'{request.method} {request.path} {body}'.encode('utf-8')).hexdigest()
+
+
+def claim_key(user, key, fingerprint):
+    """
+    Inserts the key as "in progress". Returns (record, True) if this request is the one which executes,
+    or (record, False) with the record of the request which got there first.
+    """
+    now = timezone.now()
+    expires = now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    record = None
+    for _ in range(2):  # the second attempt follows the removal of an expired record
+        try:
+            with transaction.atomic():  # committed right away, so concurrent duplicates see it
+                return IdempotencyKey.objects.create(user=user, key=key, request_fingerprint=fingerprint,
+                                                     locked_at=now, expires=expires), True
+        except IntegrityError:  # the unique (user, key) constraint collapses the concurrent duplicates
+            record = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if record is None:  # it has just been purged
+                continue
+            if record.expires <= now:
+                IdempotencyKey.objects.filter(pk=record.pk, expires__lte=now).delete()
+                continue
+            abandoned_before = now - timedelta(seconds=settings.IDEMPOTENCY_KEY_LOCK_TIMEOUT)
+            if record.response_status is None and record.request_fingerprint == fingerprint and \
+                    IdempotencyKey.objects.filter(pk=record.pk, response_status__isnull=True,
+                                                  locked_at__lt=abandoned_before).update(locked_at=now):
+                return record, True  # the first request died without an answer, so this one takes over
+            return record, False
+    return record, False
+
+
+def is_stored(response):
+    # a server error may go away, and so may a conflict (e.g. prices changing during a purchase), so the key
+    # is released for the retry instead of replaying them
+    return response.status_code < 500 and response.status_code != status.HTTP_409_CONFLICT
+
+
+def idempotent(view_method):
+    """
+    Decorator of APIView methods. A request with an Idempotency-Key header is executed only once per user and key,
+    the retries get the stored response (with an Idempotent-Replayed header) without running the view at all.
+    The view and the storing of its response share a transaction, so a purchase is never committed without
+    the response which reports it. Keys are kept for IDEMPOTENCY_KEY_TTL seconds,
+    the purge_idempotency_keys command removes the expired ones.
+    """
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        if key is None:
+            return view_method(self, request, *args, **kwargs)
+        if not key or len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response(f'The {IDEMPOTENCY_KEY_HEADER} header must have 1 to 255 characters',
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = request_fingerprint(request)
+        record, claimed = claim_key(request.user, key, fingerprint)
+        if not claimed:
+            if record is None or record.request_fingerprint != fingerprint:
+                return Response(f'This {IDEMPOTENCY_KEY_HEADER} was already used for a different request',
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if record.response_status is None:
+                return Response('A request with this key is still in progress', status=status.HTTP_409_CONFLICT,
+                                headers={'Retry-After': '1'})
+            response = HttpResponse(bytes(record.response_content), status=record.response_status,
+                                    content_type=record.response_content_type)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            with transaction.atomic():
+                # writing first takes SQLite's write lock right away, a transaction which reads first
+                # fails instead of waiting when it later needs the lock another writer holds
+                IdempotencyKey.objects.filter(pk=record.pk).update(locked_at=timezone.now())
+                response = view_method(self, request, *args, **kwargs)
+                if is_stored(response):
+                    # the response is rendered the way DRF would render it, so the replay is identical
+                    response = self.finalize_response(request, response, *args, **kwargs)
+                    response.render()
+                    IdempotencyKey.objects.filter(pk=record.pk).update(
+                        response_status=response.status_code, response_content=response.content,
+                        response_content_type=response['Content-Type'])
+        except Exception:  # e.g. invalid data, nothing was written and the request may be sent again
+            IdempotencyKey.objects.filter(pk=record.pk).delete()
+            raise
+        if not is_stored(response):
+            IdempotencyKey.objects.filter(pk=record.pk).delete()
+        return response
+
+    return wrapper
@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from tasks.caching import bump_catalogue_version
+from tasks.datasets import DatasetPlan, format_cents, generate_books, generate_chunk, generate_chunk_in_worker, \
+    init_worker
+from tasks.models import Account, Book, Operation, Purchase, PurchaseBook, SpendingRollup
+
+# the full-text index trigger from migration 0005, it is dropped while the books are written, since indexing
+# them all with one INSERT ... SELECT is many times faster than indexing them row by row
+SQLITE_INDEX_TRIGGER = '''CREATE TRIGGER tasks_book_fts_insert AFTER INSERT ON tasks_book BEGIN
+        INSERT INTO tasks_book_fts(rowid, title) VALUES (new.id, new.title);
+    END'''
+
+
+class Command(BaseCommand):
+    help = ('Generates a large synthetic dataset for scale testing: users with their accounts, books and ledgers '
+            'of deposits and purchases (with their books). The same seed always gives the same dataset, '
+            'the chunks of accounts are generated by worker processes and written with prepared bulk INSERTs. '
+            'Run it on a database nobody else writes to at the same time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--users', type=int, default=1000, help='users, each with an account')
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--operations', type=int, default=100000,
+                            help='operations of all the ledgers together, at least one per account')
+        parser.add_argument('--purchase-ratio', type=float, default=0.8,
+                            help='the share of the operations which are purchases, the rest are deposits')
+        parser.add_argument('--days', type=int, default=365, help='the period the ledgers are spread over')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='accounts generated and written at once')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='processes generating the chunks, 1 generates them in this process')
+
+    def handle(self, *args, **options):
+        users, operations = options['users'], options['operations']
+        if users < 1 or options['books'] < 1 or operations < users:
+            raise CommandError('There has to be a user, a book and at least one operation per user')
+        if not 0 <= options['purchase_ratio'] < 1:
+            raise CommandError('The purchase ratio has to be between 0 and 1, some operations are the deposits')
+        if User.objects.filter(username=f'generated-{options["seed"]}-0').exists():
+            raise CommandError(f'The dataset with seed {options["seed"]} has already been generated')
+
+        start = time.perf_counter()
+        self.written = dict.fromkeys(['users', 'books', 'operations', 'purchases', 'purchase books'], 0)
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':  # the indexes being filled stay in memory, 256 MB instead of 2 MB
+                cursor.execute('PRAGMA cache_size = -262144')
+            first_ids = {name: (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1 for name, model in
+                         (('user', User), ('account', Account), ('operation', Operation), ('purchase', Purchase))}
+            book_ids, book_prices = self.write_books(cursor, generate_books(options['seed'], options['books']))
+            plan = DatasetPlan(options['seed'], users, operations, options['purchase_ratio'], first_ids,
+                               book_ids, book_prices, options['days'], aware=connection.vendor != 'sqlite')
+            chunks = plan.chunks(options['chunk_size'])
+            if options['workers'] > 1:
+                # the workers generate the next chunks while this process writes, imap() keeps them in order
+                with multiprocessing.Pool(options['workers'], initializer=init_worker, initargs=(plan,)) as pool:
+                    for rows in pool.imap(generate_chunk_in_worker, chunks):
+                        self.write_chunk(cursor, rows)
+            else:
+                for chunk in chunks:
+                    self.write_chunk(cursor, generate_chunk(plan, chunk))
+            # the rows were written without Operation.save(), so the spending rollups are computed at once
+            SpendingRollup.rebuild(Account.objects.filter(pk__gte=first_ids['account']))
+            # the ids were chosen here, the sequences of e.g. PostgreSQL have to be moved past them
+            for sql in connection.ops.sequence_reset_sql(no_style(), [User, Account, Operation, Purchase, Book]):
+                cursor.execute(sql)
+        bump_catalogue_version()  # bulk writes send no signals, so the cached catalogue is invalidated here
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated in {elapsed:.2f}s ({self.written["operations"] / elapsed:.0f} operations/s): ' +
+            ', '.join(f'{amount} {name}' for name, amount in self.written.items())))
+
+    def write_books(self, cursor, books):
+        """
+        Writes the books and returns their ids and prices (in cents).
+        """
+        book_table = Book._meta.db_table
+        cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {book_table}')
+        first_id = cursor.fetchone()[0] + 1
+        rows = [(first_id + number, title, format_cents(price)) for number, (title, price) in enumerate(books)]
+        if connection.vendor == 'sqlite':  # indexed for the full-text search in one go
+            cursor.execute('DROP TRIGGER tasks_book_fts_insert')
+        cursor.executemany(f'INSERT INTO {book_table} (id, title, price) VALUES (%s, %s, %s)', rows)
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'INSERT INTO tasks_book_fts(rowid, title) SELECT id, title FROM {book_table} '
+                           'WHERE id >= %s', [first_id])
+            cursor.execute(SQLITE_INDEX_TRIGGER)
+        self.written['books'] += len(rows)
+        return [row[0] for row in rows], [price for _, price in books]
+
+    def write_chunk(self, cursor, rows):
+        users, accounts, operations, purchases, purchase_books = rows
+        # the generated users can't log in until they are given a password
+        cursor.executemany(f'INSERT INTO {User._meta.db_table} (id, username, date_joined, password, is_superuser, '
+                           "is_staff, is_active, first_name, last_name, email) "
+                           "VALUES (%s, %s, %s, '!', FALSE, FALSE, TRUE, '', '', '')", users)
+        cursor.executemany(f'INSERT INTO {Account._meta.db_table} (id, owner_id, balance) VALUES (%s, %s, %s)',
+                           accounts)
+        cursor.executemany(f'INSERT INTO {Operation._meta.db_table} (id, account_id, balance_change, operation_type, '
+                           'created) VALUES (%s, %s, %s, %s, %s)', operations)
+        cursor.executemany(f'INSERT INTO {Purchase._meta.db_table} (id, account_id, operation_id) '
+                           'VALUES (%s, %s, %s)', purchases)
+        cursor.executemany(f'INSERT INTO {PurchaseBook._meta.db_table} (purchase_id, book_id, quantity) '
+                           'VALUES (%s, %s, %s)', purchase_books)
+        self.written['users'] += len(users)
+        self.written['operations'] += len(operations)
+        self.written['purchases'] += len(purchases)
+        self.written['purchase books'] += len(purchase_books)
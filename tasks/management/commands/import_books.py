@@ -0,0 +1,160 @@
+import csv
+import json
+import os
+import time
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from tasks.caching import bump_catalogue_version
+from tasks.models import Book, CatalogueVersion
+
+# books per INSERT or UPDATE, Django lowers it to what the database accepts (e.g. 333 books on SQLite)
+WRITE_BATCH_SIZE = 1000
+# the key of the PostgreSQL advisory lock the imports take turns on, see Command.write()
+IMPORT_LOCK_KEY = 7007
+
+
+class Command(BaseCommand):
+    help = ('Imports books from a CSV file (with a "title,price" header) or a JSON lines file '
+            '(one {"title": ..., "price": ...} object per line). A book with the same title is updated, '
+            'the others are created. The file is read in batches, so it may be of any size.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='the file to import')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='the format of the file, guessed from its extension by default')
+        parser.add_argument('--batch-size', type=int, default=10000, help='rows written in a single transaction')
+        parser.add_argument('--rejects', help='write the rejected rows, with the reason, to this CSV file')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in ('csv', 'jsonl'):
+            raise CommandError('Unknown file format, please pass --format csv or --format jsonl')
+        # the validators of the model's own fields check the rows, so the import follows the same rules as the API,
+        # e.g. the MinValueValidator(0.01) of the price
+        self.title_validators = Book._meta.get_field('title').validators
+        self.price_validators = Book._meta.get_field('price').validators
+        self.created = self.updated = self.unchanged = self.rejected = 0
+
+        start = time.perf_counter()
+        with open(path, newline='', encoding='utf-8') as source:
+            rejects_file = open(options['rejects'], 'w', newline='', encoding='utf-8') if options['rejects'] else None
+            try:
+                self.rejects = csv.writer(rejects_file) if rejects_file else None
+                if self.rejects:
+                    self.rejects.writerow(['line', 'row', 'reason'])
+                rows = self.read_csv(source) if file_format == 'csv' else self.read_jsonl(source)
+                batch = {}
+                for line_number, row in rows:
+                    book = self.clean(line_number, row)
+                    if book is not None:
+                        title, price = book
+                        batch[title] = price  # a title repeated in the file is imported with its last price
+                    if len(batch) >= options['batch_size']:
+                        self.write(batch)
+                        batch = {}
+                self.write(batch)
+            finally:
+                if rejects_file:
+                    rejects_file.close()
+        bump_catalogue_version()  # bulk writes send no signals, so the cached catalogue is invalidated here
+        elapsed = time.perf_counter() - start
+
+        rows = self.created + self.updated + self.unchanged + self.rejected
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {rows} rows in {elapsed:.2f}s ({rows / elapsed:.0f} rows/s): {self.created} books created, '
+            f'{self.updated} updated, {self.unchanged} unchanged, {self.rejected} rows rejected'))
+
+    @staticmethod
+    def read_csv(source):
+        reader = csv.reader(source)
+        header = next(reader, [])
+        for line_number, values in enumerate(reader, start=2):  # the first line is the header
+            yield line_number, dict(zip(header, values))
+
+    @staticmethod
+    def read_jsonl(source):
+        for line_number, line in enumerate(source, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line, parse_float=Decimal)  # a float could change the price
+            except ValueError:
+                row = line.rstrip('\n')  # rejected by clean(), since it's not a dictionary
+            yield line_number, row
+
+    def clean(self, line_number, row):
+        try:
+            if not isinstance(row, dict):
+                raise ValidationError('The row is not an object with a title and a price')
+            title, price = row.get('title'), row.get('price')
+            if not isinstance(title, str) or not title.strip():
+                raise ValidationError('The title is missing')
+            try:
+                price = Decimal(str(price).strip())
+            except InvalidOperation:
+                raise ValidationError('The price is not a number')
+            if not price.is_finite():
+                raise ValidationError('The price is not a number')
+            for validator in self.title_validators:
+                validator(title)
+            for validator in self.price_validators:
+                validator(price)
+        except ValidationError as error:
+            self.rejected += 1
+            if self.rejects:
+                self.rejects.writerow([line_number, json.dumps(row, default=str), ' '.join(error.messages)])
+            return None
+        return title, price
+
+    @staticmethod
+    def find_existing(titles):
+        """
+        Returns {title: {id: price}} of the books which are already in the catalogue, a title may belong to
+        several books.
+        """
+        book_table = Book._meta.db_table
+        existing = defaultdict(dict)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':  # the whole batch is passed as one JSON parameter
+                cursor.execute(f'SELECT title, id, price FROM {book_table} '
+                               'WHERE title IN (SELECT value FROM json_each(%s))', [json.dumps(titles)])
+            elif connection.vendor == 'postgresql':  # or as one array
+                cursor.execute(f'SELECT title, id, price FROM {book_table} WHERE title = ANY(%s)', [titles])
+            else:
+                for title, pk, price in Book.objects.filter(title__in=titles).values_list('title', 'id', 'price'):
+                    existing[title][pk] = price
+                return existing
+            # the raw cursor skips the field converters, so the prices are turned into Decimals here
+            for title, pk, price in cursor.fetchall():
+                existing[title][pk] = Decimal(str(price)).quantize(Decimal('0.01'))
+        return existing
+
+    def write(self, batch):
+        if not batch:
+            return
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # two imports could both miss a title and both create it, so their batches take turns.
+                # SQLite has a single writer, the batch of the second import fails instead
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_xact_lock(%s)', [IMPORT_LOCK_KEY])
+            existing = self.find_existing(list(batch))
+            new_books = [Book(title=title, price=price) for title, price in batch.items() if title not in existing]
+            # every book with the title gets the new price, unchanged books aren't written at all
+            changed_titles = [title for title, price in batch.items() if title in existing
+                              and any(old_price != price for old_price in existing[title].values())]
+            changed_books = [Book(pk=pk, price=batch[title]) for title in changed_titles
+                             for pk, old_price in existing[title].items() if old_price != batch[title]]
+            Book.objects.bulk_create(new_books, batch_size=WRITE_BATCH_SIZE)
+            Book.objects.bulk_update(changed_books, ['price'], batch_size=WRITE_BATCH_SIZE)
+            if changed_books:  # in the same transaction, so no purchase is charged the old prices afterwards
+                CatalogueVersion.bump()
+        self.created += len(new_books)
+        self.updated += len(changed_titles)
+        self.unchanged += len(batch) - len(new_books) - len(changed_titles)
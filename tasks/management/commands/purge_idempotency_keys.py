@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tasks.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Removes the expired idempotency keys, meant to be run periodically, e.g. by a scheduler.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='keys removed per query, so the table is never locked for long')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        removed = 0
+        while True:
+            expired = list(IdempotencyKey.objects.filter(expires__lte=now).values_list('pk', flat=True)
+                           [:options['batch_size']])
+            if not expired:
+                break
+            removed += IdempotencyKey.objects.filter(pk__in=expired).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} expired idempotency keys'))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tasks.models import Account, SpendingRollup
+
+
+class Command(BaseCommand):
+    help = ('Computes the daily and monthly spending rollups from the ledgers, e.g. after operations were written '
+            'by hand. The rollups of the other accounts are left as they are.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, action='append', dest='accounts',
+                            help='the id of an account to rebuild, may be repeated, all the accounts by default')
+
+    def handle(self, *args, **options):
+        accounts = Account.objects.filter(pk__in=options['accounts']) if options['accounts'] else None
+        start = time.perf_counter()
+        SpendingRollup.rebuild(accounts)
+        rollups = SpendingRollup.objects.all()
+        if accounts is not None:
+            rollups = rollups.filter(account__in=accounts)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {rollups.count()} rollups in {time.perf_counter() - start:.2f}s'))
@@ -0,0 +1,38 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tasks.outbox import claim, deliver
+
+
+class Command(BaseCommand):
+    help = ('Delivers the messages of the outbox to the handlers of settings.OUTBOX_HANDLERS, runs until stopped. '
+            'Several workers may run at once, each message is claimed by only one of them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='messages claimed at once')
+        parser.add_argument('--threads', type=int, default=8, help='messages handled at the same time')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='seconds to wait when there is nothing to deliver')
+        parser.add_argument('--once', action='store_true',
+                            help='stop when there is nothing to deliver instead, e.g. for a scheduler')
+
+    def handle(self, *args, **options):
+        delivered = failed = 0
+        with ThreadPoolExecutor(options['threads'], thread_name_prefix='outbox') as pool:
+            try:
+                while True:
+                    messages = claim(options['batch_size'], settings.OUTBOX_LEASE)
+                    if messages:
+                        done, errors = deliver(messages, pool)
+                        delivered += done
+                        failed += errors
+                    elif options['once']:
+                        break
+                    else:
+                        time.sleep(options['poll_interval'])
+            except KeyboardInterrupt:  # the messages of an interrupted batch are due again when their lease expires
+                pass
+        self.stdout.write(self.style.SUCCESS(f'Delivered {delivered} messages, {failed} failed attempts'))
@@ -0,0 +1,163 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+
+# upper bounds of the latency histogram, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+UNRESOLVED_VIEW = 'unresolved'  # requests which didn't match any named URL, e.g. 404s
+# counters of what happens inside the requests, exposed as booklist_<name>_total
+COUNTERS = {
+    'price_index_hits': 'Books of purchases priced by the price index of the worker.',
+    'price_index_misses': 'Books of purchases the price index had to read from the database.',
+    'price_index_invalidations': 'Times the price index was emptied since the catalogue had changed.',
+    'throttle_slots_full': 'Requests let through unlimited since the throttle counters had no free slot for them.',
+}
+
+# the statistics of the request being served, a context variable, so the async views
+# (which run their queries in other threads, see tasks.async_views) are counted as well
+current_request = contextvars.ContextVar('current_request', default=None)
+
+
+class RequestStatistics:
+    __slots__ = ('queries', 'query_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper, installed on every connection (see tasks.signals).
+    """
+    statistics = current_request.get()
+    if statistics is None:  # e.g. a management command
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        statistics.queries += 1
+        statistics.query_seconds += time.perf_counter() - start
+
+
+class MetricsRegistry:
+    """
+    Metrics of this process, per URL name, and the COUNTERS. Every gunicorn worker keeps its own and writes them
+    to a file of its own in METRICS_DIR at most every METRICS_FLUSH_INTERVAL seconds, the /metrics/ endpoint adds up
+    the files of all the workers. The files are left behind by workers which have exited, so the counters
+    never go back, the directory is emptied when the server starts.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.counters = Counter()
+        self.flushed_at = time.monotonic()
+
+    def observe(self, view, seconds, statistics, response_bytes):
+        with self.lock:
+            metrics = self.views.get(view)
+            if metrics is None:
+                metrics = self.views[view] = new_view_metrics()
+            # buckets are counted individually here and made cumulative only in the exposition
+            metrics['buckets'][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            metrics['count'] += 1
+            metrics['seconds'] += seconds
+            metrics['queries'] += statistics.queries
+            metrics['query_seconds'] += statistics.query_seconds
+            metrics['response_bytes'] += response_bytes
+        if time.monotonic() - self.flushed_at >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def count(self, name, amount=1):
+        # flushed with the next observed request
+        with self.lock:
+            self.counters[name] += amount
+
+    def snapshot(self):
+        with self.lock:
+            return {'views': {view: dict(metrics, buckets=list(metrics['buckets']))
+                              for view, metrics in self.views.items()},
+                    'counters': dict(self.counters)}
+
+    def flush(self):
+        self.flushed_at = time.monotonic()
+        if not settings.METRICS_DIR:
+            return
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = os.path.join(settings.METRICS_DIR, f'worker-{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(path + '.tmp', path)  # the reader never sees a half-written file
+
+    def collect(self):
+        """
+        The metrics of all the workers added up, with this process' ones up to date.
+        """
+        if not settings.METRICS_DIR:
+            return self.snapshot()
+        self.flush()
+        total, counters = {}, Counter()
+        for name in os.listdir(settings.METRICS_DIR):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(settings.METRICS_DIR, name)) as file:
+                    worker = json.load(file)
+            except (OSError, ValueError):  # removed in the meantime
+                continue
+            counters.update(worker['counters'])
+            for view, metrics in worker['views'].items():
+                summed = total.setdefault(view, new_view_metrics())
+                for key, value in metrics.items():
+                    if key == 'buckets':
+                        summed[key] = [a + b for a, b in zip(summed[key], value)]
+                    else:
+                        summed[key] += value
+        return {'views': total, 'counters': dict(counters)}
+
+
+def new_view_metrics():
+    return {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'count': 0, 'seconds': 0.0,
+            'queries': 0, 'query_seconds': 0.0, 'response_bytes': 0}
+
+
+def format_prometheus(collected):
+    """
+    The metrics, as collected by MetricsRegistry, in the Prometheus text exposition format.
+    """
+    views, counters = collected['views'], collected['counters']
+    lines = [
+        '# HELP booklist_request_duration_seconds Time spent serving the requests.',
+        '# TYPE booklist_request_duration_seconds histogram',
+    ]
+    for view, metrics in sorted(views.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), metrics['buckets']):
+            cumulative += count
+            lines.append(f'booklist_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+        lines.append(f'booklist_request_duration_seconds_sum{{view="{view}"}} {metrics["seconds"]}')
+        lines.append(f'booklist_request_duration_seconds_count{{view="{view}"}} {metrics["count"]}')
+    for name, key, description in (
+            ('booklist_request_queries_total', 'queries', 'SQL queries run by the requests.'),
+            ('booklist_request_query_seconds_total', 'query_seconds', 'Time spent in SQL queries.'),
+            ('booklist_response_bytes_total', 'response_bytes', 'Size of the response bodies.')):
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} counter')
+        for view, metrics in sorted(views.items()):
+            lines.append(f'{name}{{view="{view}"}} {metrics[key]}')
+    for name, description in COUNTERS.items():
+        lines.append(f'# HELP booklist_{name}_total {description}')
+        lines.append(f'# TYPE booklist_{name}_total counter')
+        lines.append(f'booklist_{name}_total {counters.get(name, 0)}')
+    return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
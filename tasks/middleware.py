@@ -0,0 +1,337 @@
+import asyncio
+import gzip
+import time
+import zlib
+from functools import lru_cache
+
+import brotli
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware as DjangoAuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.middleware import MessageMiddleware as DjangoMessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware as DjangoSessionMiddleware
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_vary_headers
+from rest_framework.throttling import BaseThrottle
+from whitenoise.middleware import WhiteNoiseMiddleware as SyncWhiteNoiseMiddleware
+
+from tasks.authentication import is_token_request
+from tasks.metrics import UNRESOLVED_VIEW, RequestStatistics, current_request, registry
+from tasks.routers import RequestRouting, current_routing, remember_write
+from tasks.throttling import counter_key, get_counters, parse_rate, throttle
+
+# the API's own formats, the static files are compressed ahead of time by WhiteNoise. Not the HTML pages, which
+# carry the CSRF token next to what the request reflects, so their compressed size could leak it (BREACH)
+COMPRESSIBLE_TYPES = {'application/json', 'application/msgpack', 'application/x-ndjson', 'text/csv'}
+# levels fast enough to compress on the fly, the default ones take several times as long for a few % less
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class WhiteNoiseMiddleware(SyncWhiteNoiseMiddleware):
+    """
+    WhiteNoise 5 middleware can only be called synchronously. Under ASGI Django then runs everything below it,
+    including async views, from its single synchronous thread, so no two requests would ever be served at once.
+    This one can be awaited too, serving static files doesn't need anything but a lookup of the path.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if asyncio.iscoroutinefunction(self.get_response):
+            # the way django.utils.deprecation.MiddlewareMixin marks itself as a coroutine function for Django
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, the SQL queries (their number and time) and the response size of every request,
+    per URL name, e.g. book-list or books-buy. See tasks.metrics, they are served by the /metrics/ endpoint.
+    It should be the first middleware, so the time and queries of the others are counted too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        statistics = RequestStatistics()
+        token = current_request.set(statistics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.observe(request, response, time.perf_counter() - start, statistics)
+        return response
+
+    async def __acall__(self, request):
+        statistics = RequestStatistics()
+        token = current_request.set(statistics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.observe(request, response, time.perf_counter() - start, statistics)
+        return response
+
+    @staticmethod
+    def observe(request, response, seconds, statistics):
+        match = request.resolver_match
+        view = match.url_name if match is not None and match.url_name else UNRESOLVED_VIEW
+        # a streamed response is still being produced, only its size isn't known here
+        response_bytes = 0 if response.streaming else len(response.content)
+        registry.observe(view, seconds, statistics, response_bytes)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Keeps the routing of every request for tasks.routers.ReplicaRouter, and remembers the users whose requests
+    have written something, so they read their own writes from the primary for a while.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing = RequestRouting()
+        token = current_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        self.remember(request, routing)
+        return response
+
+    async def __acall__(self, request):
+        routing = RequestRouting()
+        token = current_routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        self.remember(request, routing)
+        return response
+
+    @staticmethod
+    def remember(request, routing):
+        # the user authenticated by the view, REST framework puts it on the Django request as well
+        if routing.wrote and hasattr(request, 'user'):
+            remember_write(request.user)
+
+
+@lru_cache(maxsize=1024)
+def view_name(path):
+    # the URL name of the path, the same paths come again and again and resolving them takes most of the time
+    try:
+        return resolve(path).url_name
+    except Resolver404:
+        return None
+
+
+class ThrottleMiddleware:
+    """
+    Rejects the requests over the rate limits per IP of their view, settings.THROTTLE_RATES, with a 429 response
+    and a Retry-After header. It comes before the session and authentication middlewares, so a flood costs
+    a few cache operations per request and no query. The user isn't known yet, the limits per user are checked
+    once it is, by tasks.throttling.VerifiedUserThrottle.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.throttled(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.throttled(request) or await self.get_response(request)
+
+    @staticmethod
+    def throttled(request):
+        if not settings.THROTTLE_RATES:
+            return None
+        scope = view_name(request.path_info)
+        rate = settings.THROTTLE_RATES.get(scope, {}).get('ip')
+        if not rate:
+            return None
+        ident = BaseThrottle().get_ident(request)  # the client's address, behind NUM_PROXIES proxies
+        wait = throttle(get_counters(), [(counter_key(scope, 'ip', ident), *parse_rate(rate))], time.time())
+        if wait is None:
+            return None
+        # the message of REST framework's own throttles
+        response = JsonResponse({'detail': f'Request was throttled. Expected available in {wait} seconds.'},
+                                status=429)
+        response['Retry-After'] = str(wait)
+        return response
+
+
+def accepted_encoding(accept_encoding):
+    """
+    The best encoding of an Accept-Encoding header, e.g. "gzip, br;q=0.8", brotli when both are as welcome,
+    or None when the client accepts neither.
+    """
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, parameters = item.partition(';')
+        weight = 1.0
+        parameters = parameters.strip()
+        if parameters.startswith('q='):
+            try:
+                weight = float(parameters[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    default = weights.get('*', 0.0)
+    best = max(['br', 'gzip'], key=lambda encoding: weights.get(encoding, default))  # the first of equal ones
+    return best if weights.get(best, default) > 0 else None
+
+
+def compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # with the gzip header
+        compress, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+class CompressionMiddleware:
+    """
+    Compresses the API's responses with brotli or gzip, whichever the client's Accept-Encoding prefers,
+    when they are at least COMPRESSION_MIN_SIZE bytes long. The streamed statements are compressed as they are
+    sent. Under ASGI the compression is CPU work, it's done in the thread pool instead of the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        encoding = self.encoding_for(request, response)
+        return self.compress(response, encoding) if encoding else response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        encoding = self.encoding_for(request, response)
+        if encoding is None:
+            return response
+        if response.streaming:  # compressed chunk by chunk, while the server sends them
+            return self.compress(response, encoding)
+        return await sync_to_async(self.compress, thread_sensitive=False)(response, encoding)
+
+    @staticmethod
+    def encoding_for(request, response):
+        if response.get('Content-Type', '').split(';')[0] not in COMPRESSIBLE_TYPES or \
+                response.has_header('Content-Encoding'):
+            return None
+        patch_vary_headers(response, ['Accept-Encoding'])  # compressed or not, the response depends on it
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return None
+        return accepted_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+
+    @staticmethod
+    def compress(response, encoding):
+        if response.streaming:
+            response.streaming_content = compress_stream(response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            if encoding == 'br':
+                compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+            else:
+                compressed = gzip.compress(response.content, GZIP_LEVEL, mtime=0)  # the same bytes every time
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):  # the same data, but no longer the same bytes
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+
+class SessionMiddleware(DjangoSessionMiddleware):
+    """
+    Django's, except for the requests of API clients authenticated with a token (see tasks.authentication), which
+    have no session, so nothing is read from the session table or written back.
+    """
+
+    def process_request(self, request):
+        if not is_token_request(request):
+            super().process_request(request)
+
+    def process_response(self, request, response):
+        if not hasattr(request, 'session'):
+            return response
+        return super().process_response(request, response)
+
+
+class AuthenticationMiddleware(DjangoAuthenticationMiddleware):
+    """
+    Django's, the requests without a session (see SessionMiddleware) are anonymous until REST framework
+    authenticates their token.
+    """
+
+    def process_request(self, request):
+        if hasattr(request, 'session'):
+            super().process_request(request)
+        else:
+            request.user = AnonymousUser()
+
+
+class MessageMiddleware(DjangoMessageMiddleware):
+    """
+    Django's, the messages are kept in the session, the requests without one have none.
+    """
+
+    def process_request(self, request):
+        if hasattr(request, 'session'):
+            super().process_request(request)
+
+    def process_response(self, request, response):
+        if not hasattr(request, 'session'):
+            return response
+        return super().process_response(request, response)
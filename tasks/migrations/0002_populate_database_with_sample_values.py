@@ -1,10 +1,11 @@
-from django.contrib.auth.models import User
 from django.db import migrations
 
-from tasks.models import Account, Book
-
 
 def populate_with_sample_data(apps, schema_editor):
+    # the models as they were at this migration, the current ones may have columns which don't exist yet
+    User = apps.get_model('auth', 'User')
+    Account = apps.get_model('tasks', 'Account')
+    Book = apps.get_model('tasks', 'Book')
     user = User.objects.create_user(
         username='sample_user',
         password='book_pass',
@@ -0,0 +1,44 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    """
+    Turns the auto-generated Purchase.books table into the explicit PurchaseBook model
+    without copying any rows, then adds the quantity column to it.
+    """
+
+    dependencies = [
+        ('tasks', '0002_populate_database_with_sample_values'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='PurchaseBook',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False,
+                                                verbose_name='ID')),
+                        ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tasks.book')),
+                        ('purchase', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                       to='tasks.purchase')),
+                    ],
+                    options={
+                        'db_table': 'tasks_purchase_books',
+                        'unique_together': {('purchase', 'book')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='purchase',
+                    name='books',
+                    field=models.ManyToManyField(through='tasks.PurchaseBook', to='tasks.Book'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='purchasebook',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
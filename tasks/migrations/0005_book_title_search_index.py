@@ -0,0 +1,57 @@
+from django.db import migrations
+
+# an external content FTS5 table only stores the index, the titles stay in tasks_book,
+# and the triggers keep it in sync with every write, including bulk ones which skip Django signals
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE tasks_book_fts USING fts5(title, content='tasks_book', content_rowid='id')",
+    """CREATE TRIGGER tasks_book_fts_insert AFTER INSERT ON tasks_book BEGIN
+        INSERT INTO tasks_book_fts(rowid, title) VALUES (new.id, new.title);
+    END""",
+    """CREATE TRIGGER tasks_book_fts_delete AFTER DELETE ON tasks_book BEGIN
+        INSERT INTO tasks_book_fts(tasks_book_fts, rowid, title) VALUES ('delete', old.id, old.title);
+    END""",
+    """CREATE TRIGGER tasks_book_fts_update AFTER UPDATE OF title ON tasks_book BEGIN
+        INSERT INTO tasks_book_fts(tasks_book_fts, rowid, title) VALUES ('delete', old.id, old.title);
+        INSERT INTO tasks_book_fts(rowid, title) VALUES (new.id, new.title);
+    END""",
+    "INSERT INTO tasks_book_fts(tasks_book_fts) VALUES ('rebuild')",  # indexes the books which already exist
+]
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS tasks_book_fts_insert',
+    'DROP TRIGGER IF EXISTS tasks_book_fts_delete',
+    'DROP TRIGGER IF EXISTS tasks_book_fts_update',
+    'DROP TABLE IF EXISTS tasks_book_fts',
+]
+
+# a trigram GIN index serves the regular expressions of the search (see tasks.filters) and is maintained
+# by PostgreSQL like any other index
+POSTGRESQL_CREATE = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX book_title_trgm_idx ON tasks_book USING gin (title gin_trgm_ops)',
+]
+POSTGRESQL_DROP = [
+    'DROP INDEX IF EXISTS book_title_trgm_idx',
+]
+
+
+def run_for_vendor(sqlite_statements, postgresql_statements):
+    def run(apps, schema_editor):
+        statements = {
+            'sqlite': sqlite_statements,
+            'postgresql': postgresql_statements,
+        }.get(schema_editor.connection.vendor, [])  # other databases fall back to scanning the table
+        for statement in statements:
+            schema_editor.execute(statement, params=None)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0004_book_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_for_vendor(SQLITE_CREATE, POSTGRESQL_CREATE),
+                             run_for_vendor(SQLITE_DROP, POSTGRESQL_DROP)),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-18 13:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0005_book_title_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(fields=['account', 'created', 'id'], name='operation_account_created_idx'),
+        ),
+    ]
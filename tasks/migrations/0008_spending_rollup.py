@@ -0,0 +1,37 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from tasks import rollups
+
+
+def backfill(apps, schema_editor):
+    # the rollups of the operations written before the table existed
+    rollups.rebuild(apps.get_model('tasks', 'SpendingRollup'), apps.get_model('tasks', 'Operation').objects.all())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0007_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpendingRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'day'), ('month', 'month')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('deposited', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('spent', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('operations', models.PositiveIntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tasks.account')),
+            ],
+            options={
+                'unique_together': {('account', 'period', 'period_start')},
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
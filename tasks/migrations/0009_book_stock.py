@@ -0,0 +1,45 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:25
+
+from django.db import migrations, models
+
+# SQLite can't add a column in place, Django copies tasks_book into a new table and the triggers of the full-text
+# index (see 0005_book_title_search_index) are dropped with the old one, so they are created again
+SQLITE_TRIGGERS = [
+    'DROP TRIGGER IF EXISTS tasks_book_fts_insert',
+    'DROP TRIGGER IF EXISTS tasks_book_fts_delete',
+    'DROP TRIGGER IF EXISTS tasks_book_fts_update',
+    """CREATE TRIGGER tasks_book_fts_insert AFTER INSERT ON tasks_book BEGIN
+        INSERT INTO tasks_book_fts(rowid, title) VALUES (new.id, new.title);
+    END""",
+    """CREATE TRIGGER tasks_book_fts_delete AFTER DELETE ON tasks_book BEGIN
+        INSERT INTO tasks_book_fts(tasks_book_fts, rowid, title) VALUES ('delete', old.id, old.title);
+    END""",
+    """CREATE TRIGGER tasks_book_fts_update AFTER UPDATE OF title ON tasks_book BEGIN
+        INSERT INTO tasks_book_fts(tasks_book_fts, rowid, title) VALUES ('delete', old.id, old.title);
+        INSERT INTO tasks_book_fts(rowid, title) VALUES (new.id, new.title);
+    END""",
+]
+
+
+def create_sqlite_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_TRIGGERS:
+            schema_editor.execute(statement, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0008_spending_rollup'),
+    ]
+
+    operations = [
+        # when unapplied, the table is copied again by the removal of the column, the triggers follow it
+        migrations.RunPython(migrations.RunPython.noop, create_sqlite_triggers),
+        migrations.AddField(
+            model_name='book',
+            name='stock',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(create_sqlite_triggers, migrations.RunPython.noop),
+    ]
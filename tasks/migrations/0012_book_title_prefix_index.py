@@ -0,0 +1,34 @@
+from django.db import migrations
+
+# ?title= is a prefix in any case, Django's istartswith. SQLite runs it as title LIKE 'prefix%', which can seek
+# an index of the titles in the NOCASE collation, the case LIKE ignores
+SQLITE_CREATE = ['CREATE INDEX book_title_nocase_idx ON tasks_book (title COLLATE NOCASE)']
+SQLITE_DROP = ['DROP INDEX IF EXISTS book_title_nocase_idx']
+
+# PostgreSQL runs it as UPPER(title::text) LIKE UPPER('prefix%'), which can seek an index of the same expression,
+# with the pattern operator class so it does whatever the collation of the database
+POSTGRESQL_CREATE = ['CREATE INDEX book_title_upper_idx ON tasks_book (UPPER(title::text) text_pattern_ops)']
+POSTGRESQL_DROP = ['DROP INDEX IF EXISTS book_title_upper_idx']
+
+
+def run_for_vendor(sqlite_statements, postgresql_statements):
+    def run(apps, schema_editor):
+        statements = {
+            'sqlite': sqlite_statements,
+            'postgresql': postgresql_statements,
+        }.get(schema_editor.connection.vendor, [])  # other databases fall back to scanning the table
+        for statement in statements:
+            schema_editor.execute(statement, params=None)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0011_catalogue_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_for_vendor(SQLITE_CREATE, POSTGRESQL_CREATE),
+                             run_for_vendor(SQLITE_DROP, POSTGRESQL_DROP)),
+    ]
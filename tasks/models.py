@@ -1,11 +1,31 @@
+from collections import Counter
 from decimal import Decimal
 
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import Sum
+from django.db import connection, models, transaction
+from django.db.models import Case, Exists, F, Max, Value, When
 from django.contrib.auth.models import User
+from django.utils import timezone
 from djchoices import ChoiceItem, DjangoChoices
 
+from tasks import prices, rollups
+
+
+def bulk_create_with_ids(model, objects):
+    """
+    bulk_create() which also sets the primary keys of the created objects on every database.
+    Must be called inside a transaction which has already written to the database, on SQLite it then holds
+    the write lock and no other connection can take ids in between.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:  # e.g. PostgreSQL, with INSERT ... RETURNING
+        return model.objects.bulk_create(objects)
+    last_id = model.objects.aggregate(last_id=Max('pk'))['last_id'] or 0
+    model.objects.bulk_create(objects)
+    # the rows of a bulk insert get increasing ids in the order of the list
+    for obj, pk in zip(objects, model.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)):
+        obj.pk = pk
+    return objects
+
 
 class Account(models.Model):
     """
@@ -22,6 +42,12 @@ class Account(models.Model):
         return Operation.objects.create(account=self, balance_change=amount, operation_type='deposition')
 
 
+class InsufficientFunds(ValueError):
+    """
+    Raised when an operation would leave the account's balance negative.
+    """
+
+
 class Operation(models.Model):
     """
     Each change (deposit, purchase, etc..) of Account's balance should be reflected
@@ -38,18 +64,77 @@ class Operation(models.Model):
     operation_type = models.CharField(max_length=20, choices=OperationTypes.choices, default='deduction')
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # statements are read per account in the order of creation, the id breaks ties of equal timestamps
+        indexes = [models.Index(fields=['account', 'created', 'id'], name='operation_account_created_idx')]
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)  # call the "real" save() method
-        new_balance = self.account.balance + self.balance_change
-        if new_balance > 0:
-            self.account.balance = new_balance
-            self.account.save()
-        # this part should not be reached, because purchase already handles such cases
-        # however implementing some protection in case of manual Operation modification
-        else:
-            self.delete()
-            raise Exception("The operation would leave the balance negative. "
-                            "Operations should not be tampered with manually")
+        if not self._state.adding:  # the balance change was applied when the operation was created
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            # the check and the change of the balance are a single conditional UPDATE executed by the database,
+            # so two workers can't both spend the same funds and no deposit is lost between a read and a write
+            applied = Account.objects.filter(pk=self.account_id, balance__gte=-self.balance_change).update(
+                balance=F('balance') + self.balance_change)
+            if not applied:  # nothing was written yet, so raising rolls back cleanly
+                raise InsufficientFunds("The operation would leave the balance negative")
+            super().save(*args, **kwargs)  # call the "real" save() method
+            SpendingRollup.add_operations([self])
+            self.account.refresh_from_db(fields=['balance'])  # the in-memory account reflects the new balance
+
+
+class SpendingRollup(models.Model):
+    """
+    Deposits and deductions of an account added up per day and per month, so a summary reads a row per period
+    instead of the whole ledger. Every code writing operations adds them with add_operations(),
+    the rebuild_spending_rollups command computes the rollups from scratch.
+    """
+
+    class Periods(DjangoChoices):
+        day = ChoiceItem()
+        month = ChoiceItem()
+
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    period = models.CharField(max_length=5, choices=Periods.choices)
+    period_start = models.DateField()  # the first day of the period, in TIME_ZONE
+    deposited = models.DecimalField(decimal_places=2, max_digits=20, default=0)
+    spent = models.DecimalField(decimal_places=2, max_digits=20, default=0)  # the deductions, as a positive amount
+    operations = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('account', 'period', 'period_start')]  # also the index the summaries are read with
+
+    @classmethod
+    def add_operations(cls, operations):
+        rollups.add_operations(cls, operations)
+
+    @classmethod
+    def rebuild(cls, accounts=None):
+        """
+        Computes the rollups of the accounts (of all of them by default) from their ledgers.
+        """
+        operations = Operation.objects.all() if accounts is None else Operation.objects.filter(account__in=accounts)
+        with transaction.atomic():
+            (cls.objects.all() if accounts is None else cls.objects.filter(account__in=accounts)).delete()
+            rollups.rebuild(cls, operations)
+
+
+class CatalogueVersion(models.Model):
+    """
+    A single row counting the changes of the books. It's bumped in the transaction of every change (by the receivers
+    of Book's signals, see tasks.signals), so a purchase quoted from the price index (see tasks.prices) can check
+    in its own transaction that no price has changed since.
+    """
+    version = models.BigIntegerField(default=0)
+
+    @classmethod
+    def bump(cls):
+        if not cls.objects.filter(pk=1).update(version=F('version') + 1):
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})  # the first change of the catalogue
+
+    @classmethod
+    def current(cls):
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
 
 
 class Book(models.Model):
@@ -58,13 +143,68 @@ class Book(models.Model):
     """
     title = models.CharField(max_length=100)
     price = models.DecimalField(decimal_places=2, max_digits=10, validators=[MinValueValidator(Decimal('0.01'))])
+    stock = models.PositiveIntegerField(null=True, blank=True)  # copies left of a limited edition, null for the rest
+
+    class Meta:
+        # the catalogue is paginated by (price, id) or (title, id) pairs, these indexes make every page an index seek
+        indexes = [
+            models.Index(fields=['price', 'id'], name='book_price_id_idx'),
+            models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():  # the receivers of post_save bump the CatalogueVersion in the same transaction
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def take_from_stock(cls, quantities):
+        """
+        Takes the copies of a cart, {book_id: quantity} of limited editions, out of stock with a single
+        UPDATE ... SET stock = stock - quantity WHERE stock >= quantity, which only runs if every book has enough.
+        The check and the change are one statement of the database, so concurrent purchases of the same book
+        never oversell it and don't read the stock first. Must run in the transaction of the purchase,
+        which has to be rolled back when OutOfStock is raised, with every book short of copies.
+        """
+        if not quantities:
+            return
+        needed = Case(*(When(pk=book_id, then=Value(quantity)) for book_id, quantity in quantities.items()),
+                      output_field=models.PositiveIntegerField())
+        taken = cls.objects.filter(
+            ~Exists(cls.objects.filter(pk__in=quantities, stock__lt=needed)), pk__in=quantities, stock__gte=needed
+        ).update(stock=F('stock') - needed)
+        if taken < len(quantities):
+            left = {book_id: stock or 0 for book_id, stock in cls.objects.filter(pk__in=quantities).values_list(
+                'id', 'stock')}
+            raise OutOfStock({book_id: left.get(book_id, 0) for book_id, quantity in quantities.items()
+                              if left.get(book_id, 0) < quantity})
+
+
+class OutOfStock(ValueError):
+    """
+    Raised when a cart asks for more copies than are left, lists all of the books short of copies at once.
+    """
+
+    def __init__(self, shortages):
+        super().__init__(shortages)
+        self.shortages = shortages  # {book_id: copies left}
+
+
+class BooksDoNotExist(Book.DoesNotExist):
+    """
+    Raised when a cart refers to books that are not in the catalogue, lists all of the missing IDs at once.
+    """
+
+    def __init__(self, book_ids):
+        super().__init__(book_ids)
+        self.book_ids = book_ids
 
 
 class Purchase(models.Model):
     """
     Model stores data about purchases.
     """
-    books = models.ManyToManyField(Book)  # again, if we're bound to 4 of those models, there needs to be a many-to-many
+    # again, if we're bound to 4 of those models, there needs to be a many-to-many
+    books = models.ManyToManyField(Book, through='PurchaseBook')
     account = models.ForeignKey(Account, on_delete=models.CASCADE)
     operation = models.ForeignKey(Operation, on_delete=models.CASCADE, null=True)
 
@@ -74,11 +214,170 @@ class Purchase(models.Model):
 
     @classmethod
     def collect_books_and_return_purchase_cost(cls, books_id_list):
-        books = []
-        purchase_cost = 0
-        for book in books_id_list:  # due to many-to-many relationship with books, we need to pass them later
-            book_id = int(book)
-            book_object = Book.objects.get(id=book_id)
-            books.append(book_object)
-            purchase_cost += book_object.price
-        return books, purchase_cost
+        """
+        Returns the cart as {book_id: quantity}, its cost, the quantities of the limited editions in it, which have
+        to be taken out of stock with Book.take_from_stock() when the purchase is made, and the CatalogueVersion
+        of the prices, which has to be checked with prices.check_version() in the transaction of the purchase.
+        """
+        # the same ID repeated in a cart means buying more copies, so the cart is kept as {book_id: quantity}
+        quantities = Counter(int(book) for book in books_id_list)
+        # the prices of the worker's price index, only the books it doesn't know are read, with a single query
+        books, version = prices.price_index.quote(quantities)
+        missing_ids = [book_id for book_id in quantities if book_id not in books]
+        if missing_ids:
+            raise BooksDoNotExist(missing_ids)
+        # the stock itself isn't in the index, it's only checked by take_from_stock()
+        limited = {book_id: quantity for book_id, quantity in quantities.items() if books[book_id][1]}
+        purchase_cost = sum((books[book_id][0] * quantity for book_id, quantity in quantities.items()), Decimal(0))
+        return quantities, purchase_cost, limited, version
+
+    @classmethod
+    def purchase_in_bulk(cls, orders):
+        """
+        Places many orders, given as (account_id, books_id_list) pairs, at once. The books and the accounts are
+        resolved with a query each and all purchases, operations and their books are written with bulk inserts
+        in a single transaction, so the number of queries doesn't depend on the number of orders.
+        Returns a result for each order, the failed ones (e.g. insufficient funds) don't stop the others.
+        """
+        carts = [Counter(int(book) for book in books_id_list) for _, books_id_list in orders]
+        account_ids = {int(account_id) for account_id, _ in orders}
+        results = []
+        with transaction.atomic():
+            # a no-op UPDATE locks the accounts' rows (and takes the write lock in SQLite) before their balances
+            # are read, so nobody can change them until the purchases are committed
+            Account.objects.filter(pk__in=account_ids).update(balance=F('balance'))
+            balances = dict(Account.objects.filter(pk__in=account_ids).values_list('pk', 'balance'))
+            # read in the transaction as well, so no price changes between the quote and the charge
+            books = {book_id: (price, stock) for book_id, price, stock in
+                     Book.objects.filter(id__in=set().union(*carts)).values_list('id', 'price', 'stock')}
+            book_prices = {book_id: price for book_id, (price, _) in books.items()}
+            limited_ids = [book_id for book_id, (_, stock) in books.items() if stock is not None]
+            # the same for the stock of the limited editions, after the accounts, in the order of single purchases
+            stocks = dict(Book.objects.select_for_update().filter(pk__in=limited_ids).values_list('pk', 'stock')
+                          ) if limited_ids else {}
+            spent, taken = Counter(), Counter()
+            purchases, operations = [], []
+            for (account_id, _), cart in zip(orders, carts):
+                account_id = int(account_id)
+                missing_ids = [book_id for book_id in cart if book_id not in book_prices]
+                if account_id not in balances:
+                    results.append({'account': account_id, 'status': 'failed', 'reason': 'account does not exist'})
+                    continue
+                if missing_ids:
+                    results.append({'account': account_id, 'status': 'failed',
+                                    'reason': f'books do not exist: {missing_ids}'})
+                    continue
+                out_of_stock = [book_id for book_id, quantity in cart.items()
+                                if book_id in stocks and stocks[book_id] - taken[book_id] < quantity]
+                if out_of_stock:
+                    results.append({'account': account_id, 'status': 'failed',
+                                    'reason': f'books out of stock: {out_of_stock}'})
+                    continue
+                cost = sum((book_prices[book_id] * quantity for book_id, quantity in cart.items()), Decimal(0))
+                if not cls.is_transaction_possible(balances[account_id] - spent[account_id], cost):
+                    results.append({'account': account_id, 'status': 'failed', 'reason': 'insufficient funds'})
+                    continue
+                spent[account_id] += cost
+                taken.update({book_id: quantity for book_id, quantity in cart.items() if book_id in stocks})
+                operations.append(Operation(account_id=account_id, balance_change=-cost))
+                purchases.append(cls(account_id=account_id))
+                results.append({'account': account_id, 'status': 'success', 'books': list(cart.elements()),
+                                'cost': cost})
+            if not purchases:
+                return results
+
+            # the balances were checked above, under the lock, so one UPDATE applies every order
+            # (bulk_create() skips Operation.save(), which would otherwise apply them one by one)
+            Account.objects.filter(pk__in=spent).update(balance=F('balance') - Case(
+                *(When(pk=account_id, then=Value(amount)) for account_id, amount in spent.items()),
+                output_field=models.DecimalField(decimal_places=2, max_digits=20)))
+            Book.take_from_stock(taken)  # checked above, under the lock, so it never raises
+            bulk_create_with_ids(Operation, operations)
+            SpendingRollup.add_operations(operations)
+            for purchase, operation in zip(purchases, operations):
+                purchase.operation = operation
+            bulk_create_with_ids(cls, purchases)
+            successful_carts = [cart for cart, result in zip(carts, results) if result['status'] == 'success']
+            PurchaseBook.objects.bulk_create(
+                PurchaseBook(purchase=purchase, book_id=book_id, quantity=quantity)
+                for purchase, cart in zip(purchases, successful_carts) for book_id, quantity in cart.items())
+            OutboxMessage.publish(OutboxMessage.PURCHASE_CREATED, [
+                purchase.outbox_payload(cart, -operation.balance_change)
+                for purchase, operation, cart in zip(purchases, operations, successful_carts)])
+        successful_results = (result for result in results if result['status'] == 'success')
+        for purchase, result in zip(purchases, successful_results):
+            result['purchase'] = purchase.pk
+        return results
+
+    def add_books(self, quantities):
+        # due to many-to-many relationship with books, we need to pass them after the purchase is saved
+        # bulk_create writes every link in one INSERT instead of one books.add() per book
+        PurchaseBook.objects.bulk_create(
+            PurchaseBook(purchase=self, book_id=book_id, quantity=quantity) for book_id, quantity in quantities.items()
+        )
+
+    def outbox_payload(self, quantities, cost):
+        # the message of the purchase, for the handlers of OutboxMessage.PURCHASE_CREATED
+        return {'purchase': self.pk, 'account': self.account_id, 'operation': self.operation_id,
+                'books': {str(book_id): quantity for book_id, quantity in quantities.items()}, 'cost': str(cost)}
+
+
+class PurchaseBook(models.Model):
+    """
+    Links a purchase with the books bought, a book added to the cart several times is stored once with a quantity.
+    """
+    purchase = models.ForeignKey(Purchase, on_delete=models.CASCADE)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        db_table = 'tasks_purchase_books'  # the table created for the former auto-generated many-to-many
+        unique_together = [('purchase', 'book')]
+
+
+class IdempotencyKey(models.Model):
+    """
+    Remembers the response to a request sent with an Idempotency-Key header, so that a retry of the request
+    gets the same response again instead of being executed twice. See tasks.idempotency.
+    """
+    key = models.CharField(max_length=255)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    request_fingerprint = models.CharField(max_length=64)  # a key reused for a different request is rejected
+    response_status = models.PositiveSmallIntegerField(null=True)  # null while the first request is in progress
+    response_content_type = models.CharField(max_length=255, blank=True)
+    response_content = models.BinaryField(null=True)  # the rendered response, replayed byte for byte
+    locked_at = models.DateTimeField()  # when the request in progress started, to take over abandoned ones
+    expires = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = [('user', 'key')]
+
+
+class OutboxMessage(models.Model):
+    """
+    An event for the world outside of the database (e-mails, analytics, a message broker...), written in the
+    transaction of the change it reports, so it exists if and only if the change is committed. The requests only
+    pay for the INSERT, the run_outbox_worker command hands the messages to their handlers later, see tasks.outbox.
+    """
+    PURCHASE_CREATED = 'purchase.created'
+
+    topic = models.CharField(max_length=100)
+    payload = models.JSONField()
+    created = models.DateTimeField(auto_now_add=True)
+    # when the message is due: right away, after a failed attempt the time of the retry, while a worker holds it
+    # the end of its lease, so it comes back by itself if the worker dies; null once the retries are given up
+    available_at = models.DateTimeField(null=True, default=timezone.now)
+    lease = models.CharField(max_length=32, blank=True)  # the claim of the worker holding the message
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        # the workers claim the due messages in this order, the delivered ones are deleted, so the table stays small
+        indexes = [models.Index(fields=['available_at', 'id'], name='outbox_available_idx')]
+
+    @classmethod
+    def publish(cls, topic, payloads):
+        """
+        Writes a message per payload with a single INSERT, inside the transaction of the change they report.
+        """
+        cls.objects.bulk_create(cls(topic=topic, payload=payload) for payload in payloads)
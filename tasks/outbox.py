@@ -0,0 +1,83 @@
+"""
+Delivery of the transactional outbox. The purchases write an OutboxMessage in their own transaction, which costs
+them an INSERT and nothing else, the run_outbox_worker command claims the due messages in batches and runs
+the handlers of their topic, settings.OUTBOX_HANDLERS, in a thread pool. The delivery is at least once:
+a message is retried, with all the handlers of its topic, when one of them fails or when its worker dies before
+reporting it, so the handlers have to be idempotent, e.g. keyed by the purchase ID of the payload.
+"""
+import logging
+import uuid
+from concurrent.futures import wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from tasks.models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+
+def log_message(message):
+    """
+    The default handler, a placeholder for a real integration.
+    """
+    logger.info('%s %s', message.topic, message.payload)
+
+
+def claim(batch_size, lease_seconds):
+    """
+    Leases up to batch_size due messages to the caller: their available_at is moved to the end of the lease,
+    so no other worker takes them meanwhile, and they are due again if the caller dies without reporting them.
+    """
+    now = timezone.now()
+    lease = uuid.uuid4().hex
+    leased_until = now + timedelta(seconds=lease_seconds)
+    due = OutboxMessage.objects.filter(available_at__lte=now).order_by('available_at', 'id')
+    changes = {'available_at': leased_until, 'lease': lease, 'attempts': F('attempts') + 1}
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            # e.g. PostgreSQL, the messages other workers are claiming at this moment are skipped, not waited for
+            claimed = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:batch_size])
+            OutboxMessage.objects.filter(pk__in=claimed).update(**changes)
+        else:
+            # SQLite has no row locks, but the UPDATE holds the write lock of the whole database while its
+            # subquery picks the messages, so the workers claim them one after another and never the same ones
+            OutboxMessage.objects.filter(pk__in=due.values('pk')[:batch_size]).update(**changes)
+    # found through the index by the end of the lease, which is exactly the one just written
+    return list(OutboxMessage.objects.filter(available_at=leased_until, lease=lease).order_by('id'))
+
+
+def handle(message, handlers):
+    close_old_connections()  # the connections of the pool's threads follow CONN_MAX_AGE, as those of requests do
+    for handler in handlers:
+        handler(message)
+
+
+def deliver(messages, pool):
+    """
+    Runs the handlers of the messages in the pool, the delivered messages are deleted and the failed ones
+    are retried later. Returns the numbers of delivered and failed messages.
+    """
+    handlers = {topic: [import_string(path) for path in settings.OUTBOX_HANDLERS.get(topic, ())]
+                for topic in {message.topic for message in messages}}
+    futures = {pool.submit(handle, message, handlers[message.topic]): message for message in messages}
+    wait(futures)
+    failed = {futures[future]: future.exception() for future in futures if future.exception() is not None}
+    # only the messages still leased to this worker, one whose lease has expired belongs to another by now
+    OutboxMessage.objects.filter(pk__in=[message.pk for message in messages if message not in failed],
+                                 lease=messages[0].lease).delete()
+    now = timezone.now()
+    for message, error in failed.items():
+        logger.warning('Outbox message %s (%s) failed, attempt %s: %r', message.pk, message.topic,
+                       message.attempts, error)
+        if message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            retry_at = None  # given up, kept with the error until somebody makes it due again
+        else:  # the delay doubles with every failed attempt
+            retry_at = now + timedelta(seconds=settings.OUTBOX_RETRY_DELAY * 2 ** (message.attempts - 1))
+        OutboxMessage.objects.filter(pk=message.pk, lease=message.lease).update(
+            available_at=retry_at, lease='', last_error=repr(error))
+    return len(messages) - len(failed), len(failed)
@@ -0,0 +1,158 @@
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from tasks.encoders import EncodedJSON, encode_link
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination which remembers the (ordering value, id) pair of the last row it has sent.
+    The next page starts with an index seek on that pair instead of an OFFSET, so every page costs
+    the same, however deep it is. The ordering is picked with ?ordering=, e.g. ?ordering=-price.
+    """
+    page_size = 100
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    ordering_fields = ('id',)  # every field needs a composite (field, id) index, the id breaks ties
+    default_ordering = 'id'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.field, self.descending = self.get_ordering(request)
+        self.cursor = self.decode_cursor(request, queryset.model)
+
+        # a "previous" cursor walks the index the other way round, the rows are flipped back afterwards
+        reverse = self.cursor is not None and self.cursor['reverse']
+        descending = self.descending != reverse
+        if self.cursor is not None:
+            queryset = queryset.filter(self.after(self.cursor['value'], self.cursor['id'], descending))
+        queryset = queryset.order_by(*self.order_by(descending))
+
+        rows = list(queryset[:self.page_size + 1])  # the extra row tells if there is anything after this page
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_encoded_paginated_response(self, encoded_rows):
+        # the same envelope as get_paginated_response(), around rows encoded by a RowEncoder
+        return Response(EncodedJSON('{"next":%s,"previous":%s,"results":%s}' % (
+            encode_link(self.get_next_link()), encode_link(self.get_previous_link()), encoded_rows)))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        field = ordering.lstrip('-')
+        if field not in self.ordering_fields:  # any other ordering would not be backed by an index
+            field, ordering = self.default_ordering.lstrip('-'), self.default_ordering
+        return field, ordering.startswith('-')
+
+    def order_by(self, descending):
+        prefix = '-' if descending else ''
+        if self.field == 'id':
+            return [prefix + 'id']
+        return [prefix + self.field, prefix + 'id']
+
+    def after(self, value, pk, descending):
+        """
+        Rows that come after (value, pk) in the current ordering. The first condition on its own
+        is enough for the index seek, the second one skips the rows tied with the cursor.
+        """
+        beyond, beyond_or_equal = ('lt', 'lte') if descending else ('gt', 'gte')
+        if self.field == 'id':
+            return Q(**{f'id__{beyond}': pk})
+        return (Q(**{f'{self.field}__{beyond_or_equal}': value}) &
+                (Q(**{f'{self.field}__{beyond}': value}) | Q(**{f'id__{beyond}': pk})))
+
+    def get_key_fields(self, request):
+        # what get_row_key() reads from the rows, views fetching only some of the columns add them
+        field, _ = self.get_ordering(request)
+        return [field, 'id'] if field != 'id' else ['id']
+
+    def get_row_key(self, row):
+        if isinstance(row, dict):  # rows fetched with .values()
+            return row[self.field], row['id']
+        if isinstance(row, tuple):  # rows fetched with .values_list(named=True)
+            return getattr(row, self.field), row.id
+        return getattr(row, self.field), row.pk
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            # the value is compared with the ordering field, so it has to be a value of that field
+            value = model._meta.get_field(self.field).to_python(cursor['v'])
+            if value is None or isinstance(value, Decimal) and not value.is_finite():
+                raise ValueError(value)
+            cursor = {'value': value, 'id': int(cursor['i']), 'reverse': bool(cursor['r'])}
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, row, reverse):
+        value, pk = self.get_row_key(row)
+        # the value is kept as a string, so Decimal prices survive the round trip exactly
+        cursor = json.dumps({'v': str(value), 'i': pk, 'r': int(reverse)}, separators=(',', ':'))
+        encoded = b64encode(cursor.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:  # an empty "previous" page, the next one starts where the cursor pointed
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+
+class BookPagination(KeysetPagination):
+    ordering_fields = ('id', 'price', 'title')
@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from rest_framework import permissions
 
 
@@ -14,3 +16,25 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
 
         # Write permissions are only allowed to the owner of the snippet.
         return obj.owner == request.user
+
+
+class IsOwnerOrStaff(permissions.BasePermission):
+    """
+    Custom permission to only allow owners of an object and staff members (e.g. auditors) to see it.
+    """
+
+    def has_object_permission(self, request, view, obj):
+        return request.user.is_staff or obj.owner_id == request.user.pk  # without loading the owner
+
+
+class IsStaffOrMetricsScraper(permissions.BasePermission):
+    """
+    Custom permission to only allow staff members and the metrics scraper, which sends
+    an "Authorization: Bearer <METRICS_TOKEN>" header, to read the metrics.
+    """
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_staff:
+            return True
+        token = settings.METRICS_TOKEN
+        return bool(token) and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}')
@@ -0,0 +1,95 @@
+"""
+The price index of a worker, the prices of the books bought lately, so the checkout doesn't read them from the
+database for every purchase. A bounded LRU of {book_id: (price, limited edition)}, stamped with the
+CatalogueVersion it was read at. It's emptied:
+- in the worker which saves or deletes a book, by the receivers of Book's signals (see tasks.signals),
+- in the other workers, when the catalogue version of the shared cache (see tasks.caching) has changed,
+- when a cart read from the database has another CatalogueVersion than the one of the index.
+The first two are fast, but the version of the shared cache changes only once the change is committed, so
+a purchase compares the version it was priced at with CatalogueVersion in its own transaction, check_version(),
+and a stale price is never charged.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Subquery
+
+from tasks import models
+from tasks.caching import get_catalogue_version
+from tasks.metrics import registry
+
+
+class StalePrices(ValueError):
+    """
+    Raised in the transaction of a purchase when the catalogue has changed since its cart was priced.
+    """
+
+
+class PriceIndex:
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()  # the least recently used first
+        self.version = None  # the CatalogueVersion of the entries
+        self.shared_version = None  # the catalogue version of the shared cache when they were read
+
+    def quote(self, book_ids):
+        """
+        Returns {book_id: (price, limited)} of the books which exist and the CatalogueVersion of their prices.
+        """
+        book_ids = set(book_ids)
+        shared_version = get_catalogue_version()
+        with self.lock:
+            if shared_version != self.shared_version:  # a book was changed by another worker, or the cache cleared
+                self.clear()
+                self.shared_version = shared_version
+            found = {book_id: self.entries[book_id] for book_id in book_ids if book_id in self.entries}
+            for book_id in found:
+                self.entries.move_to_end(book_id)
+            version = self.version
+        registry.count('price_index_hits', len(found))
+        if found and len(found) == len(book_ids):
+            return found, version
+
+        registry.count('price_index_misses', len(book_ids) - len(found))
+        # the whole cart with a single query, the version included, so all of its prices are of the same version
+        rows = list(models.Book.objects.filter(id__in=book_ids).annotate(
+            catalogue_version=Subquery(models.CatalogueVersion.objects.filter(pk=1).values('version'))
+        ).values_list('id', 'price', 'stock', 'catalogue_version'))
+        if not rows:  # none of the books exists
+            return {}, models.CatalogueVersion.current()
+        books = {book_id: (price, stock is not None) for book_id, price, stock, _ in rows}
+        version = rows[0][3] or 0
+        with self.lock:
+            if self.version is None or version > self.version:  # older entries than the cart, or none at all
+                self.clear()
+                self.version = version
+            if version == self.version:  # not if another thread has read a newer version in the meantime
+                for book_id, entry in books.items():
+                    self.entries[book_id] = entry
+                    self.entries.move_to_end(book_id)
+                while len(self.entries) > settings.PRICE_INDEX_SIZE:
+                    self.entries.popitem(last=False)
+        return books, version
+
+    def clear(self):
+        with self.lock:
+            if self.entries:
+                registry.count('price_index_invalidations')
+            self.entries.clear()
+            self.version = None
+
+
+price_index = PriceIndex()  # per process, every gunicorn worker has its own
+
+
+def check_version(version):
+    """
+    Raises StalePrices if the catalogue has changed since the prices of the given version were read.
+    Must be called in the transaction of the purchase, after its writes, so no change of a price is committed
+    between the check and the purchase (in SQLite the transaction holds the write lock by then).
+    """
+    if models.CatalogueVersion.current() != version:
+        price_index.clear()  # the purchase is priced again from the database
+        raise StalePrices(version)
@@ -0,0 +1,77 @@
+import json
+from decimal import Decimal
+
+import msgpack
+from rest_framework.renderers import BaseRenderer, BrowsableAPIRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+from tasks.encoders import EncodedJSON
+
+
+class StatementRenderer(BaseRenderer):
+    """
+    The statement itself is streamed by the view, a renderer is only needed for content negotiation
+    (?format=, the .csv/.jsonl suffixes or the Accept header) and for error responses.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode(self.charset)
+
+
+class CSVStatementRenderer(StatementRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class JSONLinesStatementRenderer(StatementRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+
+
+class PreEncodedJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer which sends the JSON encoded by the fast path of the list views (see tasks.encoders) as it is.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, EncodedJSON):
+            return data.encode('utf-8')
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack (?format=msgpack, the .msgpack suffix or Accept: application/msgpack), the data of the JSON
+    in fewer bytes, which also take less time to decode. Decimals are sent as the strings of their exact value,
+    as in the JSON, never as floats.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_extra_types, use_bin_type=True)
+
+
+def encode_extra_types(value):
+    if isinstance(value, Decimal):  # e.g. of a DecimalField with coerce_to_string=False
+        return f'{value:f}'
+    return JSONEncoder().default(value)  # dates, UUIDs, lazy translations... as in REST framework's JSON
+
+
+# the renderers of the list views
+LIST_RENDERERS = [PreEncodedJSONRenderer, MessagePackRenderer, BrowsableAPIRenderer]
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        return json.dumps(data).encode(self.charset)  # errors, e.g. a missing permission
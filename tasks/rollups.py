@@ -0,0 +1,79 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import Count, DateField, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+CENT = Decimal('0.01')
+ROLLUPS_PER_QUERY = 150  # 6 parameters each, below the 999 of older SQLite versions
+
+
+def period_starts(created):
+    """
+    The first day of the day and of the month an operation belongs to, in TIME_ZONE.
+    """
+    day = timezone.localtime(created).date()
+    return ('day', day), ('month', day.replace(day=1))
+
+
+def add_operations(rollup_model, operations):
+    """
+    Adds the operations to the rollups of their periods, with an INSERT ... ON CONFLICT DO UPDATE of ROLLUPS_PER_QUERY
+    rollups at a time, which creates the missing ones and adds to the existing ones by their unique key, so it takes
+    the same time per rollup whatever the number of accounts. Must run in the transaction which writes the operations
+    and has locked their accounts' rows (as every writer of operations does).
+    """
+    totals = defaultdict(lambda: [Decimal(0), Decimal(0), 0])
+    for operation in operations:
+        for period, start in period_starts(operation.created):
+            total = totals[(operation.account_id, period, start)]
+            if operation.balance_change >= 0:
+                total[0] += operation.balance_change
+            else:
+                total[1] -= operation.balance_change
+            total[2] += 1
+    if not totals:
+        return
+    # written by hand, bulk_create() of Django 3.2 can't update on conflict. SQLite and PostgreSQL both take this SQL,
+    # the columns of the existing row are qualified with the table, PostgreSQL rejects them as ambiguous otherwise
+    table = rollup_model._meta.db_table
+    ops = connection.ops
+    rows = [(account_id, period, ops.adapt_datefield_value(start), ops.adapt_decimalfield_value(deposited, 20, 2),
+             ops.adapt_decimalfield_value(spent, 20, 2), operations_count)
+            for (account_id, period, start), (deposited, spent, operations_count) in totals.items()]
+    with connection.cursor() as cursor:
+        for first in range(0, len(rows), ROLLUPS_PER_QUERY):
+            batch = rows[first:first + ROLLUPS_PER_QUERY]
+            cursor.execute(
+                f'INSERT INTO {table} (account_id, period, period_start, deposited, spent, operations) '
+                f'VALUES {", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT (account_id, period, period_start) DO UPDATE SET '
+                f'deposited = {table}.deposited + excluded.deposited, spent = {table}.spent + excluded.spent, '
+                f'operations = {table}.operations + excluded.operations',
+                [param for row in batch for param in row])
+
+
+def rebuild(rollup_model, operations, batch_size=10000):
+    """
+    Creates the rollups of the given operations from scratch, with a GROUP BY per period.
+    Takes the models as arguments, so the migration which creates the table can backfill it as well.
+    """
+    for period, trunc in (('day', TruncDate('created')), ('month', TruncMonth('created', output_field=DateField()))):
+        groups = operations.annotate(period_start=trunc).order_by().values('account_id', 'period_start').annotate(
+            deposited_total=Sum('balance_change', filter=Q(balance_change__gt=0)),
+            spent_total=Sum('balance_change', filter=Q(balance_change__lt=0)),
+            operations_total=Count('id'))
+        batch = []
+        for group in groups.iterator(chunk_size=batch_size):
+            batch.append(rollup_model(
+                account_id=group['account_id'], period=period, period_start=group['period_start'],
+                # SQLite adds the decimals up as floats, the result is rounded back to cents
+                deposited=Decimal(group['deposited_total'] or 0).quantize(CENT),
+                spent=-Decimal(group['spent_total'] or 0).quantize(CENT),
+                operations=group['operations_total']))
+            if len(batch) >= batch_size:
+                rollup_model.objects.bulk_create(batch)
+                batch = []
+        rollup_model.objects.bulk_create(batch)
@@ -0,0 +1,62 @@
+"""
+Reads from the read replicas of settings.DATABASE_REPLICAS. Only the views which allow it (see ReplicaReadMixin)
+send the reads of GET, HEAD and OPTIONS requests there, everything else goes to the primary, and so does every read
+of a request once it has written something or while it's in a transaction. A user who has written anything
+reads from the primary for REPLICA_READ_YOUR_WRITES_WINDOW seconds afterwards, longer than the replicas lag behind,
+so a purchase is never followed by a stale balance. The recent writers are kept in the shared cache, so the window
+holds whichever worker serves the next request.
+"""
+import contextvars
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+RECENT_WRITE_KEY = 'recent-write:{}'
+
+# the routing of the request being served, set by tasks.middleware.ReplicaRoutingMiddleware
+current_routing = contextvars.ContextVar('current_routing', default=None)
+
+
+class RequestRouting:
+    __slots__ = ('replica', 'wrote')
+
+    def __init__(self):
+        self.replica = None  # until the view allows the replicas
+        self.wrote = False
+
+
+def read_from_replica(user):
+    """
+    Sends the following reads of this request to one of the replicas, unless the user has written recently.
+    """
+    routing = current_routing.get()
+    if routing is None or not settings.DATABASE_REPLICAS:
+        return
+    if user.is_authenticated and cache.get(RECENT_WRITE_KEY.format(user.pk)):
+        return
+    routing.replica = random.choice(settings.DATABASE_REPLICAS)
+
+
+def remember_write(user):
+    if user.is_authenticated and settings.DATABASE_REPLICAS:
+        cache.set(RECENT_WRITE_KEY.format(user.pk), True, timeout=settings.REPLICA_READ_YOUR_WRITES_WINDOW)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = current_routing.get()
+        if routing is None or routing.replica is None or routing.wrote or \
+                connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # the replicas hold the same rows as the primary
@@ -1,21 +1,82 @@
+from django.conf import settings
 from rest_framework import serializers
-from tasks.models import Book, Account, Purchase
+from tasks.models import Book, Account, Purchase, BooksDoNotExist, SpendingRollup
 
 
-class BookSerializer(serializers.ModelSerializer):
+class SparseFieldsetSerializer(serializers.ModelSerializer):
+    """
+    Can be narrowed to some of its fields with e.g. BookSerializer(books, fields=['id', 'title']),
+    the list views pass what was asked for with ?fields=id,title. The fields keep the order of Meta.fields.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            unknown = [name for name in fields if name not in self.fields]
+            if unknown or not fields:
+                raise serializers.ValidationError(
+                    {'fields': [f'Pick some of: {", ".join(self.fields)}.']})
+            for name in [name for name in self.fields if name not in fields]:
+                self.fields.pop(name)
+
+
+class BookSerializer(SparseFieldsetSerializer):
     class Meta:
         model = Book
         fields = ['id', 'title', 'price']
 
 
-class AccountSerializer(serializers.ModelSerializer):
+class AccountSerializer(SparseFieldsetSerializer):
     class Meta:
         model = Account
         fields = ['id', 'owner', 'balance']
 
 
+class SpendingRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SpendingRollup
+        fields = ['period_start', 'deposited', 'spent', 'operations']
+
+
 class PurchaseSerializer(serializers.ModelSerializer):
+    # a PrimaryKeyRelatedField would look every book up separately, so the IDs are taken as plain integers
+    # and the whole cart is resolved with one query in validate_books
+    books = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False)
+
     class Meta:
         model = Purchase
         optional_fields = ['operation']
         fields = ('id', 'books', 'account')
+        read_only_fields = ('account',)  # the account always belongs to the logged user, it's passed on save()
+
+    def validate_books(self, books_id_list):
+        try:
+            self.quantities, self.purchase_cost, self.limited_quantities, self.catalogue_version = \
+                Purchase.collect_books_and_return_purchase_cost(books_id_list)
+        except BooksDoNotExist as error:  # every missing book is reported in the same response
+            raise serializers.ValidationError(
+                [f'Invalid pk "{book_id}" - object does not exist.' for book_id in error.book_ids])
+        return books_id_list
+
+    def create(self, validated_data):
+        validated_data.pop('books')
+        purchase = Purchase.objects.create(**validated_data)
+        purchase.add_books(self.quantities)
+        return purchase
+
+
+def out_of_stock_messages(error):
+    return [f'Book "{book_id}" is out of stock, {left} left.' for book_id, left in error.shortages.items()]
+
+
+class BatchOrderSerializer(serializers.Serializer):
+    account = serializers.IntegerField(min_value=1)
+    books = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False)
+
+
+class BatchPurchaseSerializer(serializers.Serializer):
+    # the books and the accounts are checked per order by Purchase.purchase_in_bulk, so one unknown ID
+    # fails only its own order and not the whole batch
+    # capped, so a single request can't hold the write lock for as long as it likes
+    orders = serializers.ListField(child=BatchOrderSerializer(), allow_empty=False,
+                                   max_length=settings.BATCH_PURCHASE_MAX_ORDERS)
@@ -0,0 +1,79 @@
+from django.core.signals import request_started
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.contrib.auth.models import User
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from tasks.authentication import evict_tokens, evict_tokens_of_user
+from tasks.caching import bump_catalogue_version
+from tasks.metrics import record_query
+from tasks.models import Account, Book, CatalogueVersion
+from tasks.prices import price_index
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_catalogue(sender, **kwargs):
+    # right away, so this transaction doesn't read its own stale responses, and again once the change is committed,
+    # since in the meantime other workers could have cached the old rows under the new version
+    # bulk_create() and update() send no signals, code using them calls bump_catalogue_version() itself
+    bump_catalogue_version()
+    transaction.on_commit(bump_catalogue_version)
+    # in the transaction of the change (Book.save() is atomic), the version purchases check in theirs
+    CatalogueVersion.bump()
+    price_index.clear()
+
+
+@receiver(post_delete, sender=Token)
+def revoke_token(sender, instance, **kwargs):
+    evict_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+def evict_tokens_of_changed_user(sender, instance, created, update_fields=None, **kwargs):
+    # not for the last_login saved at every login, nothing cached depends on it
+    if not created and set(update_fields or ()) != {'last_login'}:
+        evict_tokens_of_user(instance.pk)
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def evict_tokens_of_account_owner(sender, instance, created=True, **kwargs):
+    # the balance isn't cached, only which account a user has
+    if created:
+        evict_tokens_of_user(instance.owner_id)
+
+
+@receiver(connection_created)
+def count_queries(sender, connection, **kwargs):
+    # for every connection of every thread, the queries are only counted while a request is being served
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def set_sqlite_pragmas(sender, connection, **kwargs):
+    # PRAGMAS of the database settings, see BookListAPI/database.py
+    pragmas = connection.settings_dict.get('PRAGMAS')
+    if connection.vendor == 'sqlite' and pragmas:
+        with connection.cursor() as cursor:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def close_if_broken(connection):
+    """
+    Closes a persistent connection which no longer works (e.g. the database was restarted), so the next query
+    opens a new one instead of failing. What CONN_HEALTH_CHECKS does from Django 4.1 on.
+    """
+    if connection.settings_dict.get('CONN_HEALTH_CHECKS') and connection.connection is not None and \
+            not connection.in_atomic_block and not connection.is_usable():
+        connection.close()
+
+
+@receiver(request_started)
+def check_persistent_connections(sender, **kwargs):
+    for connection in connections.all():
+        close_if_broken(connection)
@@ -0,0 +1,68 @@
+import time
+from statistics import median
+
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from tasks.models import Account
+from tasks.tests.benchmarks.bench_pagination import seed_books
+from tasks.tests.benchmarks.utils import dataset_size, measure, report
+
+
+def seed_accounts(amount, chunk=50000):
+    for start in range(0, amount, chunk):
+        User.objects.bulk_create(User(username=f'benchmark-user-{number}')
+                                 for number in range(start, min(start + chunk, amount)))
+    users = User.objects.filter(username__startswith='benchmark-user-').values_list('id', flat=True).iterator()
+    batch = []
+    for user_id in users:
+        batch.append(Account(owner_id=user_id, balance=user_id % 10000 + 0.5))
+        if len(batch) == chunk:
+            Account.objects.bulk_create(batch)
+            batch = []
+    Account.objects.bulk_create(batch)
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})  # books too
+def test_account_list_scoped_to_the_user_and_sparse_fieldsets():
+    accounts_amount = dataset_size('BENCHMARK_ACCOUNTS', 200000)
+    seed_accounts(accounts_amount)
+    seed_books(dataset_size('BENCHMARK_BOOKS', 10000))
+    client = APIClient()
+    client.force_authenticate(User.objects.get(username='benchmark-user-0'))
+
+    urls = {
+        'all the accounts': '/accounts/',
+        'all the accounts, ?fields=id': '/accounts/?fields=id',
+        '?owner=me': '/accounts/?owner=me',
+        '?owner=me&fields=balance': '/accounts/?owner=me&fields=balance',
+        '1000 books': '/books/?page_size=1000',
+        '1000 books, ?fields=title': '/books/?page_size=1000&fields=title',
+    }
+    results, sizes, query_times = {}, {}, {}
+    for name, url in urls.items():
+        repeat = 5 if name.startswith('all') else 20
+        results[name] = measure(lambda: client.get(url, HTTP_ACCEPT='application/json'), repeat=repeat)
+        sizes[name] = len(client.get(url, HTTP_ACCEPT='application/json').content)
+        with CaptureQueriesContext(connection) as context:
+            client.get(url, HTTP_ACCEPT='application/json')
+        sql = context.captured_queries[-1]['sql']
+        with connection.cursor() as cursor:  # the query on its own, without the encoding
+            start = time.perf_counter()
+            cursor.execute(sql)
+            cursor.fetchall()
+            query_times[name] = (time.perf_counter() - start) * 1000
+    report(f'GET /accounts/ with {accounts_amount} accounts and GET /books/', results)
+    print(f'\n{"":<42} {"payload":>12} {"query":>12}')
+    for name in urls:
+        print(f'  {name:<40} {sizes[name]:>10} B {query_times[name]:>9.3f} ms')
+
+    assert (sizes['?owner=me'] < 200 and sizes['all the accounts, ?fields=id'] < sizes['all the accounts'])
+    assert (sizes['1000 books, ?fields=title'] < sizes['1000 books'])
+    # an index seek on the owner, however many accounts there are
+    assert (median(results['?owner=me']) * 20 < median(results['all the accounts']))
@@ -0,0 +1,87 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+
+import pytest
+from django.conf import settings
+from django.db import connection
+from tasks.models import Book
+from tasks.tests.benchmarks.utils import dataset_size, report
+
+# both servers get the same number of workers, the only difference is the WSGI or ASGI application
+SERVERS = {
+    'WSGI (gunicorn sync workers)': ['gunicorn', 'BookListAPI.wsgi:application', '-k', 'sync'],
+    'ASGI (gunicorn uvicorn workers)': ['gunicorn', 'BookListAPI.asgi:application',
+                                        '-k', 'uvicorn.workers.UvicornWorker'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(command, port, workers, **environment):
+    env = dict(os.environ, SQLITE_PATH=connection.settings_dict['NAME'],
+               # every request goes to the database, otherwise the catalogue cache would be measured
+               CACHE_BACKEND='django.core.cache.backends.dummy.DummyCache',
+               # all the clients share an IP, the load tests are no flood
+               THROTTLE_PURCHASES_PER_USER='1000000/s', THROTTLE_PURCHASES_PER_IP='1000000/s', **environment)
+    server = subprocess.Popen(command + ['--bind', f'127.0.0.1:{port}', '--workers', str(workers)],
+                              cwd=settings.BASE_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            get(port, '/books/')
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    pytest.fail(f'{command[1]} did not start')
+
+
+def get(port, url):
+    client = HTTPConnection('127.0.0.1', port, timeout=60)
+    start = time.perf_counter()
+    try:
+        client.request('GET', url, headers={'Accept': 'application/json'})
+        response = client.getresponse()
+        response.read()
+        assert (response.status == 200)
+    finally:
+        client.close()
+    return (time.perf_counter() - start) * 1000
+
+
+def load(port, concurrency, requests_amount, page_size):
+    with ThreadPoolExecutor(concurrency) as pool:
+        return sorted(pool.map(lambda _: get(port, f'/books/?page_size={page_size}'), range(requests_amount)))
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db(transaction=True)  # the servers run in other processes, they only see committed books
+def test_book_list_latency_under_wsgi_and_asgi():
+    if shutil.which('gunicorn') is None or sys.platform == 'win32':
+        pytest.skip('the load test needs gunicorn')
+    workers = dataset_size('BENCHMARK_WORKERS', 2)
+    requests_amount = dataset_size('BENCHMARK_REQUESTS', 400)
+    page_size = dataset_size('BENCHMARK_PAGE_SIZE', 500)
+    Book.objects.bulk_create(Book(title=f'Book {number:06}', price=1 + number % 97) for number in range(5000))
+
+    for name, command in SERVERS.items():
+        port = free_port()
+        server = start_server(command, port, workers)
+        try:
+            results = {}
+            for concurrency in (1, 8, 32, 64):
+                results[f'{concurrency} concurrent clients'] = load(port, concurrency, requests_amount, page_size)
+        finally:
+            server.terminate()
+            server.wait()
+        report(f'GET /books/?page_size={page_size}, {name}, {workers} workers', results)
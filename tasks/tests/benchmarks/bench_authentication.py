@@ -0,0 +1,33 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from tasks.tests.benchmarks.bench_purchases import seed_shop
+from tasks.tests.benchmarks.utils import dataset_size, measure, report
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_purchase_with_a_session_against_a_cached_token(settings):
+    purchases_amount = dataset_size('BENCHMARK_PURCHASES', 200)
+    settings.THROTTLE_RATES = {}  # the purchases are measured, not the limits of a single client
+    accounts, book_ids = seed_shop(1)
+    user = accounts[0].owner
+    user.set_password('benchmark')
+    user.save()
+    clients = {'session': APIClient(), 'token': APIClient()}
+    clients['session'].login(username=user.username, password='benchmark')
+    clients['token'].credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+
+    results, queries = {}, {}
+    for name, client in clients.items():
+        def buy():
+            assert (client.post('/books/buy/', {'books': book_ids[:3]}, format='json').status_code == 201)
+        results[f'POST /books/buy/ with a {name}'] = measure(buy, repeat=purchases_amount)
+        with CaptureQueriesContext(connection) as context:
+            buy()
+        queries[name] = len(context.captured_queries)
+    report(f'{purchases_amount} purchases', results)
+    print(f'  queries per purchase: {queries["session"]} with a session, {queries["token"]} with a token')
+    assert (queries['session'] - queries['token'] >= 3)
@@ -0,0 +1,79 @@
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+
+import pytest
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection
+from django.middleware.csrf import _get_new_csrf_token
+from tasks.models import Purchase
+from tasks.tests.benchmarks.bench_asgi import free_port, start_server
+from tasks.tests.benchmarks.bench_purchases import seed_shop
+from tasks.tests.benchmarks.utils import dataset_size, percentile, report
+
+SERVER = ['gunicorn', 'BookListAPI.wsgi:application', '-k', 'sync']
+
+
+def log_in(user):
+    # a session as the login page would create it, the password hashing of a real login isn't measured
+    session = SessionStore()
+    session.update({SESSION_KEY: str(user.pk), BACKEND_SESSION_KEY: 'django.contrib.auth.backends.ModelBackend',
+                    HASH_SESSION_KEY: user.get_session_auth_hash()})
+    session.create()
+    csrf_token = _get_new_csrf_token()
+    return {'Cookie': f'sessionid={session.session_key}; csrftoken={csrf_token}', 'X-CSRFToken': csrf_token,
+            'Content-Type': 'application/json', 'Accept': 'application/json'}
+
+
+def buy(port, headers, book_ids):
+    client = HTTPConnection('127.0.0.1', port, timeout=60)
+    start = time.perf_counter()
+    try:
+        client.request('POST', '/books/buy/', body='{"books": [%s]}' % ','.join(map(str, book_ids)), headers=headers)
+        response = client.getresponse()
+        response.read()
+    finally:
+        client.close()
+    return (time.perf_counter() - start) * 1000, response.status
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db(transaction=True)  # the servers run in other processes, they only see committed rows
+def test_concurrent_purchases_per_database_profile():
+    if shutil.which('gunicorn') is None or sys.platform == 'win32':
+        pytest.skip('the load test needs gunicorn')
+    workers = dataset_size('BENCHMARK_WORKERS', 4)
+    concurrency = dataset_size('BENCHMARK_CLIENTS', 16)
+    requests_amount = dataset_size('BENCHMARK_REQUESTS', 800)
+    accounts, book_ids = seed_shop(concurrency * 4)
+    logins = [log_in(account.owner) for account in accounts]  # every client buys for its own accounts
+
+    results = {}
+    try:
+        for profile in ('default', 'performance'):  # the default one first, WAL stays on in the database file
+            port = free_port()
+            server = start_server(SERVER, port, workers, DATABASE_PROFILE=profile)
+            try:
+                before = Purchase.objects.count()
+                start = time.perf_counter()
+                with ThreadPoolExecutor(concurrency) as pool:
+                    responses = list(pool.map(
+                        lambda number: buy(port, logins[number % len(logins)],
+                                           book_ids[number % len(book_ids):][:3]),
+                        range(requests_amount)))
+                elapsed = time.perf_counter() - start
+            finally:
+                server.terminate()
+                server.wait()
+            failed = sum(status != 201 for _, status in responses)
+            assert (Purchase.objects.count() - before == requests_amount - failed)
+            results[profile] = sorted(duration for duration, _ in responses)
+            print(f'\n{profile} profile: {requests_amount / elapsed:.0f} purchases/s, {failed} failed, '
+                  f'p95 {percentile(results[profile], 0.95):.1f} ms')
+    finally:
+        with connection.cursor() as cursor:  # back to the journal the other tests expect
+            cursor.execute('PRAGMA journal_mode = DELETE')
+    report(f'POST /books/buy/, {concurrency} concurrent clients, {workers} gunicorn workers', results)
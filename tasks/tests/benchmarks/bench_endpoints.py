@@ -0,0 +1,140 @@
+"""
+Latency and query count of every route in tasks/urls.py, compared with baseline.json:
+    pytest -m benchmark -s tasks/tests/benchmarks/bench_endpoints.py
+A route fails when it runs more queries than its view declares in query_budget, more queries than in the baseline,
+or when its median latency is more than BENCHMARK_REGRESSION_THRESHOLD (0.5 = 50%) above the baseline.
+The baseline is machine specific, after an intended change (or on another machine) it's written again with:
+    BENCHMARK_UPDATE_BASELINE=1 pytest -m benchmark -s tasks/tests/benchmarks/bench_endpoints.py
+"""
+import json
+import os
+import time
+from statistics import median
+
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from rest_framework.test import APIClient
+from tasks import urls
+from tasks.models import Account, Book, Operation
+from tasks.tests.benchmarks.bench_pagination import seed_books
+from tasks.tests.benchmarks.utils import dataset_size, percentile
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# (route, method, url, data, client), the route is the one of tasks/urls.py
+# and every route there has to be measured, the test fails when one is missing
+SCENARIOS = [
+    ('', 'get', '/', None, 'anonymous'),
+    ('books/', 'get', '/books/?format=json', None, 'anonymous'),
+    ('books/', 'get', '/books/?format=json&ordering=-price&page_size=1000', None, 'anonymous'),
+    ('books/', 'get', '/books/?format=json&search=book&max_price=50', None, 'anonymous'),
+    ('books/', 'get', '/books/?format=json&fields=id,title&page_size=1000', None, 'anonymous'),
+    ('accounts/', 'get', '/accounts/?format=json', None, 'customer'),
+    ('accounts/', 'get', '/accounts/?format=json&owner=me', None, 'customer'),
+    ('accounts/<int:pk>/operations/', 'get', '/accounts/{account}/operations.jsonl', None, 'customer'),
+    ('accounts/<int:pk>/summary/', 'get', '/accounts/{account}/summary/?period=day', None, 'customer'),
+    ('login/', 'get', '/login/login/', None, 'anonymous'),
+    ('books/buy/', 'post', '/books/buy/', {'books': [1, 2, 2, 3]}, 'customer'),
+    ('books/buy/batch/', 'post', '/books/buy/batch/', 'orders', 'staff'),
+    ('metrics/', 'get', '/metrics/', None, 'staff'),
+]
+THIRD_PARTY_BUDGETS = {'/login/login/': 0}  # views which aren't ours declare no budget
+
+
+def declared_query_budget(path):
+    view = resolve(path.split('?')[0]).func
+    if path in THIRD_PARTY_BUDGETS:
+        return THIRD_PARTY_BUDGETS[path]
+    # function views carry it themselves, class based views on their class
+    budget = getattr(view, 'query_budget', getattr(getattr(view, 'view_class', None), 'query_budget', None))
+    assert (budget is not None), f'the view of {path} declares no query_budget'
+    return budget
+
+
+def seed():
+    books_amount = dataset_size('BENCHMARK_BOOKS', 100000)
+    accounts_amount = dataset_size('BENCHMARK_ACCOUNTS', 1000)
+    operations_amount = dataset_size('BENCHMARK_OPERATIONS', 10000)
+    seed_books(books_amount)
+    User.objects.bulk_create(User(username=f'benchmark-user-{number}') for number in range(accounts_amount))
+    Account.objects.bulk_create(Account(owner=user, balance=10 ** 9)
+                                for user in User.objects.filter(username__startswith='benchmark-user-'))
+    customer = User.objects.get(username='benchmark-user-0')
+    account = Account.objects.get(owner=customer)
+    Operation.objects.bulk_create(Operation(account=account, operation_type='deposition', balance_change=1)
+                                  for _ in range(operations_amount))  # the ledger only, the balance is set above
+    staff = User.objects.create_user(username='benchmark-staff', is_staff=True)
+    book_ids = list(Book.objects.order_by('id').values_list('id', flat=True)[:50])
+    orders = [{'account': pk, 'books': book_ids[number % 50:number % 50 + 3]}
+              for number, pk in enumerate(Account.objects.order_by('id').values_list('id', flat=True)[:100])]
+    return {'customer': customer, 'staff': staff, 'anonymous': None}, account, orders
+
+
+def request(client, method, url, data):
+    response = getattr(client, method)(url, data, format='json') if method == 'post' else client.get(url)
+    if response.streaming:
+        b''.join(response.streaming_content)  # the rows of a stream are read while it's sent
+    assert (response.status_code in (200, 201)), f'{url}: {response.status_code}'
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_endpoints_against_baseline():
+    repeat = dataset_size('BENCHMARK_REPEAT', 30)
+    threshold = float(os.getenv('BENCHMARK_REGRESSION_THRESHOLD', 0.5))
+    # format_suffix_patterns() adds a <drf_format_suffix:format> twin of every route
+    routes = {str(pattern.pattern) for pattern in urls.urlpatterns if 'format_suffix' not in str(pattern.pattern)}
+    assert (routes == {scenario[0] for scenario in SCENARIOS}), 'every route needs a scenario'
+
+    users, account, orders = seed()
+    results, budgets = {}, {}
+    # no cache, so every request does its work, and no collectstatic manifest for the login page
+    with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+                           STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+        for route, method, template, data, user in SCENARIOS:
+            url = template.format(account=account.pk)
+            data = {'orders': orders} if data == 'orders' else data
+            client = APIClient()
+            if users[user] is not None:
+                client.force_authenticate(users[user])
+            request(client, method, url, data)  # warm up
+            durations, queries = [], 0
+            for _ in range(repeat):
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    request(client, method, url, data)
+                    durations.append((time.perf_counter() - start) * 1000)
+                queries = max(queries, len(context.captured_queries))
+            durations.sort()
+            name = f'{method.upper()} {template}'
+            results[name] = {'median_ms': round(median(durations), 3), 'p95_ms': round(percentile(durations, 0.95), 3),
+                             'queries': queries}
+            budgets[name] = declared_query_budget(url)
+
+    if os.getenv('BENCHMARK_UPDATE_BASELINE'):
+        with open(BASELINE_PATH, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+            file.write('\n')
+    with open(BASELINE_PATH) as file:
+        baseline = json.load(file)
+
+    failures = []
+    print(f'\n{"request":<70} {"median":>10} {"p95":>10} {"baseline":>10} {"queries":>8} {"budget":>7}')
+    for name, result in results.items():
+        expected = baseline.get(name)
+        print(f'{name:<70} {result["median_ms"]:>8.2f}ms {result["p95_ms"]:>8.2f}ms '
+              f'{expected["median_ms"] if expected else "-":>8}ms {result["queries"]:>8} {budgets[name]:>7}')
+        if result['queries'] > budgets[name]:
+            failures.append(f'{name}: {result["queries"]} queries, the view allows {budgets[name]}')
+        if expected is None:
+            failures.append(f'{name}: not in the baseline')
+            continue
+        if result['queries'] > expected['queries']:
+            failures.append(f'{name}: {result["queries"]} queries, {expected["queries"]} in the baseline')
+        if result['median_ms'] > expected['median_ms'] * (1 + threshold):
+            failures.append(f'{name}: median {result["median_ms"]} ms, {expected["median_ms"]} ms in the baseline')
+    assert (not failures), '\n'.join(failures)
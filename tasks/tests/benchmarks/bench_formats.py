@@ -0,0 +1,45 @@
+import gzip
+import time
+
+import brotli
+import pytest
+from tasks.encoders import EncodedJSON, RowEncoder
+from tasks.middleware import BROTLI_QUALITY, GZIP_LEVEL
+from tasks.models import Book
+from tasks.renderers import MessagePackRenderer, PreEncodedJSONRenderer
+from tasks.serializers import BookSerializer
+from tasks.tests.benchmarks.bench_pagination import seed_books
+from tasks.tests.benchmarks.utils import dataset_size
+
+
+def timed(function, *args):
+    start = time.process_time()  # the CPU time, what the workers spend on it
+    result = function(*args)
+    return result, (time.process_time() - start) * 1000
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_catalogue_size_and_encoding_time_per_format():
+    books_amount = dataset_size('BENCHMARK_BOOKS', 1000000)
+    seed_books(books_amount)
+    encoder = RowEncoder(BookSerializer)
+    rows = list(Book.objects.order_by('id').values_list(*encoder.sources, named=True))
+
+    # the whole catalogue, as the fast path of the list view encodes and renders it
+    encoded = {}
+    encoded['json'], json_ms = timed(lambda: PreEncodedJSONRenderer().render(EncodedJSON(encoder.encode_rows(rows))))
+    encoded['msgpack'], msgpack_ms = timed(lambda: MessagePackRenderer().render(encoder.represent_rows(rows)))
+    times = {'json': json_ms, 'msgpack': msgpack_ms}
+    compressors = {'gzip': lambda content: gzip.compress(content, GZIP_LEVEL, mtime=0),
+                   'br': lambda content: brotli.compress(content, quality=BROTLI_QUALITY)}
+
+    print(f'\nthe catalogue of {books_amount} books, size and CPU time to encode it')
+    for format_name, content in encoded.items():
+        print(f'  {format_name:<16} {len(content) / 2 ** 20:8.1f} MB {times[format_name]:9.0f} ms')
+        for encoding, compress in compressors.items():
+            compressed, compress_ms = timed(compress, content)
+            print(f'  {format_name + " + " + encoding:<16} {len(compressed) / 2 ** 20:8.1f} MB '
+                  f'{times[format_name] + compress_ms:9.0f} ms')
+            assert (len(compressed) < len(content) / 3)
+    assert (len(encoded['msgpack']) < len(encoded['json']))
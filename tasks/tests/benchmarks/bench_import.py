@@ -0,0 +1,58 @@
+import time
+import tracemalloc
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from tasks.models import Book
+from tasks.tests.benchmarks.utils import dataset_size
+
+
+def write_books_file(path, amount):
+    with open(path, 'w') as books_file:
+        books_file.write('title,price\n')
+        for number in range(amount):
+            books_file.write(f'Imported book number {number},{1 + number % 500}.99\n')
+
+
+def import_books(path, *args, traced=False):
+    output = StringIO()
+    if traced:
+        tracemalloc.start()
+    start = time.perf_counter()
+    call_command('import_books', str(path), *args, stdout=output)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if traced else None
+    if traced:
+        tracemalloc.stop()
+    print(output.getvalue().strip())
+    return elapsed, peak
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_import_books_throughput_and_memory(tmp_path):
+    rows_amount = dataset_size('BENCHMARK_IMPORT_ROWS', 1000000)
+    # rows per second, about 17000 are imported on a single core, bulk_create and the full-text trigger of every row
+    # included
+    minimum_rate = dataset_size('BENCHMARK_MIN_IMPORT_RATE', 10000)
+    Book.objects.all().delete()
+
+    small_file, large_file = tmp_path / 'small.csv', tmp_path / 'large.csv'
+    write_books_file(small_file, rows_amount // 100)
+    write_books_file(large_file, rows_amount // 10)
+    # small batches, so that both files take many of them
+    _, small_peak = import_books(small_file, '--batch-size', '1000', traced=True)
+    _, large_peak = import_books(large_file, '--batch-size', '1000', traced=True)  # starts with the small one
+    print(f'peak memory: {small_peak / 1e6:.1f} MB for {rows_amount // 100} rows, '
+          f'{large_peak / 1e6:.1f} MB for {rows_amount // 10} rows')
+    assert (large_peak < small_peak * 2)  # ten times the rows, about the same memory
+
+    Book.objects.all().delete()
+    full_file = tmp_path / 'full.csv'
+    write_books_file(full_file, rows_amount)
+    elapsed, _ = import_books(full_file)
+    assert (Book.objects.count() == rows_amount)
+    rate = rows_amount / elapsed
+    print(f'{rate:.0f} rows/s (target {minimum_rate} rows/s)')
+    assert (rate >= minimum_rate)
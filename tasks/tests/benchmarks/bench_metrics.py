@@ -0,0 +1,69 @@
+import time
+from statistics import median
+
+import pytest
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import resolve
+from rest_framework.test import APIClient
+from tasks.metrics import record_query
+from tasks.middleware import MetricsMiddleware
+from tasks.models import Book
+from tasks.tests.benchmarks.utils import dataset_size, report
+
+METRICS_MIDDLEWARE = 'tasks.middleware.MetricsMiddleware'
+
+
+@pytest.mark.benchmark
+def test_metrics_middleware_cost_per_request():
+    requests_amount = dataset_size('BENCHMARK_REQUESTS', 100000)
+    max_overhead = dataset_size('BENCHMARK_MAX_METRICS_OVERHEAD_US', 20)  # per request, in microseconds
+    request = RequestFactory().get('/books/')
+    request.resolver_match = resolve('/books/')
+    response = HttpResponse(b'x' * 1000)
+
+    def view(request):
+        for _ in range(3):  # e.g. the session, the user and the books
+            record_query(lambda sql, params, many, context: None, 'SELECT 1', (), False, {})
+        return response
+
+    def bare_view(request):
+        for _ in range(3):
+            (lambda sql, params, many, context: None)('SELECT 1', (), False, {})
+        return response
+
+    durations = {}
+    for name, handler in (('bare view', bare_view), ('view with metrics', MetricsMiddleware(view))):
+        start = time.perf_counter()
+        for _ in range(requests_amount):
+            handler(request)
+        durations[name] = (time.perf_counter() - start) * 1000000 / requests_amount
+    overhead = durations['view with metrics'] - durations['bare view']
+    print(f'\nmetrics middleware and 3 recorded queries: {overhead:.2f} us per request')
+    assert (overhead < max_overhead)
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_metrics_middleware_overhead_end_to_end(settings):
+    requests_amount = dataset_size('BENCHMARK_REQUESTS', 200)
+    Book.objects.bulk_create(Book(title=f'Book {number}', price=10) for number in range(100))
+    client = APIClient()
+    without_metrics = override_settings(MIDDLEWARE=[name for name in settings.MIDDLEWARE if name != METRICS_MIDDLEWARE])
+
+    def requests():
+        start = time.perf_counter()
+        for _ in range(requests_amount):
+            # a cached catalogue response is one of the cheapest requests, so the overhead weighs the most
+            client.get('/books/', HTTP_ACCEPT='application/json')
+        return (time.perf_counter() - start) * 1000
+
+    results = {'without metrics': [], 'with metrics': []}
+    for _ in range(15):  # interleaved, so both see the same noise of the machine
+        with without_metrics:
+            results['without metrics'].append(requests())
+        results['with metrics'].append(requests())
+    results = {name: sorted(durations) for name, durations in results.items()}
+    report(f'{requests_amount} requests to /books/', results)
+    overhead = (median(results['with metrics']) - median(results['without metrics'])) * 1000 / requests_amount
+    print(f'  difference per request: {overhead:.1f} us (noisy, see the test above for the cost itself)')
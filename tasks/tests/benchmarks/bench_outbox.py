@@ -0,0 +1,46 @@
+import time
+from io import StringIO
+from statistics import median
+
+import pytest
+from django.core.management import call_command
+from rest_framework.test import APIClient
+from tasks.models import OutboxMessage
+from tasks.tests.benchmarks.bench_purchases import seed_shop
+from tasks.tests.benchmarks.utils import dataset_size, measure, report
+
+HANDLER_COST = 0.02  # in seconds, e.g. an e-mail sent through a remote API
+
+
+def slow_handler(message):
+    time.sleep(HANDLER_COST)
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_purchases_do_not_wait_for_the_outbox_handlers(settings):
+    purchases_amount = dataset_size('BENCHMARK_PURCHASES', 200)
+    settings.THROTTLE_RATES = {}  # the purchases are measured, not the limits of a single client
+    settings.OUTBOX_HANDLERS = {'purchase.created': ['tasks.tests.benchmarks.bench_outbox.slow_handler']}
+    accounts, book_ids = seed_shop(1)
+    client = APIClient()
+    client.force_authenticate(accounts[0].owner)
+
+    def buy():
+        assert (client.post('/books/buy/', {'books': book_ids[:3]}, format='json').status_code == 201)
+
+    results = {'POST /books/buy/ with the outbox': measure(buy, repeat=purchases_amount)}
+    report(f'{purchases_amount} purchases, {HANDLER_COST * 1000:.0f} ms per handled message', results)
+    # the purchase only pays for the INSERT of its message, far less than its handler
+    assert (median(results['POST /books/buy/ with the outbox']) < HANDLER_COST * 1000)
+
+    messages = OutboxMessage.objects.count()
+    for threads in (1, 8):
+        if not OutboxMessage.objects.exists():  # delivered by the previous run, the same amount again
+            OutboxMessage.objects.bulk_create(OutboxMessage(topic='purchase.created', payload={})
+                                              for _ in range(messages))
+        start = time.perf_counter()
+        call_command('run_outbox_worker', '--once', '--threads', str(threads), stdout=StringIO())
+        elapsed = time.perf_counter() - start
+        print(f'  run_outbox_worker --threads {threads}: {messages / elapsed:.0f} messages/s')
+        assert (not OutboxMessage.objects.exists())
@@ -0,0 +1,46 @@
+import json
+from base64 import b64encode
+from statistics import median
+
+import pytest
+from rest_framework.test import APIClient
+from tasks.models import Book
+from tasks.tests.benchmarks.utils import dataset_size, measure, report
+
+
+def seed_books(amount, chunk=50000):
+    for start in range(0, amount, chunk):  # in chunks, so a million model instances never sit in memory
+        Book.objects.bulk_create(Book(title=f'Book {number:08}', price=1 + number % 997)
+                                 for number in range(start, min(start + chunk, amount)))
+
+
+def cursor_at(ordering, offset):
+    field = ordering.lstrip('-')
+    value, pk = Book.objects.order_by(ordering, ordering.replace(field, 'id')).values_list(field, 'id')[offset]
+    cursor = json.dumps({'v': str(value), 'i': pk, 'r': 0}, separators=(',', ':'))
+    return b64encode(cursor.encode('utf-8')).decode('ascii')
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+@pytest.mark.parametrize('ordering', ['id', 'price', '-title'])
+def test_book_list_page_latency_does_not_depend_on_depth(ordering):
+    books_amount = dataset_size('BENCHMARK_BOOKS', 1000100)
+    deep_offset = books_amount - 100
+    seed_books(books_amount)
+    client = APIClient()
+    first_page = f'/books/?ordering={ordering}'
+    deep_page = f'{first_page}&cursor={cursor_at(ordering, deep_offset)}'
+    field = ordering.lstrip('-')
+
+    results = {
+        'cursor, first page': measure(lambda: client.get(first_page)),
+        f'cursor, page at offset {deep_offset}': measure(lambda: client.get(deep_page)),
+        # what a LIMIT/OFFSET page at the same depth would cost, for comparison
+        f'OFFSET {deep_offset}': measure(
+            lambda: list(Book.objects.order_by(ordering, ordering.replace(field, 'id'))[deep_offset:deep_offset + 100]),
+            repeat=5),
+    }
+    report(f'GET /books/ ordered by {ordering}, {books_amount} books', results)
+    shallow, deep = median(results['cursor, first page']), median(results[f'cursor, page at offset {deep_offset}'])
+    assert (deep < shallow * 3)  # a deep page is about as cheap as the first one
@@ -0,0 +1,52 @@
+import random
+from statistics import median
+
+import pytest
+from rest_framework.test import APIClient
+from tasks.metrics import registry
+from tasks.models import Book
+from tasks.prices import price_index
+from tasks.tests.benchmarks.bench_purchases import seed_shop
+from tasks.tests.benchmarks.utils import dataset_size, measure, report
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_pricing_carts_from_the_price_index(settings):
+    carts_amount = dataset_size('BENCHMARK_PURCHASES', 1000)
+    settings.THROTTLE_RATES = {}  # the purchases are measured, not the limits of a single client
+    accounts, book_ids = seed_shop(1, books_amount=10000)
+    price_index.clear()
+    generator = random.Random(0)
+    # popular books, like a real catalogue: most carts are made of the same few hundred
+    carts = [[book_ids[int(generator.paretovariate(1)) % len(book_ids)] for _ in range(3)] for _ in range(100)]
+
+    def price_carts(index):
+        def run():
+            for cart in carts:
+                if index:
+                    price_index.quote(cart)
+                else:  # what the checkout did before, a query per cart
+                    dict(Book.objects.filter(id__in=cart).values_list('id', 'price'))
+        return run
+
+    results = {
+        'the database': measure(price_carts(False), repeat=carts_amount // len(carts)),
+        'the price index': measure(price_carts(True), repeat=carts_amount // len(carts)),
+    }
+    report(f'pricing {len(carts)} carts of 3 books', results)
+    hits, misses = registry.counters['price_index_hits'], registry.counters['price_index_misses']
+    print(f'  hit rate {hits / (hits + misses):.1%}')
+    assert (median(results['the price index']) < median(results['the database']) / 2)
+
+    client = APIClient()
+    client.force_authenticate(accounts[0].owner)
+
+    def buy():
+        assert (client.post('/books/buy/', {'books': carts[generator.randrange(len(carts))]},
+                            format='json').status_code == 201)
+
+    with_index = measure(buy, repeat=carts_amount // 5)
+    settings.PRICE_INDEX_SIZE = 0  # every cart is read from the database
+    without_index = measure(buy, repeat=carts_amount // 5)
+    report('POST /books/buy/', {'with the price index': with_index, 'without it': without_index})
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+from tasks.models import Account, Book, Purchase
+from tasks.tests.benchmarks.utils import dataset_size
+
+
+def seed_shop(accounts_amount, books_amount=50):
+    Book.objects.bulk_create(Book(title=f'Benchmark book {number}', price=1 + number % 20)
+                             for number in range(books_amount))
+    User.objects.bulk_create(User(username=f'benchmark-user-{number}') for number in range(accounts_amount))
+    users = list(User.objects.filter(username__startswith='benchmark-user-').order_by('id'))
+    Account.objects.bulk_create(Account(owner=user, balance=1000000) for user in users)
+    accounts = list(Account.objects.filter(owner__in=users).select_related('owner').order_by('id'))
+    book_ids = list(Book.objects.filter(title__startswith='Benchmark book').values_list('id', flat=True))
+    return accounts, book_ids
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_batch_purchase_against_separate_requests(settings):
+    settings.THROTTLE_RATES = {}  # the purchases are measured, not the limits of a single client
+    orders_amount = dataset_size('BENCHMARK_ORDERS', 1000)
+    accounts, book_ids = seed_shop(100)
+    orders = [{'account': accounts[number % len(accounts)].pk,
+               'books': [book_ids[(number + offset) % len(book_ids)] for offset in range(3)]}
+              for number in range(orders_amount)]
+    owners = {account.pk: account.owner for account in accounts}
+    client = APIClient()
+
+    start = time.perf_counter()
+    for order in orders:
+        client.force_authenticate(owners[order['account']])
+        assert (client.post('/books/buy/', {'books': order['books']}, format='json').status_code == 201)
+    separate = time.perf_counter() - start
+
+    client.force_authenticate(User.objects.create_user(username='benchmark-shop', is_staff=True))
+    start = time.perf_counter()
+    response = client.post('/books/buy/batch/', {'orders': orders}, format='json')
+    batch = time.perf_counter() - start
+
+    assert (all(result['status'] == 'success' for result in response.data['results']))
+    assert (Purchase.objects.count() == 2 * orders_amount)
+    print(f'\n{orders_amount} orders: {separate:.2f}s as separate POST /books/buy/ requests, '
+          f'{batch:.2f}s as one POST /books/buy/batch/ ({separate / batch:.1f}x faster)')
+    assert (batch < separate)
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_batch_purchase_over_many_distinct_accounts(settings):
+    # every order of a batch from another account, so every one of them has rollups of its own to write
+    accounts_amount = dataset_size('BENCHMARK_ACCOUNTS', 3000)
+    batch_size = settings.BATCH_PURCHASE_MAX_ORDERS
+    accounts, book_ids = seed_shop(accounts_amount)
+    client = APIClient()
+    client.force_authenticate(User.objects.create_user(username='benchmark-shop', is_staff=True))
+
+    def post_batch(batch_accounts):
+        orders = [{'account': account.pk, 'books': book_ids[:3]} for account in batch_accounts]
+        start = time.perf_counter()
+        response = client.post('/books/buy/batch/', {'orders': orders}, format='json')
+        duration = time.perf_counter() - start
+        assert (all(result['status'] == 'success' for result in response.data['results']))
+        return duration
+
+    # the same number of orders, from a tenth of the accounts and then from as many accounts as orders
+    few = post_batch([accounts[number % (batch_size // 10)] for number in range(batch_size)])
+    many = sum(post_batch(accounts[first:first + batch_size]) for first in range(0, accounts_amount, batch_size))
+    batches = -(-accounts_amount // batch_size)
+    print(f'\n{batch_size} orders per batch: {few:.2f}s from {batch_size // 10} accounts, '
+          f'{many / batches:.2f}s from {batch_size} accounts (average of {batches} batches)')
+    assert (Purchase.objects.count() == batch_size + accounts_amount)
+    assert (many / batches < 3 * few)  # the number of accounts barely matters
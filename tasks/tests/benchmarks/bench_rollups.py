@@ -0,0 +1,41 @@
+import time
+from datetime import timedelta
+
+import pytest
+from django.db import transaction
+from django.utils import timezone
+from tasks.models import Operation, SpendingRollup
+from tasks.tests.benchmarks.bench_purchases import seed_shop
+from tasks.tests.benchmarks.utils import dataset_size
+
+
+def add_one_operation_per_account(accounts, created):
+    operations = [Operation(account=account, balance_change=-5, created=created) for account in accounts]
+    start = time.perf_counter()
+    with transaction.atomic():
+        SpendingRollup.add_operations(operations)
+    return time.perf_counter() - start
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_rollups_of_many_distinct_accounts():
+    # the time per rollup mustn't grow with the number of accounts of a batch
+    accounts_amount = dataset_size('BENCHMARK_ACCOUNTS', 3000)
+    accounts, _ = seed_shop(accounts_amount, books_amount=1)
+    yesterday = timezone.now() - timedelta(days=1)
+
+    results = {}
+    for amount in (accounts_amount // 10, accounts_amount):
+        created = add_one_operation_per_account(accounts[:amount], yesterday)
+        updated = add_one_operation_per_account(accounts[:amount], yesterday)  # every rollup exists by then
+        results[amount] = updated
+        print(f'\n{amount} accounts: rollups created in {created * 1000:.0f} ms, '
+              f'added to in {updated * 1000:.0f} ms')
+
+    day = timezone.localtime(yesterday).date()
+    assert (SpendingRollup.objects.filter(period='day', period_start=day).count() == accounts_amount)
+    rollup = SpendingRollup.objects.get(account=accounts[0], period='day', period_start=day)
+    assert (rollup.spent == 20 and rollup.operations == 4)  # in both sizes, twice each
+    # 10 times the accounts take about 10 times as long, not 100
+    assert (results[accounts_amount] < 30 * results[accounts_amount // 10])
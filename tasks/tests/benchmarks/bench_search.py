@@ -0,0 +1,55 @@
+import random
+from statistics import median
+
+import pytest
+from rest_framework.test import APIClient
+from tasks.models import Book
+from tasks.tests.benchmarks.utils import dataset_size, measure, report
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pa', 'qu', 'dor', 'fen', 'gal', 'hum']
+
+
+def seed_catalogue(amount, first_number=0, chunk=50000):
+    """
+    Titles are three words from a vocabulary of a few thousand made-up words, so most words are shared
+    by many books. Every 100000th book also gets the word 'zanzibar', which stays rare at any size.
+    """
+    generator = random.Random(first_number)  # deterministic, whatever the dataset size
+    vocabulary = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+    for start in range(first_number, first_number + amount, chunk):
+        books = []
+        for number in range(start, min(start + chunk, first_number + amount)):
+            words = generator.sample(vocabulary, 3)
+            if number % 100000 == 0:
+                words[1] = 'zanzibar'
+            books.append(Book(title=' '.join(words).title(), price=1 + number % 997))
+        Book.objects.bulk_create(books)
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_book_search_is_sublinear_in_catalogue_size():
+    books_amount = dataset_size('BENCHMARK_BOOKS', 1000000)
+    client = APIClient()
+    queries = {
+        'rare word (?search=zanzibar)': '/books/?search=zanzibar',
+        'common word prefix (?search=kalo)': '/books/?search=kalo',
+        'title prefix (?title=Kalomi)': '/books/?title=Kalomi',
+        'price range': '/books/?min_price=100&max_price=101',
+    }
+    scan = {'full scan, title LIKE %zanzibar%': lambda: list(Book.objects.filter(title__icontains='zanzibar'))}
+
+    seed_catalogue(books_amount // 10)
+    small = {name: measure(lambda url=url: client.get(url)) for name, url in queries.items()}
+    small.update({name: measure(function, repeat=5) for name, function in scan.items()})
+    report(f'GET /books/ filtering, {books_amount // 10} books', small)
+
+    seed_catalogue(books_amount - books_amount // 10, first_number=books_amount // 10)
+    large = {name: measure(lambda url=url: client.get(url)) for name, url in queries.items()}
+    large.update({name: measure(function, repeat=5) for name, function in scan.items()})
+    report(f'GET /books/ filtering, {books_amount} books', large)
+
+    rare = 'rare word (?search=zanzibar)'
+    # ten times more books must not make an indexed search anywhere near ten times slower
+    assert (median(large[rare]) < median(small[rare]) * 3)
+    assert (median(large[rare]) < median(large['full scan, title LIKE %zanzibar%']))
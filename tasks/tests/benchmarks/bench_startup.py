@@ -0,0 +1,82 @@
+import os
+import shutil
+import signal
+import sys
+import time
+from statistics import median
+
+import pytest
+from tasks.models import Book
+from tasks.tests.benchmarks.bench_asgi import free_port, get, start_server
+from tasks.tests.benchmarks.utils import dataset_size
+
+COMMAND = ['gunicorn', 'BookListAPI.wsgi:application']
+
+
+def worker_pids(master):
+    with open(f'/proc/{master.pid}/task/{master.pid}/children') as file:
+        return [int(pid) for pid in file.read().split()]
+
+
+def memory_kb(pid):
+    # Pss counts the pages shared with the master and the other workers once, split between them
+    with open(f'/proc/{pid}/smaps_rollup') as file:
+        fields = dict(line.split(':', 1) for line in file if ':' in line)
+    return {name: int(fields[name].split()[0]) for name in ('Rss', 'Pss')}
+
+
+def time_to_first_response(port, master):
+    """
+    Kills the only worker and returns how long it takes until the one replacing it has answered a request,
+    in milliseconds, what a worker started when scaling up takes as well.
+    """
+    worker, = worker_pids(master)
+    start = time.perf_counter()
+    os.kill(worker, signal.SIGKILL)
+    while True:
+        try:
+            get(port, '/books/')
+            return (time.perf_counter() - start) * 1000
+        except OSError:  # until the new worker accepts
+            time.sleep(0.001)
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db(transaction=True)  # the servers run in other processes, they only see committed books
+def test_worker_startup_and_memory_per_profile(tmp_path):
+    if shutil.which('gunicorn') is None or sys.platform != 'linux':
+        pytest.skip('the startup benchmark needs gunicorn and /proc')
+    restarts = dataset_size('BENCHMARK_RESTARTS', 10)
+    Book.objects.bulk_create(Book(title=f'Book {number:06}', price=1 + number % 97) for number in range(1000))
+    no_config = tmp_path / 'gunicorn.conf.py'
+    no_config.write_text('')
+    setups = {
+        'full settings, without gunicorn.conf.py': (COMMAND + ['--config', str(no_config)], 'full'),
+        'API-only settings, without gunicorn.conf.py': (COMMAND + ['--config', str(no_config)], 'api'),
+        'full settings, preloaded and warmed up': (COMMAND, 'full'),
+        'API-only settings, preloaded and warmed up': (COMMAND, 'api'),
+    }
+
+    results = {}
+    for name, (command, profile) in setups.items():
+        port = free_port()
+        start = time.perf_counter()
+        server = start_server(command, port, 1, SETTINGS_PROFILE=profile)
+        try:
+            startup = (time.perf_counter() - start) * 1000
+            first_responses = [time_to_first_response(port, server) for _ in range(restarts)]
+            for _ in range(20):
+                get(port, '/books/')
+            memory = memory_kb(worker_pids(server)[0])
+        finally:
+            server.terminate()
+            server.wait()
+        results[name] = median(first_responses), memory
+
+        print(f'\n{name}: server up in {startup:.0f} ms, a new worker answers in {median(first_responses):.0f} ms '
+              f'(median of {restarts}), then takes {memory["Rss"] / 1024:.1f} MB RSS, '
+              f'{memory["Pss"] / 1024:.1f} MB PSS')
+    baseline = results['full settings, without gunicorn.conf.py']
+    lean = results['API-only settings, preloaded and warmed up']
+    assert (lean[0] < baseline[0] / 2)
+    assert (lean[1]['Pss'] < baseline[1]['Pss'])
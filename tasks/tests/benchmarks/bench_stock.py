@@ -0,0 +1,60 @@
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from tasks.models import Book, PurchaseBook
+from tasks.tests.benchmarks.bench_asgi import free_port, start_server
+from tasks.tests.benchmarks.bench_database import SERVER, buy, log_in
+from tasks.tests.benchmarks.bench_purchases import seed_shop
+from tasks.tests.benchmarks.utils import dataset_size, report
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db(transaction=True)  # the server runs in other processes, they only see committed rows
+def test_hot_limited_edition_is_never_oversold():
+    if shutil.which('gunicorn') is None or sys.platform == 'win32':
+        pytest.skip('the load test needs gunicorn')
+    workers = dataset_size('BENCHMARK_WORKERS', 4)
+    concurrency = dataset_size('BENCHMARK_CLIENTS', 32)
+    requests_amount = dataset_size('BENCHMARK_REQUESTS', 1000)
+    accounts, _ = seed_shop(concurrency)
+    logins = [log_in(account.owner) for account in accounts]
+    # the same book for everybody, once as a limited edition which sells out halfway, once without a stock
+    stock = requests_amount // 2
+    books = {'limited edition': Book.objects.create(title='Limited edition', price=1, stock=stock),
+             'unlimited book': Book.objects.create(title='Unlimited book', price=1)}
+
+    port = free_port()
+    server = start_server(SERVER, port, workers, DATABASE_PROFILE='performance')
+    results = {}
+    try:
+        for name, book in books.items():
+            started = time.perf_counter()
+
+            def purchase(number):
+                duration, status = buy(port, logins[number % len(logins)], [book.pk])
+                return duration, status, time.perf_counter() - started
+
+            with ThreadPoolExecutor(concurrency) as pool:
+                responses = list(pool.map(purchase, range(requests_amount)))
+            elapsed = time.perf_counter() - started
+            sold = PurchaseBook.objects.filter(book=book).count()
+            successes = sum(status == 201 for _, status, _ in responses)
+            assert (all(status in (201, 400) for _, status, _ in responses))
+            assert (sold == successes)
+            if book.stock is not None:
+                assert (sold == stock and Book.objects.get(pk=book.pk).stock == 0)  # sold out, and not a copy more
+            # requests answered per tenth of the run, the lock of the hot row shouldn't make the rate collapse
+            tenths = [0] * 10
+            for _, _, finished in responses:
+                tenths[min(int(finished / elapsed * 10), 9)] += 1
+            print(f'\n{name}: {requests_amount / elapsed:.0f} requests/s, {sold} sold, '
+                  f'{requests_amount - successes} rejected, answered per tenth of the run: {tenths}')
+            assert (min(tenths[1:-1]) > requests_amount / 10 / 4)
+            results[name] = sorted(duration for duration, _, _ in responses)
+    finally:
+        server.terminate()
+        server.wait()
+    report(f'POST /books/buy/ of one book, {concurrency} concurrent clients, {workers} gunicorn workers', results)
@@ -0,0 +1,67 @@
+import multiprocessing
+import sys
+from statistics import median
+
+import pytest
+from django.test import RequestFactory
+from tasks.middleware import ThrottleMiddleware
+from tasks.tests.benchmarks.utils import dataset_size, measure, percentile
+from tasks.throttling import SharedMemoryCounters
+
+UNREACHABLE_LIMITS = {'user': '1000000000/min', 'ip': '1000000000/min'}  # every request does the whole check
+
+
+def hit_shared_counter(path, hits):
+    counters = SharedMemoryCounters(path)
+    for _ in range(hits):
+        counters.hit([('throttle:books-buy:ip:shared', 60, 1)])
+
+
+@pytest.mark.benchmark
+def test_throttle_overhead_per_request(settings, tmp_path):
+    requests_amount = dataset_size('BENCHMARK_REQUESTS', 1000)
+    settings.CACHES = {
+        'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'throttling'},
+        'filebased': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                      'LOCATION': str(tmp_path / 'cache')},
+    }
+    factory = RequestFactory()
+    clients = [factory.post('/books/buy/', REMOTE_ADDR=f'10.0.{number // 256}.{number % 256}',
+                            HTTP_COOKIE=f'sessionid=session-{number}') for number in range(100)]
+
+    def per_request():
+        # in microseconds, timed over many requests, a single one is below the resolution of the timer
+        def run():
+            for number in range(requests_amount):
+                assert (ThrottleMiddleware.throttled(clients[number % len(clients)]) is None)
+        return [duration * 1000 / requests_amount for duration in measure(run, repeat=10, warmup=1)]
+
+    results = {}
+    settings.THROTTLE_RATES = {'book-list': UNREACHABLE_LIMITS}
+    results['a view without limits'] = per_request()
+    settings.THROTTLE_RATES = {'books-buy': UNREACHABLE_LIMITS}
+    results['limit per IP, shared memory'] = per_request()
+    for alias in ('locmem', 'filebased'):
+        settings.THROTTLE_CACHE = alias
+        results[f'limit per IP, {alias} cache'] = per_request()
+
+    print(f'\nThrottleMiddleware per request, {len(clients)} clients')
+    for name, durations in results.items():
+        print(f'  {name:<45} median {median(durations):8.1f} us   p95 {percentile(durations, 0.95):8.1f} us')
+    assert (median(results['limit per IP, shared memory']) < 100)  # far below a millisecond
+
+
+@pytest.mark.benchmark
+def test_shared_counters_are_atomic_across_processes(tmp_path):
+    if sys.platform == 'win32':
+        pytest.skip('the shared counters need fcntl')
+    processes_amount, hits = 4, dataset_size('BENCHMARK_REQUESTS', 1000)
+    path = str(tmp_path / 'throttle')
+    context = multiprocessing.get_context('fork')  # the workers of gunicorn are forked as well
+    processes = [context.Process(target=hit_shared_counter, args=(path, hits)) for _ in range(processes_amount)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    # an update by 0 reads the counter, none of the concurrent increments was lost
+    assert (SharedMemoryCounters(path).update('throttle:books-buy:ip:shared', 1, 0) == (0, processes_amount * hits))
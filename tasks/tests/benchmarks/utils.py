@@ -0,0 +1,38 @@
+# helpers shared by the benchmarks, which are excluded from the normal test run and started with:
+# pytest -m benchmark -s tasks/tests/benchmarks
+# the dataset sizes can be scaled down with environment variables, e.g. BENCHMARK_BOOKS=100000
+
+import os
+import time
+from statistics import median
+
+
+def dataset_size(name, default):
+    return int(os.getenv(name, default))
+
+
+def measure(function, repeat=20, warmup=2):
+    """
+    Calls the function repeatedly and returns the sorted durations in milliseconds.
+    """
+    for _ in range(warmup):
+        function()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return sorted(durations)
+
+
+def percentile(durations, fraction):
+    return durations[min(int(len(durations) * fraction), len(durations) - 1)]
+
+
+def report(title, results):
+    """
+    Prints one line per measured case: median and 95th percentile of the durations.
+    """
+    print(f'\n{title}')
+    for name, durations in results.items():
+        print(f'  {name:<40} median {median(durations):9.3f} ms   p95 {percentile(durations, 0.95):9.3f} ms')
@@ -0,0 +1,50 @@
+from collections import Counter
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(settings):
+    # every test gets an empty, process-local cache, so no cached catalogue leaks from one test into another
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                   'LOCATION': 'tests'}}
+    from django.core.cache import cache
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def isolated_metrics(settings, tmp_path, monkeypatch):
+    # the metrics files of the tests don't end up next to the ones of the development server
+    settings.METRICS_DIR = str(tmp_path / 'metrics')
+    from tasks.metrics import registry
+    monkeypatch.setattr(registry, 'views', {})
+    monkeypatch.setattr(registry, 'counters', Counter())
+
+
+@pytest.fixture(autouse=True)
+def isolated_throttle(settings, tmp_path):
+    # fresh rate limit counters for every test
+    settings.THROTTLE_COUNTERS_PATH = str(tmp_path / 'throttle')
+
+
+@pytest.fixture
+def replicate(settings, tmp_path):
+    # registers a second SQLite file as the only read replica, replicate() copies what the test database holds
+    # into it, what's written to the primary afterwards isn't there until the next call, like a replica lagging behind
+    import sqlite3
+    from django.db import connection, connections
+    path = str(tmp_path / 'replica.sqlite3')
+    connections.settings['replica'] = dict(connection.settings_dict, NAME=path)
+    settings.DATABASE_REPLICAS = ['replica']
+
+    def replicate():
+        connections['replica'].close()
+        connection.ensure_connection()
+        with sqlite3.connect(path) as target:
+            connection.connection.backup(target)
+        return connections['replica']
+
+    yield replicate
+    connections['replica'].close()
+    del connections['replica']
+    del connections.settings['replica']
@@ -0,0 +1,156 @@
+import csv
+import json
+from decimal import Decimal
+from io import StringIO
+from itertools import accumulate
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from rest_framework.test import APIClient
+from tasks.models import Account, Book, Operation, OutboxMessage, Purchase, PurchaseBook
+
+delivered_messages = []
+
+
+def record_message(message):  # the handlers of the outbox test
+    delivered_messages.append(message.payload)
+
+
+def fail_first_attempt(message):
+    if message.attempts == 1:
+        raise ConnectionError('the broker is down')
+
+
+def fail_every_attempt(message):
+    raise ConnectionError('the broker is down')
+
+
+class TestsCommands:
+
+    @pytest.mark.django_db
+    def test_import_books_creates_updates_and_rejects(self, tmp_path):
+        Book.objects.all().delete()
+        Book.objects.create(title='The Stranger', price=40.00)
+        books_file = tmp_path / 'books.csv'
+        books_file.write_text('title,price\n'
+                              'The Stranger,35.50\n'  # an existing title is updated
+                              'Dialogues,25\n'
+                              'Dialogues,26\n'  # the last row with the same title wins
+                              'Free Book,0\n'  # below MinValueValidator(0.01)
+                              'Cheap Book,0.001\n'  # more than 2 decimal places
+                              ',10\n'  # no title
+                              'Priceless Book,priceless\n')
+        rejects_file = tmp_path / 'rejects.csv'
+        output = StringIO()
+        call_command('import_books', str(books_file), '--batch-size', '2', '--rejects', str(rejects_file),
+                     stdout=output)
+        assert (dict(Book.objects.values_list('title', 'price')) == {'The Stranger': Decimal('35.50'),
+                                                                     'Dialogues': Decimal('26.00')})
+        assert ('1 books created, 2 updated, 0 unchanged, 4 rows rejected' in output.getvalue())  # 2 batches
+        rejects = list(csv.reader(rejects_file.open()))
+        assert ([row[0] for row in rejects[1:]] == ['5', '6', '7', '8'])  # the line numbers in the imported file
+        # the imported books are in the search index too
+        response = APIClient().get('/books/?search=dialog')
+        assert ([book['title'] for book in response.json()['results']] == ['Dialogues'])
+
+    @pytest.mark.django_db
+    def test_import_books_from_json_lines(self, tmp_path):
+        Book.objects.all().delete()
+        books_file = tmp_path / 'books.jsonl'
+        books_file.write_text(json.dumps({'title': 'Les Miserables', 'price': 70.10}) + '\n'
+                              + '\n'
+                              + 'not json\n'
+                              + json.dumps({'title': 'Dialogues', 'price': '25.00'}) + '\n')
+        output = StringIO()
+        call_command('import_books', str(books_file), stdout=output)
+        # 70.10 is read as a Decimal, a float would not survive the round trip exactly
+        assert (dict(Book.objects.values_list('title', 'price')) == {'Les Miserables': Decimal('70.10'),
+                                                                     'Dialogues': Decimal('25.00')})
+        assert ('1 rows rejected' in output.getvalue())
+        call_command('import_books', str(books_file), stdout=output)  # importing it again changes nothing
+        assert ('0 books created, 0 updated, 2 unchanged' in output.getvalue())
+        assert (Book.objects.count() == 2)
+
+    @pytest.mark.django_db
+    def test_import_books_updates_every_book_with_the_title(self, tmp_path):
+        Book.objects.all().delete()
+        Book.objects.bulk_create([Book(title='Dialogues', price=20.00), Book(title='Dialogues', price=25.00)])
+        books_file = tmp_path / 'books.csv'
+        books_file.write_text('title,price\nDialogues,25\n')
+        output = StringIO()
+        call_command('import_books', str(books_file), stdout=output)
+        assert ('0 books created, 1 updated, 0 unchanged' in output.getvalue())
+        assert (list(Book.objects.values_list('title', 'price')) == [('Dialogues', Decimal('25.00'))] * 2)
+
+    @staticmethod
+    def generated_dataset():
+        accounts = list(Account.objects.filter(owner__username__startswith='generated-7-')
+                        .order_by('owner__username').values_list('owner__username', 'balance'))
+        operations = list(Operation.objects.filter(account__owner__username__startswith='generated-7-')
+                          .order_by('id').values_list('account__owner__username', 'balance_change', 'created'))
+        carts = list(PurchaseBook.objects.filter(purchase__account__owner__username__startswith='generated-7-')
+                     .order_by('id').values_list('purchase__operation__balance_change', 'book__title', 'quantity'))
+        return accounts, operations, carts
+
+    @pytest.mark.django_db
+    def test_generate_dataset(self):
+        call_command('generate_dataset', '--seed', '7', '--users', '30', '--books', '20', '--operations', '510',
+                     '--chunk-size', '7', '--workers', '1', stdout=StringIO())
+        accounts, operations, carts = self.generated_dataset()
+        assert (len(accounts) == 30 and len(operations) == 510)
+        # 80% of the 16 operations after the first deposit
+        assert (Purchase.objects.filter(account__owner__username__startswith='generated-7-').count() == 30 * 12)
+        for account in Account.objects.filter(owner__username__startswith='generated-7-'):
+            ledger = list(account.operation_set.order_by('created', 'id').values_list('balance_change', flat=True))
+            assert (sum(ledger) == account.balance)  # the balance is the sum of the ledger
+            assert (all(balance >= 0 for balance in accumulate(ledger)))  # and it has never been negative
+        for purchase in Purchase.objects.filter(account__owner__username__startswith='generated-7-')[:50]:
+            cost = sum(line.book.price * line.quantity for line in purchase.purchasebook_set.all())
+            assert (purchase.operation.balance_change == -cost)
+        with pytest.raises(CommandError):
+            call_command('generate_dataset', '--seed', '7', stdout=StringIO())
+
+        # the same seed gives the same dataset, whatever the number of workers
+        User.objects.filter(username__startswith='generated-7-').delete()
+        call_command('generate_dataset', '--seed', '7', '--users', '30', '--books', '20', '--operations', '510',
+                     '--chunk-size', '7', '--workers', '2', stdout=StringIO())
+        assert (self.generated_dataset() == (accounts, operations, carts))
+
+    @pytest.mark.django_db
+    def test_outbox_worker_delivers_committed_purchases(self, settings):
+        settings.OUTBOX_HANDLERS = {'purchase.created': ['tasks.tests.tests_commands.fail_first_attempt',
+                                                         'tasks.tests.tests_commands.record_message']}
+        settings.OUTBOX_RETRY_DELAY = 0
+        settings.OUTBOX_MAX_ATTEMPTS = 2
+        delivered_messages.clear()
+        book = Book.objects.create(title='Dialogues', price=30.00)
+        user = User.objects.create_user(username='test', password='testpass')
+        account = Account.objects.create(balance=70.00, owner=user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        assert (client.post('/books/buy/', {'books': [book.pk]}, format='json').status_code == 201)
+        assert (client.post('/books/buy/', {'books': [book.pk, book.pk]}, format='json').status_code == 400)
+        # only the committed purchase has a message, and nothing is delivered until the worker runs
+        purchase = Purchase.objects.get()
+        assert (list(OutboxMessage.objects.values_list('topic', 'payload')) == [
+            ('purchase.created', {'purchase': purchase.pk, 'account': account.pk, 'operation': purchase.operation_id,
+                                  'books': {str(book.pk): 1}, 'cost': '30.00'})])
+        assert (delivered_messages == [])
+
+        output = StringIO()
+        call_command('run_outbox_worker', '--once', '--threads', '2', stdout=output)
+        # the first attempt failed before recording it, the retry went through and removed the message
+        assert (len(delivered_messages) == 1 and delivered_messages[0]['purchase'] == purchase.pk)
+        assert (not OutboxMessage.objects.exists())
+        assert ('Delivered 1 messages, 1 failed attempts' in output.getvalue())
+
+        # a message which keeps failing is given up after OUTBOX_MAX_ATTEMPTS, with its error
+        settings.OUTBOX_HANDLERS = {'purchase.created': ['tasks.tests.tests_commands.fail_every_attempt']}
+        staff = User.objects.create_user(username='staff', password='testpass', is_staff=True)
+        client.force_authenticate(user=staff)
+        client.post('/books/buy/batch/', {'orders': [{'account': account.pk, 'books': [book.pk]}]}, format='json')
+        call_command('run_outbox_worker', '--once', stdout=output)
+        message = OutboxMessage.objects.get()
+        assert (message.available_at is None and message.attempts == 2)
+        assert ('the broker is down' in message.last_error)
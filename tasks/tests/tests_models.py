@@ -4,12 +4,15 @@
 # The code coverage for views.py and models.py as I'm writing this is 100% and 100%
 # *****************************************************************************************************************
 
+import threading
 from decimal import Decimal
 
 from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Sum
 
 import pytest
-from tasks.models import Account, Book, Operation, Purchase
+from tasks.models import Account, Book, Operation, Purchase, InsufficientFunds
 
 
 class TestsModels:
@@ -28,13 +31,15 @@ class TestsModels:
     @pytest.mark.django_db
     def test_operation_creation_after_new_purchase(self):
         self.set_up()
-        book1 = Book.objects.get(book_id=1)
-        book2 = Book.objects.get(book_id=2)
+        book1 = Book.objects.get(title='book1')
+        book2 = Book.objects.get(title='book2')
         collective_price = book1.price + book2.price
-        purchase = Purchase.objects.create(account_id=1)  # we create a purchase transaction
-        purchase.books.add(book1)
-        purchase.books.add(book2)
-        purchase.save()
+        account = Account.objects.get(owner__username='test')
+        quantities, purchase_cost, _, _ = Purchase.collect_books_and_return_purchase_cost([book1.pk, book2.pk])
+        operation = Operation.objects.create(account=account, balance_change=-purchase_cost)
+        purchase = Purchase.objects.create(account=account, operation=operation)  # we create a purchase transaction
+        purchase.add_books(quantities)
+        assert (set(purchase.books.all()) == {book1, book2})
         assert (purchase.operation.balance_change == -collective_price)
         # the success of the assert above indicates that the purchase was created, books and operations were added
         # and that the operation balance was calculated correctly
@@ -42,16 +47,15 @@ class TestsModels:
     @pytest.mark.django_db
     def test_purchase_behavior_if_funds_insufficient(self):
         self.set_up(5.00)
-        book1 = Book.objects.get(book_id=1)
-        with pytest.raises(ValueError):
-            purchase = Purchase.objects.create(account_id=1)
-            purchase.books.add(book1)
-            purchase.save()
+        book1 = Book.objects.get(title='book1')
+        account = Account.objects.get(owner__username='test')
+        quantities, purchase_cost, _, _ = Purchase.collect_books_and_return_purchase_cost([book1.pk])
+        assert (not Purchase.is_transaction_possible(account.balance, purchase_cost))
 
     @pytest.mark.django_db
     def test_account_balance_change_after_operation_creation(self):
         self.set_up()
-        account1 = Account.objects.get(account_id=1)
+        account1 = Account.objects.get(owner__username='test')
         assert (account1.balance == 100)
         operation = Operation.objects.create(account=account1, balance_change=-30)
         assert (account1.balance == 100 + operation.balance_change)
@@ -59,20 +63,65 @@ class TestsModels:
     @pytest.mark.django_db
     def test_deposit(self):
         self.set_up()
-        account = Account.objects.get(account_id=1)
+        account = Account.objects.get(owner__username='test')
         account.deposit(100)
         assert (account.balance == 200)
 
     @pytest.mark.django_db
     def test_negative_value_deposit(self):
         self.set_up()
-        account = Account.objects.get(account_id=1)
+        account = Account.objects.get(owner__username='test')
         with pytest.raises(ValueError):
             account.deposit(-100)
 
     @pytest.mark.django_db
     def test_negative_value_operation(self):
         self.set_up(5.00)
-        account = Account.objects.get(account_id=1)
+        account = Account.objects.get(owner__username='test')
         with pytest.raises(Exception):
             Operation.objects.create(account=account, balance_change=Decimal(-100.00))
+
+    @pytest.mark.django_db
+    def test_rejected_operation_is_not_saved(self):
+        self.set_up(5.00)
+        account = Account.objects.get(owner__username='test')
+        with pytest.raises(InsufficientFunds):
+            Operation.objects.create(account=account, balance_change=Decimal('-5.01'))
+        assert (Operation.objects.filter(account=account).count() == 0)  # nothing was written, nothing to delete
+        Operation.objects.create(account=account, balance_change=Decimal('-5.00'))  # spending everything is fine
+        assert (Account.objects.get(pk=account.pk).balance == 0)
+
+    @pytest.mark.django_db(transaction=True)  # the threads need committed data in the file-backed test database
+    def test_concurrent_operations_keep_balance_consistent(self):
+        self.set_up(100.00)
+        account_id = Account.objects.get(owner__username='test').pk
+        threads_amount, operations_per_thread = 8, 25
+        rejected = []
+        start = threading.Barrier(threads_amount)
+
+        def worker(index):
+            account = Account.objects.get(pk=account_id)
+            start.wait()  # every thread starts hammering the same account at once
+            try:
+                for step in range(operations_per_thread):
+                    if (index + step) % 3 == 0:
+                        account.deposit(Decimal('1.00'))
+                    else:
+                        try:
+                            Operation.objects.create(account=account, balance_change=Decimal('-7.00'))
+                        except InsufficientFunds:
+                            rejected.append(index)
+            finally:
+                connection.close()  # every thread has its own connection
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(threads_amount)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        balance = Account.objects.get(pk=account_id).balance
+        ledger = Operation.objects.filter(account_id=account_id).aggregate(total=Sum('balance_change'))['total']
+        assert (rejected)  # the account really ran out of money during the test
+        assert (balance >= 0)  # it was never overdrawn
+        assert (balance == Decimal('100.00') + ledger)  # and every saved operation is reflected in the balance
@@ -1,8 +1,40 @@
+import asyncio
+import base64
+import copy
+import gzip
+import json
+import os
+import threading
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import brotli
+import msgpack
 import pytest
+from asgiref.sync import async_to_sync
 from decimal import Decimal
+from io import StringIO
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models import Sum
+from django.test import AsyncClient
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
-from tasks.models import Account, Book, Operation, Purchase
+from BookListAPI.database import SQLITE_PRAGMAS, apply_database_profile
+from BookListAPI.profiles import apply_settings_profile
+from tasks.metrics import LATENCY_BUCKETS, new_view_metrics, registry
+from tasks.encoders import RowEncoder
+from tasks.models import Account, Book, CatalogueVersion, IdempotencyKey, Operation, OutOfStock, Purchase, PurchaseBook
+from tasks.routers import RECENT_WRITE_KEY
+from tasks.serializers import AccountSerializer, BookSerializer
+from tasks.signals import close_if_broken
+from tasks.throttling import SharedMemoryCounters
 
 
 class TestsViews:
@@ -18,47 +50,181 @@ class TestsViews:
 
     @pytest.mark.django_db
     def test_books_endpoint_without_any_books(self):
+        Book.objects.all().delete()  # the sample data migration has created some books already
         client = APIClient()
         response = client.get('/books/')
-        data = response.data
-        assert (data['count'] == 0)
+        data = response.json()
+        assert (data['next'] is None)
         assert (len(data['results']) == 0)
 
     @pytest.mark.django_db
     def test_books_endpoint_with_sample_books(self):
+        Book.objects.all().delete()
         Book.objects.create(title='book1', price=10.00)
         Book.objects.create(title='book2', price=30.00)
         client = APIClient()
         response = client.get('/books/')
-        data = response.data
-        assert (data['count'] == 2)
+        data = response.json()
+        assert (data['next'] is None)
         assert (len(data['results']) == 2)
 
+    @pytest.mark.django_db
+    def test_list_fast_path_matches_serializer_output(self):
+        Book.objects.all().delete()
+        Book.objects.create(title='Zażółć "gęślą" jaźń \u2028', price=Decimal('10'))
+        Book.objects.create(title='book2', price=Decimal('0.5'))
+        user = User.objects.create_user(username='test', password='testpass')
+        Account.objects.create(balance=Decimal('100.10'), owner=user)
+        client = APIClient()
+        client.force_authenticate(user)
+        books = client.get('/books/?page_size=1')
+        expected = JSONRenderer().render(OrderedDict([
+            ('next', books.json()['next']), ('previous', None),
+            ('results', BookSerializer(Book.objects.order_by('id')[:1], many=True).data)]))
+        assert (books.content == expected)  # byte for byte what the serializer and JSONRenderer would send
+        assert (client.get(books.json()['next']).json()['results'][0]['price'] == '0.50')
+        accounts = client.get('/accounts/')
+        assert (accounts.content == JSONRenderer().render(AccountSerializer(Account.objects.all(), many=True).data))
+        # a NULL decimal is a null, as the serializer writes it
+        assert (RowEncoder(BookSerializer).encode_rows([(1, 'no price', None)]) ==
+                JSONRenderer().render([BookSerializer(Book(pk=1, title='no price', price=None)).data]).decode())
+        # an indented response still goes through the serializer
+        indented = client.get('/books/', HTTP_ACCEPT='application/json; indent=2')
+        assert (indented.json() == client.get('/books/').json() and b'\n  ' in indented.content)
+
+    @pytest.mark.django_db
+    def test_sparse_fieldsets_and_accounts_of_the_user(self):
+        Book.objects.all().delete()
+        Book.objects.bulk_create(Book(title=f'book{i}', price=10 + i) for i in range(5))
+        client = APIClient()
+        with CaptureQueriesContext(connection) as context:
+            books = client.get('/books/?fields=title,price&ordering=-price&page_size=2').json()
+        assert (books['results'] == [{'title': 'book4', 'price': '14.00'}, {'title': 'book3', 'price': '13.00'}])
+        assert (context.captured_queries[0]['sql'].startswith(
+            'SELECT "tasks_book"."title", "tasks_book"."price", "tasks_book"."id" FROM'))
+        # the ordering key isn't sent, but the next page still starts after the right book
+        assert (client.get(books['next']).json()['results'][0] == {'title': 'book2', 'price': '12.00'})
+        # the same through the serializer
+        indented = client.get('/books/?fields=title&ordering=-price&page_size=2',
+                              HTTP_ACCEPT='application/json; indent=2')
+        assert (indented.json()['results'] == [{'title': 'book4'}, {'title': 'book3'}])
+        assert (client.get('/books/?fields=id,isbn').status_code == 400)
+
+        user = User.objects.create_user(username='test', password='testpass')
+        account = Account.objects.create(balance=Decimal('100.10'), owner=user)
+        Account.objects.create(balance=5, owner=User.objects.create_user(username='other'))
+        client.force_authenticate(user)
+        assert (len(client.get('/accounts/').json()) == Account.objects.count())  # everybody's accounts, as before
+        with CaptureQueriesContext(connection) as context:
+            mine = client.get('/accounts/?owner=me&fields=id,balance').json()
+        assert (mine == {'next': None, 'previous': None, 'results': [{'id': account.pk, 'balance': '100.10'}]})
+        assert (len(context.captured_queries) == 1 and '"owner_id" =' in context.captured_queries[0]['sql'])
+
+    @pytest.mark.django_db
+    def test_books_endpoint_cursor_pagination(self):
+        Book.objects.all().delete()
+        # plenty of equal prices, so the pages have to break ties by the id
+        Book.objects.bulk_create(Book(title=f'book{i:02}', price=10 + i % 3) for i in range(25))
+        expected = list(Book.objects.order_by('-price', '-id').values_list('id', flat=True))  # ties by -id too
+        client = APIClient()
+        url, seen, pages = '/books/?ordering=-price&page_size=4', [], []
+        while url:
+            data = client.get(url).json()
+            pages.append(data)
+            seen += [book['id'] for book in data['results']]
+            url = data['next']
+        assert (seen == expected)  # every book exactly once, in order
+        previous_page = client.get(pages[-1]['previous']).json()  # and the way back gives the same pages
+        assert (previous_page['results'] == pages[-2]['results'])
+        assert (client.get('/books/?cursor=not-a-cursor').status_code == 404)
+        # a cursor value which isn't a value of the ordering field is refused as well, it never reaches the query
+        for ordering, value in [('price', 'abc'), ('-price', 'abc'), ('price', 'sNaN'), ('price', {}), ('title', None)]:
+            cursor = base64.b64encode(json.dumps({'v': value, 'i': 1, 'r': 0}).encode()).decode()
+            assert (client.get(f'/books/?ordering={ordering}&cursor={cursor}').status_code == 404)
+
+    @pytest.mark.django_db
+    def test_books_endpoint_search_and_price_filters(self):
+        Book.objects.all().delete()
+        monte_cristo = Book.objects.create(title='Count of Monte Cristo', price=50.00)
+        Book.objects.create(title='The Count Zero', price=15.00)
+        Book.objects.create(title='Counting Stars', price=30.00)
+        client = APIClient()
+
+        def titles(query):
+            response = client.get('/books/' + query)
+            assert (response.status_code == 200)
+            return sorted(book['title'] for book in response.json()['results'])
+
+        assert (titles('?title=Count') == ['Count of Monte Cristo', 'Counting Stars'])  # beginning of the title
+        assert (titles('?title=count') == ['Count of Monte Cristo', 'Counting Stars'])  # in any case
+        assert (titles('?title=\U0010ffff') == [])  # the last character there is
+        assert (titles('?search=count') == ['Count of Monte Cristo', 'Counting Stars', 'The Count Zero'])
+        assert (titles('?search=CRIST mon') == ['Count of Monte Cristo'])  # word prefixes, any case and order
+        assert (titles('?search=ount') == [])  # not the middle of a word
+        assert (titles('?search=(monte-CRIS') == ['Count of Monte Cristo'])  # punctuation separates the words
+        assert (titles('?search=of-cristo') == [])
+        assert (titles('?search=count&min_price=20&max_price=40') == ['Counting Stars'])
+        monte_cristo.title = 'The Stranger'  # the index follows every write of the titles
+        monte_cristo.save()
+        assert (titles('?search=cristo') == [])
+        assert (titles('?search=stranger') == ['The Stranger'])
+        monte_cristo.delete()
+        assert (titles('?search=stranger') == [])
+        assert (titles('?search="') == [])  # quotes can't break the full-text query
+        assert (client.get('/books/?min_price=cheap').status_code == 400)
+
+    @pytest.mark.django_db(transaction=True)  # the catalogue version changes only when a write is committed
+    def test_books_endpoint_etag_and_cache(self):
+        Book.objects.all().delete()
+        Book.objects.create(title='book1', price=10.00)
+        client = APIClient()
+        first = client.get('/books/', HTTP_ACCEPT='application/json')
+        etag = first['ETag']
+        with CaptureQueriesContext(connection) as context:
+            not_modified = client.get('/books/', HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+            cached = client.get('/books/', HTTP_ACCEPT='application/json')
+        assert (not_modified.status_code == 304)
+        assert (cached.content == first.content and cached['ETag'] == etag)
+        assert (len(context.captured_queries) == 0)  # neither of them has touched the database
+        Book.objects.create(title='book2', price=20.00)
+        changed = client.get('/books/', HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        assert (changed.status_code == 200 and changed['ETag'] != etag)
+        assert (len(changed.json()['results']) == 2)
+        Book.objects.filter(title='book2').delete()
+        assert (client.get('/books/', HTTP_ACCEPT='application/json').content == first.content)
+
+    @pytest.mark.django_db
+    def test_catalogue_cache_is_kept_per_host(self, settings):
+        settings.ALLOWED_HOSTS = ['*']  # as Django-Heroku and the API profile set it
+        Book.objects.all().delete()
+        Book.objects.bulk_create(Book(title=f'book{i}', price=10.00) for i in range(3))
+        client = APIClient()
+        for path in ('/books/?page_size=2', '/'):  # absolute pagination links and hyperlinks
+            other_host = client.get(path, HTTP_ACCEPT='application/json', HTTP_HOST='evil.example')
+            response = client.get(path, HTTP_ACCEPT='application/json')
+            assert ('http://evil.example/' in other_host.content.decode())
+            assert ('http://testserver/' in response.content.decode())
+            assert ('evil.example' not in response.content.decode())  # not served from the other host's entry
+            assert (response['ETag'] != other_host['ETag'])
+
     @pytest.mark.django_db
     def test_account_list_displaying(self):
         user = User.objects.create_user(
             username='test',
             password='testpass',
         )
-        Account.objects.create(balance=100.00, owner=user)
+        account = Account.objects.create(balance=100.00, owner=user)
         client = APIClient()
+        client.login(username='test', password='testpass')  # only the logged in users see the accounts
         response = client.get('/accounts/')
         assert response.status_code == 200  # assert the API accepted our request
-        data = response.data  # all the data in the response
-        assert (data['count'] == 1)  # assert there's only one account
-        results = self.get_results_dict(data)
-        assert (results['account_id'] == 1)
-        assert (results['owner'] == 1)
+        data = json.loads(response.content)  # all the accounts, next to the sample ones of the migrations
+        assert (len(data) == Account.objects.count())
+        results = {result['id']: result for result in data}[account.pk]
+        assert (results['owner'] == user.pk)
         assert (Decimal(results['balance']) == 100.00)
         # we asserted that the account we created is displayed correctly
 
-    @staticmethod
-    def get_results_dict(data):
-        results = data['results']
-        results = results[0]
-        results = dict(results)
-        return results
-
     @pytest.mark.django_db
     def test_account_creation_if_not_authenticated(self):
         user = User.objects.create_user(
@@ -66,29 +232,29 @@ class TestsViews:
             password='testpass',
         )
         client = APIClient()
-        response = client.post('/accounts/', {"owner": user, "balance": 100.00})
+        response = client.post('/accounts/', {"owner": user.pk, "balance": 100.00})
         assert (response.status_code == 403)
         assert (response.data[
                     'detail'].code == 'not_authenticated')  # assert the server did inform user he's not logged
-        assert (Account.objects.all().count() == 0)  # assert the account was not created
+        assert (not Account.objects.filter(owner=user).exists())  # assert the account was not created
 
     @pytest.mark.django_db
     def test_account_creation_if_authenticated(self):
-        User.objects.create_user(
+        user = User.objects.create_user(
             username='test',
             password='testpass',
         )
         client = APIClient()
         client.login(username='test',
                      password='testpass')  # we log with the same credentials we used while creating user
-        response = client.post('/accounts/', {"owner": 1, "balance": 100.00})
+        response = client.post('/accounts/', {"owner": user.pk, "balance": 100.00})
         assert (response.status_code == 201)
         data = response.data
-        assert (data['account_id'] == 1)
-        assert (data['owner'] == 1)
+        assert (data['id'] == Account.objects.get(owner=user).pk)
+        assert (data['owner'] == user.pk)
         assert (Decimal(data['balance']) == 100)
         # if all the credentials are good, let's just see if an account was created
-        assert (Account.objects.all().count() == 1)
+        assert (Account.objects.filter(owner=user).count() == 1)
 
     @pytest.mark.django_db
     def test_account_modification_owner_permission(self):
@@ -136,10 +302,11 @@ class TestsViews:
         user = self.books_buy_endpoint_helper_startup()
         client = APIClient()
         client.login(username='test', password='testpass')
-        data = {"books": [1, 2]}
+        book_ids = [Book.objects.get(title='book1').pk, Book.objects.get(title='book2').pk]
+        data = {"books": book_ids}
         response = client.post('/books/buy/', data, format='json')
         data = response.data
-        assert (data[0] == [1, 2])
+        assert (data[0] == book_ids)
         assert (data[1] == Decimal('40'))
         account = Account.objects.get(owner=user)
         assert (account.balance == 60.00)  # assert the price was deducted from the account
@@ -164,9 +331,577 @@ class TestsViews:
         self.books_buy_endpoint_helper_startup()
         client = APIClient()
         client.login(username='test', password='testpass')
-        data = {"books": [1, 3]}
+        missing_id = Book.objects.order_by('-pk').first().pk + 1
+        data = {"books": [Book.objects.get(title='book1').pk, missing_id]}
         response = client.post('/books/buy/', data, format='json')
         assert (response.status_code == 400)  # assert that server rejected the transaction
         data = response.data
-        assert (data['books'][0] == 'Invalid pk "3" - object does not exist.')
+        assert (data['books'][0] == f'Invalid pk "{missing_id}" - object does not exist.')
         # this is also a standard framework message, so we assert it is returned
+
+    @pytest.mark.django_db
+    def test_books_buy_endpoint_duplicate_ids_become_quantities(self):
+        user = self.books_buy_endpoint_helper_startup()
+        book = Book.objects.get(title='book1')
+        client = APIClient()
+        client.login(username='test', password='testpass')
+        response = client.post('/books/buy/', {"books": [book.pk, book.pk, book.pk]}, format='json')
+        assert (response.status_code == 201)
+        assert (response.data[1] == Decimal('30'))
+        assert (PurchaseBook.objects.get(book=book).quantity == 3)  # one row with a quantity, not three rows
+        assert (Account.objects.get(owner=user).balance == 70.00)
+
+    @pytest.mark.django_db
+    def test_books_buy_endpoint_reports_all_missing_ids(self):
+        self.books_buy_endpoint_helper_startup()
+        client = APIClient()
+        client.login(username='test', password='testpass')
+        existing_id = Book.objects.get(title='book1').pk
+        response = client.post('/books/buy/', {"books": [existing_id, 100001, 100002, 100001]}, format='json')
+        assert (response.status_code == 400)
+        assert (response.data['books'] == ['Invalid pk "100001" - object does not exist.',
+                                           'Invalid pk "100002" - object does not exist.'])
+        assert (Purchase.objects.all().count() == 0)
+
+    @pytest.mark.django_db
+    def test_books_buy_endpoint_query_count_does_not_grow_with_cart(self):
+        user = self.books_buy_endpoint_helper_startup(balance=100000.00)
+        Book.objects.bulk_create(Book(title=f'bulk{i}', price=1.00) for i in range(50))
+        book_ids = list(Book.objects.values_list('id', flat=True))
+        client = APIClient()
+        client.force_authenticate(user)  # keeps the session lookups out of the measured queries
+
+        def count_purchase_queries(cart):
+            with CaptureQueriesContext(connection) as context:
+                response = client.post('/books/buy/', {"books": cart}, format='json')
+            assert (response.status_code == 201)
+            return len(context.captured_queries)
+
+        single_book = count_purchase_queries(book_ids[:1])
+        large_cart = count_purchase_queries(book_ids + book_ids[:10])  # 50+ distinct books, some of them twice
+        assert (large_cart == single_book)  # resolving, pricing and linking take the same queries for any cart
+
+    @pytest.mark.django_db
+    def account_statement_helper_startup(self, operations_amount=3):
+        user = User.objects.create_user(username='test', password='testpass')
+        account = Account.objects.create(balance=100.00, owner=user)
+        # bulk_create skips Operation.save(), the balance doesn't matter for a statement
+        Operation.objects.bulk_create(Operation(account=account, balance_change=Decimal('-1.50'))
+                                      for _ in range(operations_amount))
+        for day, operation in enumerate(Operation.objects.filter(account=account).order_by('id'), start=1):
+            operation.created = datetime(2021, 1, day % 28 + 1, tzinfo=timezone.utc)
+            operation.save(update_fields=['created'])
+        return user, account
+
+    @pytest.mark.django_db
+    def test_account_statement_formats_and_date_range(self):
+        user, account = self.account_statement_helper_startup()
+        client = APIClient()
+        client.login(username='test', password='testpass')
+        response = client.get(f'/accounts/{account.pk}/operations/')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        assert (response['Content-Type'] == 'text/csv; charset=utf-8')  # CSV is the default
+        assert (lines[0] == 'id,created,operation_type,balance_change')
+        assert (len(lines) == 4 and lines[1].endswith(',deduction,-1.50'))
+        response = client.get(f'/accounts/{account.pk}/operations.jsonl?since=2021-01-03&until=2021-01-04')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        assert (rows == [{'id': rows[0]['id'], 'created': '2021-01-03T00:00:00+00:00',
+                          'operation_type': 'deduction', 'balance_change': '-1.50'}])
+        assert (client.get(f'/accounts/{account.pk}/operations/?since=yesterday').status_code == 400)
+
+    @pytest.mark.django_db
+    def test_account_statement_permissions(self):
+        user, account = self.account_statement_helper_startup()
+        client = APIClient()
+        assert (client.get(f'/accounts/{account.pk}/operations/').status_code == 403)  # not logged in
+        User.objects.create_user(username='stranger', password='testpass')
+        client.login(username='stranger', password='testpass')
+        assert (client.get(f'/accounts/{account.pk}/operations/').status_code == 403)  # not the owner
+        User.objects.create_user(username='auditor', password='testpass', is_staff=True)
+        client.login(username='auditor', password='testpass')
+        assert (client.get(f'/accounts/{account.pk}/operations/').status_code == 200)
+
+    @pytest.mark.django_db
+    def test_account_statement_memory_does_not_grow_with_history(self):
+        user = User.objects.create_user(username='test', password='testpass')
+        account = Account.objects.create(balance=100.00, owner=user)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        def peak_memory_of_export(operations_amount):
+            Operation.objects.filter(account=account).delete()
+            Operation.objects.bulk_create(Operation(account=account, balance_change=Decimal('-1.50'))
+                                          for _ in range(operations_amount))
+            response = client.get(f'/accounts/{account.pk}/operations.jsonl')
+            tracemalloc.start()
+            exported = sum(len(chunk) for chunk in response.streaming_content)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return exported, peak
+
+        small_export, small_peak = peak_memory_of_export(8000)
+        large_export, large_peak = peak_memory_of_export(40000)
+        assert (large_export > 4 * small_export)
+        assert (large_peak < 2 * small_peak)  # five times the history, but about the same memory
+        assert (large_peak < large_export / 4)  # and far less than the whole statement
+
+    @pytest.mark.django_db
+    def test_batch_purchase_results_per_order(self):
+        book1 = Book.objects.create(title='book1', price=10.00)
+        book2 = Book.objects.create(title='book2', price=30.00)
+        rich = Account.objects.create(balance=100.00, owner=User.objects.create_user(username='rich', password='x'))
+        poor = Account.objects.create(balance=15.00, owner=User.objects.create_user(username='poor', password='x'))
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='shop', password='x', is_staff=True))
+        orders = [{'account': rich.pk, 'books': [book1.pk, book2.pk, book2.pk]},
+                  {'account': poor.pk, 'books': [book1.pk]},
+                  {'account': poor.pk, 'books': [book1.pk]},  # the first order has left only 5.00
+                  {'account': rich.pk, 'books': [book1.pk, 100001]},
+                  {'account': 100001, 'books': [book1.pk]}]
+        response = client.post('/books/buy/batch/', {'orders': orders}, format='json')
+        assert (response.status_code == 200)
+        results = response.data['results']
+        assert ([result['status'] for result in results] == ['success', 'success', 'failed', 'failed', 'failed'])
+        assert ([result.get('reason') for result in results[2:]] ==
+                ['insufficient funds', 'books do not exist: [100001]', 'account does not exist'])
+        assert (results[0]['cost'] == Decimal('70.00') and results[0]['books'] == [book1.pk, book2.pk, book2.pk])
+        assert (Account.objects.get(pk=rich.pk).balance == 30.00)
+        assert (Account.objects.get(pk=poor.pk).balance == 5.00)
+        purchase = Purchase.objects.get(pk=results[0]['purchase'])
+        assert (purchase.operation.balance_change == Decimal('-70.00') and purchase.account_id == rich.pk)
+        assert (dict(PurchaseBook.objects.filter(purchase=purchase).values_list('book_id', 'quantity')) ==
+                {book1.pk: 1, book2.pk: 2})
+        assert (Purchase.objects.get(pk=results[1]['purchase']).operation.account_id == poor.pk)
+
+    @pytest.mark.django_db
+    def test_batch_purchase_query_count_does_not_grow_with_orders(self, settings):
+        book = Book.objects.create(title='book1', price=1.00)
+        accounts = [Account.objects.create(balance=100.00, owner=User.objects.create_user(username=f'u{i}'))
+                    for i in range(30)]
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='shop', password='x', is_staff=True))
+        assert (APIClient().post('/books/buy/batch/', {'orders': []}, format='json').status_code == 403)
+
+        def count_batch_queries(orders_amount):
+            orders = [{'account': accounts[i % 30].pk, 'books': [book.pk]} for i in range(orders_amount)]
+            with CaptureQueriesContext(connection) as context:
+                response = client.post('/books/buy/batch/', {'orders': orders}, format='json')
+            assert (all(result['status'] == 'success' for result in response.data['results']))
+            return len(context.captured_queries)
+
+        assert (count_batch_queries(2) == count_batch_queries(60))
+        assert (Operation.objects.count() == 62 and Purchase.objects.count() == 62)
+        too_many = [{'account': accounts[0].pk, 'books': [book.pk]}] * (settings.BATCH_PURCHASE_MAX_ORDERS + 1)
+        response = client.post('/books/buy/batch/', {'orders': too_many}, format='json')
+        assert (response.status_code == 400 and 'orders' in response.data)
+        assert (Purchase.objects.count() == 62)
+
+    @pytest.mark.django_db
+    def test_books_buy_endpoint_idempotency_key(self):
+        user = self.books_buy_endpoint_helper_startup()
+        book = Book.objects.get(title='book1')
+        client = APIClient()
+        client.force_authenticate(user)
+        first = client.post('/books/buy/', {"books": [book.pk]}, format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+        with CaptureQueriesContext(connection) as context:
+            retry = client.post('/books/buy/', {"books": [book.pk]}, format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+        assert (first.status_code == retry.status_code == 201)
+        assert (retry.content == first.content and retry['Idempotent-Replayed'] == 'true')
+        assert (not any('tasks_book' in query['sql'] for query in context.captured_queries))  # no pricing at all
+        assert (Account.objects.get(owner=user).balance == 90.00)  # charged only once
+        assert (Purchase.objects.count() == 1 and Operation.objects.count() == 1)
+        other_cart = client.post('/books/buy/', {"books": [book.pk, book.pk]}, format='json',
+                                 HTTP_IDEMPOTENCY_KEY='order-1')
+        assert (other_cart.status_code == 422)
+        IdempotencyKey.objects.update(expires=datetime.now(timezone.utc) - timedelta(seconds=1))
+        call_command('purge_idempotency_keys')
+        assert (IdempotencyKey.objects.count() == 0)  # once expired, the key may be used again
+        client.post('/books/buy/', {"books": [book.pk]}, format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+        assert (Account.objects.get(owner=user).balance == 80.00)
+
+    @pytest.mark.django_db(transaction=True)
+    def test_books_buy_endpoint_concurrent_duplicates_are_collapsed(self):
+        user = self.books_buy_endpoint_helper_startup()
+        book = Book.objects.get(title='book1')
+        threads_amount = 6
+        start = threading.Barrier(threads_amount)
+        statuses = []
+
+        def retry_storm():
+            client = APIClient()
+            client.force_authenticate(user)
+            start.wait()
+            try:
+                response = client.post('/books/buy/', {"books": [book.pk]}, format='json',
+                                       HTTP_IDEMPOTENCY_KEY='storm')
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=retry_storm) for _ in range(threads_amount)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert (len(statuses) == threads_amount and set(statuses) <= {201, 409})
+        assert (Purchase.objects.count() == 1)  # only one of the duplicates was executed
+        assert (Account.objects.get(owner=user).balance == 90.00)
+
+    @pytest.mark.django_db(transaction=True)  # the async views read in threads of their own, with own connections
+    @pytest.mark.urls('BookListAPI.asgi_urls')
+    def test_async_read_endpoints(self):
+        Book.objects.all().delete()
+        Book.objects.create(title='book1', price=10.00)
+        Book.objects.create(title='book2', price=30.00)
+        user = User.objects.create_user(username='test', password='testpass')
+        Account.objects.create(balance=100.00, owner=user)
+        client = AsyncClient()
+        client.force_login(user)
+
+        async def read_concurrently():
+            return await asyncio.gather(client.get('/books/?format=json'), client.get('/?format=json'),
+                                        client.get('/accounts/?format=json'))
+
+        async def write():
+            return await client.post('/books/', {'title': 'book3'})
+
+        books, root, accounts = async_to_sync(read_concurrently)()
+        assert (books.status_code == 200 and root.status_code == 200 and accounts.status_code == 200)
+        assert ([book['title'] for book in books.json()['results']] == ['book1', 'book2'])
+        assert (list(root.json().keys()) == ['accounts', 'books', 'books-buy'])
+        assert (Decimal(accounts.json()[-1]['balance']) == 100)
+        assert (books.content == APIClient().get('/books/?format=json').content)  # same as the synchronous view
+        assert (async_to_sync(write)().status_code == 405)  # writes still go through Django's own thread
+
+    @pytest.mark.django_db
+    def test_metrics_endpoint(self, settings, tmp_path):
+        settings.METRICS_TOKEN = 'scraper-token'
+        os.makedirs(settings.METRICS_DIR)
+        # what another gunicorn worker has written, it's added to the metrics of this process
+        other_worker = new_view_metrics()
+        other_worker.update(count=3, queries=6, buckets=[3] + [0] * len(LATENCY_BUCKETS))
+        (tmp_path / 'metrics' / 'worker-1.json').write_text(json.dumps(
+            {'views': {'book-list': other_worker}, 'counters': {'price_index_hits': 4}}))
+        client = APIClient()
+        for _ in range(2):
+            client.get('/books/', HTTP_ACCEPT='application/json')
+        response = client.get('/metrics/', HTTP_AUTHORIZATION='Bearer scraper-token')
+        assert (response.status_code == 200 and response['Content-Type'].startswith('text/plain'))
+        metrics = dict(line.rsplit(' ', 1) for line in response.content.decode().splitlines()
+                       if not line.startswith('#'))
+        assert (metrics['booklist_request_duration_seconds_count{view="book-list"}'] == '5')
+        assert (metrics['booklist_request_duration_seconds_bucket{view="book-list",le="+Inf"}'] == '5')
+        assert (int(metrics['booklist_request_queries_total{view="book-list"}']) >= 6 + 1)  # 1+ of this worker
+        assert (int(metrics['booklist_response_bytes_total{view="book-list"}']) > 0)
+        assert (metrics['booklist_price_index_hits_total'] == '4')
+        assert (client.get('/metrics/').status_code == 403)
+        assert (client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code == 403)
+
+    @pytest.mark.django_db
+    def test_database_performance_profile(self, tmp_path):
+        databases = {'default': dict(connection.settings_dict, NAME=str(tmp_path / 'db.sqlite3'))}
+        apply_database_profile(databases, 'performance', conn_max_age=60)
+        assert (databases['default']['CONN_MAX_AGE'] == 60 and databases['default']['CONN_HEALTH_CHECKS'])
+        with pytest.raises(ImproperlyConfigured):
+            apply_database_profile(databases, 'fastest')
+        # a new connection gets the pragmas
+        tuned = connections['default'].__class__(databases['default'])
+        with tuned.cursor() as cursor:
+            pragmas = {name: cursor.execute(f'PRAGMA {name}').fetchone()[0] for name in SQLITE_PRAGMAS}
+        assert (pragmas == {'journal_mode': 'wal', 'busy_timeout': 5000, 'synchronous': 1, 'cache_size': -65536})
+        close_if_broken(tuned)
+        assert (tuned.connection is not None)  # it still works, so it's reused
+        tuned.is_usable = lambda: False
+        close_if_broken(tuned)
+        assert (tuned.connection is None)
+
+    def test_api_only_settings_profile(self, settings):
+        names = ('INSTALLED_APPS', 'MIDDLEWARE', 'TEMPLATES', 'ALLOWED_HOSTS', 'DATABASES')
+        full = {name: copy.deepcopy(getattr(settings, name)) for name in names}
+        api = copy.deepcopy(full)
+        apply_settings_profile(api, 'api')
+        assert ('django.contrib.admin' not in api['INSTALLED_APPS'] and 'tasks' in api['INSTALLED_APPS'])
+        assert ('tasks.middleware.MessageMiddleware' not in api['MIDDLEWARE'])
+        assert (api['MIDDLEWARE'][0] == 'tasks.middleware.MetricsMiddleware')
+        assert ('django.contrib.messages.context_processors.messages' not in
+                api['TEMPLATES'][0]['OPTIONS']['context_processors'])
+        unchanged = copy.deepcopy(full)
+        apply_settings_profile(unchanged, 'full')
+        assert (unchanged == full)
+        with pytest.raises(ImproperlyConfigured):
+            apply_settings_profile(full, 'lean')
+
+    def test_effective_middleware(self, settings):
+        # as the settings end up after Django-Heroku, which inserts its own WhiteNoise middleware first
+        assert (settings.MIDDLEWARE[0] == 'tasks.middleware.MetricsMiddleware')  # it measures the whole request
+        assert ('whitenoise.middleware.WhiteNoiseMiddleware' not in settings.MIDDLEWARE)
+        assert ('tasks.middleware.WhiteNoiseMiddleware' in settings.MIDDLEWARE)
+        assert (settings.STATICFILES_STORAGE == 'whitenoise.storage.CompressedManifestStaticFilesStorage')
+
+    @pytest.mark.django_db(transaction=True)  # the requests of a test transaction would read from the primary
+    def test_list_reads_from_the_replica_but_users_read_their_own_writes(self, replicate):
+        user = self.books_buy_endpoint_helper_startup()  # an account of 100 and book1 at 10
+        replica = replicate()
+        client = APIClient()
+        client.force_authenticate(user)
+        with CaptureQueriesContext(replica) as replica_queries:
+            response = client.post('/books/buy/', {'books': [Book.objects.get(title='book1').pk]}, format='json')
+        assert (response.status_code == 201 and not replica_queries.captured_queries)  # writes go to the primary
+        mine = client.get('/accounts/?owner=me').json()['results']
+        assert (mine[0]['balance'] == '90.00')  # the purchase is seen right away, from the primary
+        someone_else = APIClient()
+        someone_else.force_authenticate(User.objects.create_user(username='someone else'))
+        balances = {account['owner']: account['balance'] for account in someone_else.get('/accounts/').json()}
+        assert (balances[user.pk] == '100.00')  # the replica still lags behind
+        cache.delete(RECENT_WRITE_KEY.format(user.pk))  # the window is over
+        assert (client.get('/accounts/?owner=me').json()['results'][0]['balance'] == '100.00')
+
+    @pytest.mark.django_db(transaction=True)
+    def test_a_lagging_replica_never_fills_the_catalogue_cache(self, replicate):
+        self.books_buy_endpoint_helper_startup()
+        client = APIClient()
+        client.get('/books/')  # cached under the current version
+        replica = replicate()
+        Book.objects.create(title='not replicated yet', price=1)  # bumps the catalogue version
+        with CaptureQueriesContext(replica) as replica_queries:
+            titles = [book['title'] for book in client.get('/books/?page_size=1000').json()['results']]
+        assert ('not replicated yet' in titles and not replica_queries.captured_queries)
+        # the cached response of the new version is the new catalogue as well
+        titles = [book['title'] for book in client.get('/books/?page_size=1000').json()['results']]
+        assert ('not replicated yet' in titles)
+
+    @pytest.mark.django_db
+    def test_limited_editions_are_never_oversold(self):
+        user = self.books_buy_endpoint_helper_startup(balance=1000.00)
+        unlimited = Book.objects.get(title='book1')
+        limited = Book.objects.create(title='limited', price=10.00, stock=3)
+        rare = Book.objects.create(title='rare', price=10.00, stock=1)
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post('/books/buy/', {'books': [limited.pk, limited.pk, unlimited.pk]}, format='json')
+        assert (response.status_code == 201)
+        assert (Book.objects.get(pk=limited.pk).stock == 1 and Book.objects.get(pk=unlimited.pk).stock is None)
+        # every book short of copies in one response, and nothing is bought
+        response = client.post('/books/buy/', {'books': [limited.pk, limited.pk, rare.pk, rare.pk]}, format='json')
+        assert (response.status_code == 400 and len(response.data['books']) == 2)
+        assert (Purchase.objects.count() == 1)
+
+        # the cart was validated, then somebody else took the copies, the conditional UPDATE takes none of them
+        with pytest.raises(OutOfStock) as error, transaction.atomic():
+            Book.take_from_stock({limited.pk: 2, rare.pk: 1})
+        assert (error.value.shortages == {limited.pk: 1})
+        assert (Book.objects.get(pk=rare.pk).stock == 1)
+
+        client.force_authenticate(User.objects.create_user(username='shop', is_staff=True))
+        account = Account.objects.get(owner=user)
+        results = client.post('/books/buy/batch/', {'orders': [{'account': account.pk, 'books': [rare.pk]},
+                                                               {'account': account.pk, 'books': [rare.pk]}]},
+                              format='json').data['results']
+        assert ([result['status'] for result in results] == ['success', 'failed'])
+        assert (results[1]['reason'] == f'books out of stock: [{rare.pk}]')
+        assert (Book.objects.get(pk=rare.pk).stock == 0)
+
+    @pytest.mark.django_db
+    def test_account_summary_matches_the_ledger(self):
+        user = self.books_buy_endpoint_helper_startup()
+        account = Account.objects.get(owner=user)
+        book = Book.objects.get(title='book1')
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(user)
+        for _ in range(3):
+            client.post('/books/buy/', {"books": [book.pk]}, format='json')
+        account.deposit(Decimal('5.55'))
+        client.force_authenticate(staff)
+        client.post('/books/buy/batch/', {'orders': [{'account': account.pk, 'books': [book.pk, book.pk]}]},
+                    format='json')
+        # an operation of last month, its rollups are rebuilt from the ledger
+        Operation.objects.filter(pk=Operation.objects.filter(account=account).first().pk).update(
+            created=datetime.now(timezone.utc) - timedelta(days=40))
+        call_command('rebuild_spending_rollups', '--account', str(account.pk), stdout=StringIO())
+
+        client.force_authenticate(user)
+        for period in ('day', 'month'):
+            summary = client.get(f'/accounts/{account.pk}/summary/?period={period}').json()
+            operations = Operation.objects.filter(account=account)
+            assert (Decimal(summary['deposited']) == operations.filter(balance_change__gt=0).aggregate(
+                total=Sum('balance_change'))['total'].quantize(Decimal('0.01')))
+            assert (Decimal(summary['spent']) == -operations.filter(balance_change__lt=0).aggregate(
+                total=Sum('balance_change'))['total'].quantize(Decimal('0.01')))
+            assert (sum(row['operations'] for row in summary['results']) == operations.count())
+            assert (len(summary['results']) == 2)  # this period and the one 40 days ago
+        this_month = datetime.now(timezone.utc).date().replace(day=1)
+        summary = client.get(f'/accounts/{account.pk}/summary/?since={this_month}').json()
+        assert (Decimal(summary['spent']) == 40)  # 4 of the 5 books were bought this month, at 10 each
+        with CaptureQueriesContext(connection) as context:
+            client.get(f'/accounts/{account.pk}/summary/')
+        assert (len(context.captured_queries) == 2)  # the account and its rollups
+        assert (client.get(f'/accounts/{account.pk}/summary/?period=year').status_code == 400)
+        client.force_authenticate(User.objects.create_user(username='stranger'))
+        assert (client.get(f'/accounts/{account.pk}/summary/').status_code == 403)
+
+    @pytest.mark.django_db
+    def test_purchases_are_throttled_per_user_and_per_ip(self, settings, monkeypatch):
+        settings.THROTTLE_RATES = {'books-buy': {'user': '2/min', 'ip': '7/min'}}
+        now = 60 * 20000000 + 30  # halfway through a minute
+        monkeypatch.setattr('tasks.middleware.time.time', lambda: now)
+        self.books_buy_endpoint_helper_startup(balance=1000)
+        Account.objects.create(balance=1000, owner=User.objects.create_user(username='other', password='otherpass'))
+        clients = [APIClient(), APIClient(), APIClient()]
+        clients[0].login(username='test', password='testpass')
+        clients[1].login(username='other', password='otherpass')
+        for client in clients[:2]:
+            for _ in range(2):
+                assert (client.post('/books/buy/', {"books": [1]}, format='json').status_code == 201)
+            response = client.post('/books/buy/', {"books": [1]}, format='json')
+            assert (response.status_code == 429)  # the limit of the user, once authenticated
+            assert (response['Retry-After'] == '60')  # 30 s to the next minute, then half of it slides out
+        # the limit is the user's, whatever the credentials, other ones don't get around it
+        token = Token.objects.create(user=User.objects.get(username='test'))
+        clients[2].credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        assert (clients[2].post('/books/buy/', {"books": [1]}, format='json').status_code == 429)
+        clients[2].credentials()
+        # the 8th request of the IP, the ones rejected by the user limits were counted by the limit of the IP,
+        # which rejects the following ones before any query
+        with CaptureQueriesContext(connection) as context:
+            response = clients[2].post('/books/buy/', {"books": [1]}, format='json')
+        assert (response.status_code == 429 and len(context.captured_queries) == 0)  # not even the session
+        assert (response['Retry-After'] == '39')
+        assert (Purchase.objects.count() == 4)
+
+        now += 60  # the previous minute only counts for half now
+        assert (clients[0].post('/books/buy/', {"books": [1]}, format='json').status_code == 201)
+        assert (clients[0].post('/books/buy/', {"books": [1]}, format='json').status_code == 429)
+        assert (clients[0].get('/books/').status_code == 200)  # the other views have no limits
+
+        settings.THROTTLE_RATES = {'books-buy': {'ip': '0/min'}}  # closed
+        response = clients[0].post('/books/buy/', {"books": [1]}, format='json')
+        assert (response.status_code == 429 and response['Retry-After'] == '60')
+
+    def test_shared_counters_count_the_requests_they_have_no_slot_for(self, monkeypatch, tmp_path):
+        # every key probes the same two slots
+        monkeypatch.setattr(SharedMemoryCounters, 'SLOTS', 3)
+        monkeypatch.setattr(SharedMemoryCounters, 'PROBES', 2)
+        counters = SharedMemoryCounters(str(tmp_path / 'counters'))
+        assert (counters.hit([('first', 60, 1), ('second', 60, 1)]) == [(0, 1), (0, 1)])
+        assert (counters.hit([('third', 60, 1)]) == [(0, 0)])  # not limited
+        assert (registry.counters['throttle_slots_full'] == 1)
+        assert (counters.hit([('third', 60, 3)]) == [(0, 1)])  # once the others have expired
+
+    @pytest.mark.django_db
+    def test_lists_in_messagepack_and_compressed(self, settings):
+        user = self.books_buy_endpoint_helper_startup()
+        Book.objects.bulk_create(Book(title=f'Book {number}', price=Decimal('0.01') * number)
+                                 for number in range(1, 60))
+        client = APIClient()
+        client.force_authenticate(user)
+        json_books = client.get('/books/?page_size=100', HTTP_ACCEPT='application/json').json()
+        for response in (client.get('/books/?page_size=100&format=msgpack'),
+                         client.get('/books.msgpack?page_size=100'),
+                         client.get('/books/?page_size=100', HTTP_ACCEPT='application/msgpack')):
+            assert (response['Content-Type'] == 'application/msgpack')
+            assert (msgpack.unpackb(response.content) == json_books)  # the prices as their exact strings too
+        assert ('0.01' in [book['price'] for book in json_books['results']])
+        books = msgpack.unpackb(client.get('/books/?fields=id,price&format=msgpack').content)['results']
+        assert (set(books[0]) == {'id', 'price'})
+        accounts = msgpack.unpackb(client.get('/accounts/?owner=me&format=msgpack').content)
+        assert (accounts['results'] == [{'id': Account.objects.get(owner=user).pk, 'balance': '100.00',
+                                         'owner': user.pk}])
+
+        plain = client.get('/books/?page_size=100', HTTP_ACCEPT='application/json')
+        compressed = client.get('/books/?page_size=100', HTTP_ACCEPT='application/json',
+                                HTTP_ACCEPT_ENCODING='gzip, deflate')
+        assert (compressed['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in compressed['Vary'])
+        assert (gzip.decompress(compressed.content) == plain.content)
+        assert (compressed['ETag'] == 'W/' + plain['ETag'])
+        assert (client.get('/books/?page_size=100', HTTP_ACCEPT='application/json', HTTP_ACCEPT_ENCODING='gzip',
+                           HTTP_IF_NONE_MATCH=compressed['ETag']).status_code == 304)
+        # brotli is preferred by the clients which accept both
+        compressed = client.get('/books/?page_size=100', HTTP_ACCEPT='application/json',
+                                HTTP_ACCEPT_ENCODING='gzip, br')
+        assert (compressed['Content-Encoding'] == 'br' and brotli.decompress(compressed.content) == plain.content)
+        # not below COMPRESSION_MIN_SIZE, nor for a client which refuses it
+        assert (not client.get('/', HTTP_ACCEPT_ENCODING='gzip').has_header('Content-Encoding'))
+        assert (not client.get('/books/?page_size=100', HTTP_ACCEPT_ENCODING='gzip;q=0').has_header('Content-Encoding'))
+        # nor the pages of the browsable API, rendered without the manifest of collectstatic here
+        settings.STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        assert (not client.get('/books/?page_size=100', HTTP_ACCEPT='text/html',
+                               HTTP_ACCEPT_ENCODING='gzip').has_header('Content-Encoding'))
+        # a streamed statement is compressed as it is sent
+        client.post('/books/buy/', {"books": [1, 2]}, format='json')
+        statement_url = f'/accounts/{Account.objects.get(owner=user).pk}/operations.jsonl'
+        statement = client.get(statement_url, HTTP_ACCEPT_ENCODING='gzip')
+        assert (statement['Content-Encoding'] == 'gzip')
+        assert (gzip.decompress(b''.join(statement.streaming_content)) ==
+                b''.join(client.get(statement_url).streaming_content))
+
+    @pytest.mark.django_db
+    def test_a_changed_price_is_never_charged_from_the_price_index(self, monkeypatch):
+        user = self.books_buy_endpoint_helper_startup()
+        book = Book.objects.get(title='book1')
+        client = APIClient()
+        client.force_authenticate(user)
+        for _ in range(2):  # read from the database once, then priced by the index
+            assert (client.post('/books/buy/', {"books": [book.pk]}, format='json').data[1] == Decimal('10.00'))
+        assert (registry.counters['price_index_misses'] == 1 and registry.counters['price_index_hits'] == 1)
+        book.price = 15
+        book.save()  # the index of this worker is emptied right away
+        assert (client.post('/books/buy/', {"books": [book.pk]}, format='json').data[1] == Decimal('15.00'))
+
+        # another worker changes the price after the cart was priced, before this one has heard of it
+        changes = iter([20])
+        is_transaction_possible = Purchase.is_transaction_possible
+
+        def change_price(account_balance, transaction_price):
+            price = next(changes, None)
+            if price is not None:
+                Book.objects.filter(pk=book.pk).update(price=price)  # no signal, the index isn't emptied
+                CatalogueVersion.bump()
+            return is_transaction_possible(account_balance, transaction_price)
+        monkeypatch.setattr(Purchase, 'is_transaction_possible', change_price)
+        response = client.post('/books/buy/', {"books": [book.pk]}, format='json')
+        assert (response.status_code == 201 and response.data[1] == Decimal('20.00'))  # priced again, not 15
+        assert (Account.objects.get(owner=user).balance == Decimal('45.00'))
+
+        # and when it keeps changing, nothing is bought
+        changes = iter([21, 22, 23])
+        assert (client.post('/books/buy/', {"books": [book.pk]}, format='json',
+                            HTTP_IDEMPOTENCY_KEY='order-1').status_code == 409)
+        assert (Purchase.objects.count() == 4 and Account.objects.get(owner=user).balance == Decimal('45.00'))
+        # the conflict isn't stored, the retry with the same key buys at the last price
+        retry = client.post('/books/buy/', {"books": [book.pk]}, format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+        assert (retry.status_code == 201 and retry.data[1] == Decimal('23.00') and 'Idempotent-Replayed' not in retry)
+
+    @pytest.mark.django_db
+    def test_token_authentication_is_cached_and_skips_the_session(self, settings):
+        user = self.books_buy_endpoint_helper_startup()
+        book = Book.objects.get(title='book1')
+        session_client = APIClient()
+        session_client.login(username='test', password='testpass')
+        token_client = APIClient()
+        token_client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+        queries = {}
+        for name, client in (('session', session_client), ('token', token_client)):
+            client.post('/books/buy/', {"books": [book.pk]}, format='json')  # the token is cached by the first one
+            with CaptureQueriesContext(connection) as context:
+                response = client.post('/books/buy/', {"books": [book.pk]}, format='json')
+            assert (response.status_code == 201)
+            queries[name] = len(context.captured_queries)
+        # no session, no user and no account read
+        assert (queries['session'] - queries['token'] >= 3)
+        assert (settings.SESSION_COOKIE_NAME not in response.cookies)
+        assert (Account.objects.get(owner=user).balance == Decimal('60.00'))
+        response = token_client.get('/accounts/?owner=me', HTTP_ACCEPT='application/json')
+        assert ([account['owner'] for account in json.loads(response.content)['results']] == [user.pk])
+        # the balance is still checked, by the purchase itself
+        response = token_client.post('/books/buy/', {"books": [book.pk] * 7}, format='json')
+        assert (response.status_code == 400 and Account.objects.get(owner=user).balance == Decimal('60.00'))
+
+        # a revoked token, or the one of a deactivated user, is refused right away
+        Token.objects.filter(user=user).delete()
+        assert (token_client.post('/books/buy/', {"books": [book.pk]}, format='json').status_code == 403)
+        token_client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+        assert (token_client.get('/accounts/?owner=me').status_code == 200)
+        user.is_active = False
+        user.save()
+        assert (token_client.get('/accounts/?owner=me').status_code == 403)
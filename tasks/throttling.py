@@ -0,0 +1,200 @@
+"""
+Rate limits of the expensive endpoints, per user and per client IP, see settings.THROTTLE_RATES. The limits per IP
+are checked by tasks.middleware.ThrottleMiddleware before the session, the user or anything else is read from
+the database. The limits per user by VerifiedUserThrottle, once REST framework has authenticated the user, so
+a client can't get around them with made-up session cookies or tokens.
+The limits hold over a sliding window, approximated with two fixed windows: the requests of the current one plus
+those of the previous one, weighted by the part of it the sliding window still covers.
+
+Each request is counted with an atomic increment, unlike the read-modify-write of REST framework's throttles,
+which lets concurrent requests served by different workers through. By default the counters are kept in memory
+shared by the workers of the machine (a file mapped by each of them, THROTTLE_COUNTERS_PATH), an update takes
+a lock of its counter alone and a few microseconds. With several machines they have to be in a cache shared by
+all of them which increments atomically, e.g. memcached, named by THROTTLE_CACHE.
+"""
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from functools import lru_cache
+from hashlib import blake2b
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+from tasks.metrics import registry
+
+RATE_PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    # the format of REST framework's throttles, e.g. '60/min' or '1000/day', returns (requests, seconds)
+    requests, period = rate.split('/')
+    return int(requests), RATE_PERIODS[period[0]]
+
+
+def counter_key(scope, kind, ident):
+    # hashed, the credentials of the client never end up in the cache, and short, since the cache checks keys
+    # character by character, which is most of the time it takes
+    return f'throttle:{scope}:{kind}:{blake2b(ident.encode(), digest_size=8).hexdigest()}'
+
+
+class CacheCounters:
+    """
+    The counters in a cache, "<key>:<window number>" for every window.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def hit(self, windows):
+        """
+        Counts a request in the current window of each (key, seconds, number) and returns the (previous, current)
+        numbers of requests of every key.
+        """
+        # the previous windows of all counters are read at once, a single round trip to the cache
+        previous = self.cache.get_many([f'{key}:{number - 1}' for key, _, number in windows])
+        return [(previous.get(f'{key}:{number - 1}', 0), self.increment(f'{key}:{number}', 2 * seconds))
+                for key, seconds, number in windows]
+
+    def increment(self, key, timeout):
+        try:
+            return self.cache.incr(key)
+        except ValueError:  # the first request of the window
+            if self.cache.add(key, 1, timeout):  # kept until it has been the previous window
+                return 1
+            return self.cache.incr(key)  # another worker has just added it
+
+    def undo(self, windows):
+        for key, _, number in windows:
+            try:
+                self.cache.decr(f'{key}:{number}')
+            except ValueError:  # expired in the meantime
+                pass
+
+
+class SharedMemoryCounters:
+    """
+    The counters in a file mapped in memory by every worker, a table of SLOTS slots of (key hash, window number,
+    requests of the previous window, requests of the current one). A key takes the first free or expired slot
+    among PROBES slots from the one its hash points to, and those are locked (fcntl, so across the processes)
+    while it's updated. The file is sparse, only the pages of the used slots take memory.
+    When all of them hold live counters of other keys, the request isn't limited, rather than rejecting a client
+    for the requests of others, and it's counted as throttle_slots_full in /metrics/.
+    """
+    SLOT = struct.Struct('=QqII')
+    SLOTS = 2 ** 18
+    PROBES = 8
+
+    def __init__(self, path):
+        import fcntl  # POSIX only, elsewhere THROTTLE_CACHE has to be set
+        self.fcntl = fcntl
+        self.lock = threading.Lock()  # fcntl locks only keep the other processes out, not the other threads
+        self.file = open(path, 'a+b')
+        size = self.SLOTS * self.SLOT.size
+        if os.fstat(self.file.fileno()).st_size < size:
+            self.file.truncate(size)  # every worker truncates to the same size, so whichever is first doesn't matter
+        self.memory = mmap.mmap(self.file.fileno(), size)
+
+    def hit(self, windows):
+        return [self.update(key, number, 1) for key, _, number in windows]
+
+    def undo(self, windows):
+        for key, _, number in windows:
+            self.update(key, number, -1)
+
+    def update(self, key, number, change):
+        key_hash = int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), 'little') or 1  # 0 is a free slot
+        first = key_hash % (self.SLOTS - self.PROBES)
+        offset, length = first * self.SLOT.size, self.PROBES * self.SLOT.size
+        with self.lock:
+            self.fcntl.lockf(self.file, self.fcntl.LOCK_EX, length, offset)
+            try:
+                free = None
+                for slot in range(offset, offset + length, self.SLOT.size):
+                    slot_hash, slot_number, previous, current = self.SLOT.unpack_from(self.memory, slot)
+                    if slot_hash == key_hash:
+                        break
+                    if free is None and (slot_hash == 0 or slot_number < number - 1):
+                        free = slot
+                else:
+                    if free is None or change < 0:
+                        if change > 0:
+                            registry.count('throttle_slots_full')
+                        return 0, 0  # the slots are taken by live counters of other keys, the request isn't limited
+                    slot, slot_number, previous, current = free, number, 0, 0
+                if slot_number < number:  # the first request of a new window
+                    previous, current = (current if slot_number == number - 1 else 0), 0
+                elif change < 0 and slot_number > number:
+                    return previous, current  # the window of the undone request is over
+                current = max(current + change, 0)
+                self.SLOT.pack_into(self.memory, slot, key_hash, max(slot_number, number), previous, current)
+                return previous, current
+            finally:
+                self.fcntl.lockf(self.file, self.fcntl.LOCK_UN, length, offset)
+
+
+shared_counters = {}  # per process and file, the mapping isn't inherited by forked workers
+
+
+def get_counters():
+    if settings.THROTTLE_CACHE:
+        return CacheCounters(caches[settings.THROTTLE_CACHE])
+    key = (os.getpid(), settings.THROTTLE_COUNTERS_PATH)
+    if key not in shared_counters:
+        shared_counters[key] = SharedMemoryCounters(settings.THROTTLE_COUNTERS_PATH)
+    return shared_counters[key]
+
+
+def seconds_until_allowed(before, current, limit, window, elapsed):
+    """
+    How long until a request fits in the sliding window again, given the requests of the previous fixed window,
+    the ones of the current window and the seconds elapsed since it started.
+    """
+    if limit < 1:  # e.g. '0/min' closes the view, nothing is ever allowed, the client may try again a window later
+        return window
+    if current < limit:  # the share of the previous window has to shrink, there is one since the request was rejected
+        return (1 - (limit - current - 1) / before) * window - elapsed
+    # only in the next window, where the requests of this one become the shrinking share
+    return window - elapsed + (1 - (limit - 1) / current) * window
+
+
+def throttle(counters, limits, now):
+    """
+    Counts a request with the limits, (key, limit, seconds) triples. Returns None if it's within every limit,
+    otherwise the seconds after which it would be allowed, a rejected request isn't counted.
+    """
+    windows = [(key, seconds, int(now // seconds)) for key, _, seconds in limits]
+    wait = 0
+    for (_, limit, seconds), (_, _, number), (before, current) in zip(limits, windows, counters.hit(windows)):
+        elapsed = now - number * seconds
+        if before * (1 - elapsed / seconds) + current > limit:
+            wait = max(wait, seconds_until_allowed(before, current - 1, limit, seconds, elapsed))
+    if not wait:
+        return None
+    counters.undo(windows)
+    return max(math.ceil(wait), 1)
+
+
+class VerifiedUserThrottle(BaseThrottle):
+    """
+    The 'user' limits of settings.THROTTLE_RATES, per URL name, for REST framework's DEFAULT_THROTTLE_CLASSES.
+    It runs after the authentication, so the counter is the one of the user's id, whatever their credentials.
+    """
+
+    def allow_request(self, request, view):
+        self.seconds = None
+        scope = getattr(request.resolver_match, 'url_name', None)
+        rate = settings.THROTTLE_RATES.get(scope, {}).get('user')
+        if not rate or not request.user.is_authenticated:
+            return True
+        self.seconds = throttle(get_counters(), [(counter_key(scope, 'user', str(request.user.pk)), *parse_rate(rate))],
+                                time.time())
+        return self.seconds is None
+
+    def wait(self):
+        return self.seconds
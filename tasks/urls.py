@@ -6,6 +6,10 @@ urlpatterns = format_suffix_patterns([
     path('', views.api_root),
     path('books/', views.BookList.as_view(), name='book-list'),
     path('accounts/', views.AccountList.as_view(), name='accounts-list'),
+    path('accounts/<int:pk>/operations/', views.AccountStatement.as_view(), name='account-statement'),
+    path('accounts/<int:pk>/summary/', views.AccountSummary.as_view(), name='account-summary'),
     path('login/', include('rest_framework.urls')),
     path('books/buy/', views.PurchaseCreate.as_view(), name='books-buy'),
+    path('books/buy/batch/', views.BatchPurchaseCreate.as_view(), name='books-buy-batch'),
+    path('metrics/', views.Metrics.as_view(), name='metrics'),
 ])
@@ -1,14 +1,41 @@
+import csv
+import json
+from decimal import Decimal
+
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.decorators import method_decorator
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
 from rest_framework import generics, status
 from rest_framework import permissions
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
-from tasks.models import Book, Account, Purchase, Operation
-from tasks.permissions import IsOwnerOrReadOnly
-from tasks.serializers import BookSerializer, AccountSerializer, PurchaseSerializer
+from tasks.caching import catalogue_cache
+from tasks.encoders import EncodedJSON, RowEncoder
+from tasks.filters import BookSearchFilter
+from tasks.idempotency import idempotent
+from tasks.metrics import format_prometheus, registry
+from tasks.models import Book, Account, Purchase, Operation, InsufficientFunds, OutOfStock, OutboxMessage, \
+    SpendingRollup
+from tasks.pagination import BookPagination, KeysetPagination
+from tasks.permissions import IsOwnerOrReadOnly, IsOwnerOrStaff, IsStaffOrMetricsScraper
+from tasks.prices import StalePrices, check_version
+from tasks.renderers import LIST_RENDERERS, CSVStatementRenderer, JSONLinesStatementRenderer, MessagePackRenderer, \
+    PreEncodedJSONRenderer, PrometheusRenderer
+from tasks.routers import read_from_replica
+from tasks.serializers import BookSerializer, AccountSerializer, PurchaseSerializer, BatchPurchaseSerializer, \
+    SpendingRollupSerializer, out_of_stock_messages
+
+INSUFFICIENT_FUNDS_MESSAGE = 'Cannot perform such operation, since the funds are insufficient'
+PRICES_CHANGED_MESSAGE = 'The prices of the books keep changing, please try again'
 
 
+@catalogue_cache
 @api_view(['GET'])
 def api_root(request, format=None):  # root of our API offers everything the API has to offer to a normal user
     # the login page is available in the upper right corner
@@ -19,17 +46,120 @@ def api_root(request, format=None):  # root of our API offers everything the API
     })
 
 
+# the most SQL queries a request may run, see tasks/tests/benchmarks/bench_endpoints.py
+api_root.query_budget = 0
+
+
+class FastListMixin:
+    """
+    List views with a fast path for plain JSON and MessagePack responses: the rows are fetched as tuples with
+    values_list() and encoded by a RowEncoder built from the serializer, so no model instance or serializer is
+    created per row. The output is byte for byte the one of the serializer. The browsable API still goes through
+    the serializer.
+    Both paths take ?fields=id,title, which narrows the SELECT as well as the JSON.
+    """
+    renderer_classes = LIST_RENDERERS
+    fields_query_param = 'fields'
+    row_encoders = {}  # per serializer class and fields, the fields of the serializer are only looked at once
+
+    def get_sparse_fields(self):
+        if self.request.method != 'GET':  # a form or a created object always has all the fields
+            return None
+        fields = self.request.query_params.get(self.fields_query_param)
+        if fields is None:
+            return None
+        return frozenset(name.strip() for name in fields.split(',') if name.strip())
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_sparse_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_row_encoder(self):
+        key = self.get_serializer_class(), self.get_sparse_fields()
+        if key not in self.row_encoders:
+            self.row_encoders[key] = RowEncoder(key[0], fields=key[1])  # raises a ValidationError for unknown fields
+        return self.row_encoders[key]
+
+    def get_columns(self, sources):
+        # the paginator reads the ordering key of every row, so it's fetched even when ?fields= leaves it out
+        key_fields = self.paginator.get_key_fields(self.request) if self.paginator is not None else []
+        return [*sources, *(field for field in key_fields if field not in sources)]
+
+    def is_fast_path_possible(self, request):
+        renderer = request.accepted_renderer
+        if isinstance(renderer, MessagePackRenderer):
+            return True
+        # an indented response (e.g. Accept: application/json; indent=4) is left to the renderer
+        return isinstance(renderer, PreEncodedJSONRenderer) and \
+            not renderer.get_indent(request.accepted_media_type, self.get_renderer_context())
+
+    def list(self, request, *args, **kwargs):
+        encoder = self.get_row_encoder()
+        columns = self.get_columns(encoder.sources)
+        queryset = self.filter_queryset(self.get_queryset())
+        if not self.is_fast_path_possible(request):
+            page = self.paginate_queryset(queryset.only(*columns))
+            if page is not None:
+                return self.get_paginated_response(self.get_serializer(page, many=True).data)
+            return Response(self.get_serializer(queryset.only(*columns), many=True).data)
+        queryset = queryset.values_list(*columns, named=True)
+        page = self.paginate_queryset(queryset)
+        if isinstance(request.accepted_renderer, MessagePackRenderer):  # the rows as data, for the renderer
+            if page is not None:
+                return self.get_paginated_response(encoder.represent_rows(page))
+            return Response(encoder.represent_rows(queryset))
+        if page is not None:
+            return self.paginator.get_encoded_paginated_response(encoder.encode_rows(page))
+        return Response(EncodedJSON(encoder.encode_rows(queryset)))
+
+
+class ReplicaReadMixin:
+    """
+    Reads of GET, HEAD and OPTIONS requests go to a read replica, once the user is authenticated and allowed in
+    (those two are read from the primary). See tasks.routers.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in permissions.SAFE_METHODS:
+            read_from_replica(request.user)
+
+
 # using ListAPIView from generics for both views because it simplifies view creation immensely
-class BookList(generics.ListAPIView):
+# read from the primary: a lagging replica would put the previous catalogue in the cache under the new version
+@method_decorator(catalogue_cache, name='dispatch')
+class BookList(FastListMixin, generics.ListAPIView):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
+    pagination_class = BookPagination  # ?ordering=id|price|title (or -id, ...), pages are followed with ?cursor=
+    filter_backends = [BookSearchFilter]  # ?title=, ?search=, ?min_price=, ?max_price=
+    query_budget = 1  # the page, its links come from the rows themselves
 
 
-class AccountList(generics.ListCreateAPIView):
+class AccountList(ReplicaReadMixin, FastListMixin, generics.ListCreateAPIView):
+    """
+    All the accounts, or with ?owner=me only the one of the logged in user. That list is paginated
+    (pages are followed with ?cursor=) and read through the owner index instead of the whole table.
+    """
     permission_classes = [permissions.IsAuthenticated,
                           IsOwnerOrReadOnly]
     queryset = Account.objects.all()
     serializer_class = AccountSerializer
+    pagination_class = KeysetPagination
+    query_budget = 1
+
+    def is_scoped_to_user(self):
+        return self.request.query_params.get('owner') == 'me'
+
+    def get_queryset(self):
+        if self.is_scoped_to_user():
+            return Account.objects.filter(owner=self.request.user)
+        return super().get_queryset()
+
+    @property
+    def paginator(self):
+        # the list of all the accounts stays the single unpaginated response it has always been
+        return super().paginator if self.is_scoped_to_user() else None
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
@@ -37,31 +167,194 @@ class AccountList(generics.ListCreateAPIView):
 
 class PurchaseCreate(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 16  # whatever the size of the cart, savepoints, the stock and the outbox message included
+    quote_attempts = 3
 
+    @idempotent  # a retry with the same Idempotency-Key header gets the first response, without a second charge
     def post(self, request, format=None):
-        current_account = Account.objects.filter(owner=request.user).first()
-        # we got the account associated with current user
-        received_data = request.data
-        received_data.update({'account': current_account.pk})  # passing the account's primary field to data
-        received_data.update({'operation': None})  # the operation is created in the model, so it needn't be passed
-        serializer = PurchaseSerializer(data=received_data)
+        for _ in range(self.quote_attempts):
+            try:
+                return self.purchase(request)
+            except StalePrices:  # a price changed since the cart was priced, nothing was saved, it's priced again
+                continue
+        return Response(PRICES_CHANGED_MESSAGE, status=status.HTTP_409_CONFLICT)
+
+    def purchase(self, request):
+        current_account = self.get_account(request)
+        serializer = PurchaseSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)  # if the data is invalid, it'll raise exception on the user's end
-        books_id_list = received_data['books']
-        books, transaction_price = Purchase.collect_books_and_return_purchase_cost(books_id_list)
-        if Purchase.is_transaction_possible(current_account.balance, transaction_price):
-            model_object = serializer.save()  # save the model object for now
-            for book in books:
-                model_object.books.add(book)
-            model_object.operation = Operation.objects.create(account=current_account,
-                                                              balance_change=-transaction_price)
-            model_object.save()  # to reflect the changes, we need to save the object
-        else:
-            return Response('Cannot perform such operation, since the funds are insufficient',
-                            status=status.HTTP_400_BAD_REQUEST)
-        # it won't create a new operation again, just change the current operation's balance
+        books_id_list = serializer.validated_data['books']
+        transaction_price = serializer.purchase_cost  # the cart was priced during validation, by the price index
+        # the balance of an account known from the token isn't read, the purchase itself checks it anyway
+        if current_account.balance is not None and \
+                not Purchase.is_transaction_possible(current_account.balance, transaction_price):
+            return Response(INSUFFICIENT_FUNDS_MESSAGE, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with transaction.atomic():  # the purchase, its books and the operation are saved together or not at all
+                model_object = serializer.save(account=current_account)
+                model_object.operation = Operation.objects.create(account=current_account,
+                                                                  balance_change=-transaction_price)
+                model_object.save(update_fields=['operation'])  # to reflect the changes, we need to save the object
+                # handled later by the outbox worker, so the response doesn't wait for e-mails and the like
+                OutboxMessage.publish(OutboxMessage.PURCHASE_CREATED,
+                                      [model_object.outbox_payload(serializer.quantities, transaction_price)])
+                # last, so the rows of the popular limited editions are locked for as short as possible
+                Book.take_from_stock(serializer.limited_quantities)
+                check_version(serializer.catalogue_version)  # the prices charged are still the current ones
+        except InsufficientFunds:  # another request has spent the funds since the balance above was read
+            return Response(INSUFFICIENT_FUNDS_MESSAGE, status=status.HTTP_400_BAD_REQUEST)
+        except OutOfStock as error:  # other requests have bought the last copies since the cart was validated
+            return Response({'books': out_of_stock_messages(error)}, status=status.HTTP_400_BAD_REQUEST)
         returned_data = [books_id_list, transaction_price]
         return Response(returned_data, status=status.HTTP_201_CREATED)
 
+    @staticmethod
+    def get_account(request):
+        account_id = getattr(request.auth, 'account_id', None)
+        if account_id is not None:  # cached with the token, see tasks.authentication
+            return Account(pk=account_id, owner=request.user, balance=None)
+        return Account.objects.filter(owner=request.user).first()  # we got the account associated with current user
+
     def get(self, request, format=None):
         message = 'Please input books in format: {"books": [a,b,...]"}, where a,b,... are the IDs of books to purhcase'
         return Response(message, status.HTTP_204_NO_CONTENT)
+
+
+class BatchPurchaseCreate(APIView):
+    """
+    Places the orders of many accounts in one request: {"orders": [{"account": 1, "books": [1, 2]}, ...]}.
+    Meant for backends ordering on behalf of their users, so it's limited to staff members.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    query_budget = 18  # whatever the number of orders, SQLite splits the rollups of 100 accounts in two INSERTs
+
+    @idempotent
+    def post(self, request, format=None):
+        serializer = BatchPurchaseSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        orders = [(order['account'], order['books']) for order in serializer.validated_data['orders']]
+        return Response({'results': Purchase.purchase_in_bulk(orders)}, status=status.HTTP_200_OK)
+
+
+class Echo:
+    """
+    File-like object for csv.writer, which hands each written row back instead of keeping it.
+    """
+
+    def write(self, value):
+        return value
+
+
+class AccountStatement(APIView):
+    """
+    Streams the whole operation history of an account as CSV (the default) or JSON lines,
+    e.g. /accounts/1/operations.jsonl?since=2021-01-01&until=2021-02-01 (until is exclusive).
+    The rows are read in chunks and written out one by one, so the memory used doesn't depend on the history size.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsOwnerOrStaff]
+    query_budget = 2  # whatever the length of the history
+    renderer_classes = [CSVStatementRenderer, JSONLinesStatementRenderer]
+    columns = ('id', 'created', 'operation_type', 'balance_change')
+    chunk_size = 2000
+
+    def get(self, request, pk, format=None):
+        account = get_object_or_404(Account, pk=pk)
+        self.check_object_permissions(request, account)
+        operations = Operation.objects.filter(account=account)  # served by the (account, created, id) index
+        since, until = self.get_datetime('since'), self.get_datetime('until')
+        if since is not None:
+            operations = operations.filter(created__gte=since)
+        if until is not None:
+            operations = operations.filter(created__lt=until)
+        # iterator() uses a server-side cursor on PostgreSQL and fetches the rows in chunks on SQLite
+        rows = operations.order_by('created', 'id').values_list(*self.columns).iterator(chunk_size=self.chunk_size)
+
+        renderer = request.accepted_renderer
+        lines = self.csv_lines(rows) if renderer.format == 'csv' else self.json_lines(rows)
+        response = StreamingHttpResponse(lines, content_type=f'{renderer.media_type}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="account-{account.pk}-operations.{renderer.format}"'
+        return response
+
+    def get_datetime(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            moment = parse_datetime(value)
+            if moment is None:  # a plain date means its midnight
+                date = parse_date(value)
+                moment = date and timezone.datetime(date.year, date.month, date.day)
+        except ValueError:
+            moment = None
+        if moment is None:
+            raise ValidationError({name: ['Use the YYYY-MM-DD or YYYY-MM-DDThh:mm[:ss] format.']})
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment, timezone.utc)
+        return moment
+
+    def csv_lines(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.columns)
+        for operation_id, created, operation_type, balance_change in rows:
+            yield writer.writerow((operation_id, created.isoformat(), operation_type, balance_change))
+
+    def json_lines(self, rows):
+        for operation_id, created, operation_type, balance_change in rows:
+            # the amount is a string, just like in the rest of the API, so no cent is lost to a float
+            yield json.dumps({'id': operation_id, 'created': created.isoformat(), 'operation_type': operation_type,
+                              'balance_change': str(balance_change)}) + '\n'
+
+
+class AccountSummary(APIView):
+    """
+    Deposits and spending of an account per month (the default) or per day, with the totals of the range,
+    e.g. /accounts/1/summary/?period=day&since=2021-01-01&until=2021-02-01 (until is exclusive).
+    Read from the rollups, a row per period, so it costs the same however long the ledger is.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsOwnerOrStaff]
+    query_budget = 2
+
+    def get(self, request, pk, format=None):
+        account = get_object_or_404(Account, pk=pk)
+        self.check_object_permissions(request, account)
+        period = request.query_params.get('period', SpendingRollup.Periods.month)
+        if period not in SpendingRollup.Periods.values:
+            raise ValidationError({'period': [f'Use one of: {", ".join(SpendingRollup.Periods.values)}.']})
+        rollups = SpendingRollup.objects.filter(account=account, period=period)
+        since, until = self.get_date('since'), self.get_date('until')
+        if since is not None:
+            rollups = rollups.filter(period_start__gte=since)
+        if until is not None:
+            rollups = rollups.filter(period_start__lt=until)
+        results = SpendingRollupSerializer(rollups.order_by('period_start'), many=True).data
+        return Response({
+            'account': account.pk,
+            'period': period,
+            'deposited': str(sum((Decimal(row['deposited']) for row in results), Decimal('0.00'))),
+            'spent': str(sum((Decimal(row['spent']) for row in results), Decimal('0.00'))),
+            'results': results,
+        })
+
+    def get_date(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            date = parse_date(value)
+        except ValueError:
+            date = None
+        if date is None:
+            raise ValidationError({name: ['Use the YYYY-MM-DD format.']})
+        return date
+
+
+class Metrics(APIView):
+    """
+    Latency, SQL queries and response sizes per view, of all the workers, in the Prometheus text format.
+    """
+    permission_classes = [IsStaffOrMetricsScraper]
+    query_budget = 0
+    renderer_classes = [PrometheusRenderer]
+
+    def get(self, request, format=None):
+        return Response(format_prometheus(registry.collect()))